@@ -0,0 +1,145 @@
+"""
+Admission control: deciding up front which requests the server takes on.
+
+Under a burst the cheapest useful answer is a fast refusal. A request that
+would wait behind hundreds of others gets a 503 with Retry-After straight
+away, rather than an answer long after its client gave up. Three limits apply
+before a request runs:
+
+- RateLimiter: a token bucket per client address; a client over its rate gets 429
+- ConcurrencyLimiter: at most max_active requests run at once, and at most
+  max_waiting more wait (for at most `timeout` seconds) for one to finish;
+  anything beyond that gets 503
+- a cap on the request body size (413), checked in the handler
+
+Engines that queue connections before a handler runs (the worker pool, the
+asyncio executor) bound that queue as well and answer past it with
+OVERLOADED_RESPONSE.
+"""
+import json
+import math
+import socket
+import threading
+import time
+
+# Seconds a 503 tells clients to wait before retrying
+DEFAULT_RETRY_AFTER = 1
+
+
+def retry_after_header(seconds):
+    """Returns: the Retry-After value for a delay, in whole seconds (at least 1)"""
+    return str(max(1, math.ceil(seconds)))
+
+
+def overloaded_response(retry_after=DEFAULT_RETRY_AFTER):
+    """Returns: a complete 503 response, for turning a connection away before any handler sees it"""
+    body = json.dumps({"error": "Server is overloaded, retry later"}).encode()
+    return (b"HTTP/1.1 503 Service Unavailable\r\n"
+            b"Content-Type: application/json\r\n"
+            b"Content-Length: %d\r\n"
+            b"Retry-After: %s\r\n"
+            b"Connection: close\r\n\r\n%s" % (len(body), retry_after_header(retry_after).encode(), body))
+
+
+def reject_connection(sock, response, timeout=0.1):
+    """
+    Answers a just-accepted connection with response and closes it.
+    The request is read first (as far as it arrives within timeout), because
+    closing a socket with unread data resets the connection, and the client
+    could lose the response with it.
+    """
+    try:
+        sock.settimeout(timeout)
+        try:
+            sock.recv(65536)
+        except socket.timeout:
+            pass
+        sock.sendall(response)
+        sock.shutdown(socket.SHUT_WR)
+    except OSError:
+        pass
+    finally:
+        sock.close()
+
+
+class RateLimiter:
+    """
+    Token bucket per client: `rate` requests a second on average, with bursts
+    of up to `burst`. At most max_clients buckets are kept; idle ones (full
+    again by now) are dropped first.
+    """
+
+    def __init__(self, rate, burst, max_clients=10000):
+        if rate <= 0 or burst < 1:
+            raise ValueError("Rate limit needs a positive rate and a burst of at least 1")
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def check(self, client):
+        """
+        Takes a token from the client's bucket.
+        Returns: 0 if the request may go ahead, else the seconds until it may
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                self._buckets[client] = (tokens - 1, now)
+                wait = 0
+            else:
+                self._buckets[client] = (tokens, now)
+                wait = (1 - tokens) / self.rate
+            if len(self._buckets) > self.max_clients:
+                self._prune(now)
+            return wait
+
+    def _prune(self, now):
+        # Buckets are kept in order of last use (check re-inserts them)
+        full_after = self.burst / self.rate
+        for client, (_, last) in list(self._buckets.items()):
+            if len(self._buckets) <= self.max_clients // 2 or now - last < full_after:
+                break
+            del self._buckets[client]
+        while len(self._buckets) > self.max_clients:
+            del self._buckets[next(iter(self._buckets))]
+
+
+class ConcurrencyLimiter:
+    """
+    Lets at most max_active requests run at once (0 means no limit). Up to
+    max_waiting more may wait, for at most timeout seconds, for a slot.
+    """
+
+    def __init__(self, max_active, max_waiting, timeout):
+        self.max_active = max_active
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def enter(self):
+        """Returns: True once the request has a slot, False if it is turned away"""
+        with self._cond:
+            if self.max_active <= 0 or (self.active < self.max_active and not self.waiting):
+                self.active += 1
+                return True
+            if self.waiting >= self.max_waiting:
+                return False
+            self.waiting += 1
+            try:
+                admitted = self._cond.wait_for(lambda: self.active < self.max_active, self.timeout)
+            finally:
+                self.waiting -= 1
+            if admitted:
+                self.active += 1
+            return admitted
+
+    def leave(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
@@ -0,0 +1,177 @@
+"""
+asyncio engine for the todo server.
+
+The event loop owns every connection, so thousands of idle keep-alive clients
+cost a socket each but no thread. Once a complete request has arrived it is
+handed to the regular request handler class on a worker thread. That keeps the
+routes, the JSON contract and the validation identical to the threaded engines,
+and keeps blocking work such as saving todos off the event loop.
+"""
+import asyncio
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Largest request line plus headers we accept
+MAX_HEADER_BYTES = 64 * 1024
+
+
+def content_length(head):
+    """Returns: the Content-Length declared in a raw request head (0 if absent or invalid)"""
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"content-length":
+            try:
+                return max(int(value.strip()), 0)
+            except ValueError:
+                return 0
+    return 0
+
+
+class LoopWriter(io.RawIOBase):
+    """
+    wfile for a handler running on a worker thread.
+    Every write is passed to the event loop and waits until the socket drained it,
+    so a slow client applies backpressure to the handler instead of buffering.
+    """
+
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        asyncio.run_coroutine_threadsafe(self._send(data), self.loop).result()
+        return len(data)
+
+    async def _send(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+
+class AsyncHTTPServer:
+    """
+    asyncio HTTP server with the same surface as the socketserver based servers
+    (server_address, serve_forever, shutdown, server_close), so it can be picked
+    as just another engine.
+
+    Once max_pending requests are queued for a worker (0 means no limit), a new
+    request is answered with overload_response and its connection closed.
+    A body over max_body_bytes is left unread for the handler to refuse.
+    """
+
+    def __init__(self, server_address, handler_class, workers=16, idle_timeout=60, max_pending=0,
+                 max_body_bytes=None, overload_response=None, on_reject=None):
+        self.handler_class = handler_class
+        self.idle_timeout = idle_timeout
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_body_bytes = max_body_bytes
+        self.overload_response = overload_response
+        self.on_reject = on_reject
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.connections = set()
+        self.in_flight = set()
+        self.started = threading.Event()
+        self.stopped = threading.Event()
+
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(asyncio.start_server(
+            self.handle_connection, *server_address, limit=MAX_HEADER_BYTES))
+        self.server_address = self.server.sockets[0].getsockname()[:2]
+
+    def serve_forever(self):
+        asyncio.set_event_loop(self.loop)
+        self.stopped.clear()
+        self.started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.stopped.set()
+
+    def shutdown(self):
+        """
+        Stops serve_forever and, like socketserver's, waits until it has returned.
+        Called before serve_forever has started, it waits for it to start (and
+        stop again at once), so server_close() never finds the loop running.
+        """
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.started.wait()
+        self.stopped.wait()
+
+    def server_close(self):
+        self.loop.run_until_complete(self._close())
+        self.executor.shutdown(wait=False)
+        self.loop.close()
+
+    async def _close(self):
+        """Stops accepting, lets in-flight requests finish and closes every connection."""
+        self.server.close()
+        if self.in_flight:
+            await asyncio.wait(self.in_flight, timeout=10)
+        for writer in list(self.connections):
+            writer.close()
+        await self.server.wait_closed()
+
+        pending = asyncio.all_tasks() - {asyncio.current_task()}
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    async def handle_connection(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        client_address = writer.get_extra_info("peername")
+        wfile = LoopWriter(loop, writer)
+        self.connections.add(writer)
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.idle_timeout)
+                    length = content_length(head)
+                    if self.max_body_bytes is not None and length > self.max_body_bytes:
+                        length = 0
+                    body = await reader.readexactly(length)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                    # Client went away, sent oversized headers or stayed idle too long
+                    break
+
+                if self.max_pending and len(self.in_flight) >= self.workers + self.max_pending:
+                    if self.on_reject is not None:
+                        self.on_reject()
+                    writer.write(self.overload_response)
+                    await writer.drain()
+                    break
+
+                future = loop.run_in_executor(
+                    self.executor, self.run_handler, head + body, client_address, wfile)
+                self.in_flight.add(future)
+                try:
+                    handler = await future
+                finally:
+                    self.in_flight.discard(future)
+
+                if handler.close_connection:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    def run_handler(self, raw_request, client_address, wfile):
+        """Runs one request through the handler class on a worker thread."""
+        handler = self.handler_class.__new__(self.handler_class)
+        handler.server = self
+        handler.client_address = client_address
+        handler.rfile = io.BytesIO(raw_request)
+        handler.wfile = wfile
+        handler.close_connection = True
+        handler.handle_one_request()
+        return handler
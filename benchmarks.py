@@ -0,0 +1,427 @@
+"""
+Micro-benchmarks for the todo store.
+
+    python benchmarks.py indexes [--items 1000000]
+    python benchmarks.py memory [--items 100000 1000000]
+    python benchmarks.py keepalive [--items 20000]
+    python benchmarks.py startup [--items 1000000]
+    python benchmarks.py validation [--items 100000]
+    python benchmarks.py shards [--items 20000]
+    python benchmarks.py serialize [--items 100000]
+
+Each benchmark prints one line per case with the best of a few runs.
+"""
+import argparse
+import gc
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+
+from codec import STDLIB, make_orjson_codec
+from compact import CompactTodoStore
+from indexes import is_completed, todo_tokens, tokenize
+from loader import read_todos
+from persistence import write_file_atomically
+from sharded import ShardedTodoStore, load_shards, shard_path
+from snapshot import load_snapshot, write_snapshot
+from store import TodoStore, index_todos
+from validation import todo_validator, update_validator
+
+LAYOUTS = {"dict": TodoStore, "compact": CompactTodoStore}
+
+WORDS = ["buy", "milk", "call", "mom", "fix", "bug", "write", "report", "walk", "dog",
+         "pay", "rent", "book", "flight", "clean", "kitchen", "review", "pull", "request", "plan"]
+
+
+def iter_todos(count, seed=0, completed_ratio=0.05):
+    """Yields count todos with random short tasks, a few of them completed"""
+    rng = random.Random(seed)
+    for todo_id in range(1, count + 1):
+        item = {"id": todo_id, "task": " ".join(rng.sample(WORDS, 3)),
+                "completed": rng.random() < completed_ratio}
+        if todo_id % 1000 == 0:
+            item["description"] = "quarterly audit"
+        yield item
+
+
+def make_todos(count, **kwargs):
+    """Returns: dict of id -> todo, see iter_todos"""
+    return {item["id"]: item for item in iter_todos(count, **kwargs)}
+
+
+def best_of(func, repeat=3):
+    """Returns: the fastest of repeat runs of func, in seconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def report(name, seconds, baseline=None, baseline_name="a scan"):
+    line = f"{name:<40} {seconds * 1000:10.2f} ms"
+    if baseline is not None and seconds <= baseline:
+        line += f"   {baseline / seconds:8.1f}x faster than {baseline_name}"
+    elif baseline is not None:
+        line += f"   {seconds / baseline:8.1f}x slower than {baseline_name}"
+    print(line)
+
+
+def bench_indexes(count):
+    todo = make_todos(count)
+    store = TodoStore(todo)
+    start = time.perf_counter()
+    store.indexes
+    report(f"build indexes ({count} todos)", time.perf_counter() - start)
+
+    def scan(completed=None, query=None, limit=None):
+        terms = tokenize(query) if query is not None else None
+        found = []
+        for item in todo.values():
+            if completed is not None and is_completed(item) != completed:
+                continue
+            if terms is None or terms <= todo_tokens(item):
+                found.append(item)
+                if limit is not None and len(found) == limit:
+                    break
+        return found
+
+    cases = [
+        ("completed=true", {"completed": True}),
+        ("completed=true&limit=100", {"completed": True, "limit": 100}),
+        ("completed=false&limit=100", {"completed": False, "limit": 100}),
+        ("q=audit (rare word)", {"query": "audit"}),
+        ("q=milk (common word)&limit=100", {"query": "milk", "limit": 100}),
+        ("q=buy milk", {"query": "buy milk"}),
+        ("q=buy milk&completed=true", {"query": "buy milk", "completed": True}),
+    ]
+    for name, params in cases:
+        limit = params.pop("limit", None)
+        assert store.page(limit, **params)[0] == scan(limit=limit, **params)
+        scanned = best_of(lambda: scan(limit=limit, **params))
+        indexed = best_of(lambda: store.page(limit, **params))
+        report(f"scan    {name}", scanned)
+        report(f"indexed {name}", indexed, scanned)
+
+
+def rss_bytes():
+    """Returns: the resident set size of this process (Linux), in bytes"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    raise RuntimeError("VmRSS not found")
+
+
+def measure_layout(layout, count):
+    """Runs in a fresh process. Returns: dict of memory and access timings for one layout"""
+    # Filled one todo at a time, as a running server would be, so memory freed
+    # along the way doesn't linger in the allocator and blur the comparison
+    gc.collect()
+    before = rss_bytes()
+    store = LAYOUTS[layout]()
+    for item in iter_todos(count):
+        store.add(item)
+    gc.collect()
+    rss = rss_bytes() - before
+
+    rng = random.Random(1)
+    ids = [rng.randint(1, count) for _ in range(100_000)]
+    return {
+        "rss": rss,
+        "get": best_of(lambda: [store.get(todo_id) for todo_id in ids]) / len(ids),
+        "page": best_of(lambda: [store.page(100, after=todo_id) for todo_id in ids[:1000]]) / 1000,
+        "all": best_of(store.all),
+    }
+
+
+def bench_memory(count):
+    # Each layout is measured in a process of its own, so RSS isn't shared
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for layout in LAYOUTS:
+        with context.Pool(1) as pool:
+            results[layout] = pool.apply(measure_layout, (layout, count))
+
+    for layout, result in results.items():
+        print(f"{layout:<8} {count:>9} todos   RSS {result['rss'] / 2**20:8.1f} MiB "
+              f"({result['rss'] / count:6.0f} B/todo)   get {result['get'] * 1e6:6.2f} us   "
+              f"page(100) {result['page'] * 1e6:7.1f} us   all() {result['all'] * 1000:8.1f} ms")
+    print(f"compact uses {results['compact']['rss'] / results['dict']['rss']:.0%} of the dict layout's memory")
+
+
+def start_server(engine, todo):
+    """Returns: a server for engine answering from todo, running on a thread, with logging off"""
+    os.environ.setdefault("TODO_FILE", os.path.join(tempfile.mkdtemp(), "todos.json"))
+    import server
+
+    server.store = CompactTodoStore(todo)
+    server.ToDoHandler.log_message = lambda handler, format, *args: None
+    httpd = server.make_server(("localhost", 0), engine=engine)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def run_clients(client, requests, clients=4):
+    """Runs client(count) on several threads. Returns: requests per second"""
+    threads = [threading.Thread(target=client, args=(requests // clients,)) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return requests // clients * clients / (time.perf_counter() - start)
+
+
+def bench_keepalive(count, pipeline_depth=16):
+    address = None
+    request = b"GET /todo/id/1 HTTP/1.1\r\nHost: localhost\r\n\r\n"
+
+    def new_connection_per_request(requests):
+        for _ in range(requests):
+            conn = http.client.HTTPConnection(*address)
+            conn.request("GET", "/todo/id/1")
+            conn.getresponse().read()
+            conn.close()
+
+    def reused_connection(requests):
+        conn = http.client.HTTPConnection(*address)
+        for _ in range(requests):
+            conn.request("GET", "/todo/id/1")
+            conn.getresponse().read()
+        conn.close()
+
+    def pipelined(requests):
+        with socket.create_connection(address) as sock:
+            rfile = sock.makefile("rb")
+            for _ in range(requests // pipeline_depth):
+                sock.sendall(request * pipeline_depth)
+                for _ in range(pipeline_depth):
+                    length = 0
+                    while True:
+                        line = rfile.readline()
+                        if line.lower().startswith(b"content-length:"):
+                            length = int(line.split(b":")[1])
+                        elif line == b"\r\n":
+                            break
+                    rfile.read(length)
+
+    for engine in ("threaded", "asyncio"):
+        httpd = start_server(engine, make_todos(100))
+        address = httpd.server_address[:2]
+        try:
+            for name, client in (("new connection per request", new_connection_per_request),
+                                 ("one kept-alive connection", reused_connection),
+                                 (f"pipelined, {pipeline_depth} deep", pipelined)):
+                print(f"{engine:<9} {name:<28} {run_clients(client, count):8.0f} req/s")
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+
+def bench_startup(count):
+    with tempfile.TemporaryDirectory() as workdir:
+        json_path = os.path.join(workdir, "todos.json")
+        snapshot_path = os.path.join(workdir, "todos.snap")
+        items = list(iter_todos(count))
+        with open(json_path, "w") as f:
+            json.dump(items, f, indent=2)
+        write_snapshot(snapshot_path, items)
+        del items
+
+        def from_json():
+            return CompactTodoStore(index_todos(read_todos(json_path)))
+
+        def from_snapshot():
+            return TodoStore(load_snapshot(snapshot_path))
+
+        loaded = best_of(from_json, repeat=1)
+        opened = best_of(from_snapshot)
+        report(f"load JSON file ({count} todos)", loaded)
+        report(f"open snapshot ({count} todos)", opened)
+
+        store = from_snapshot()
+        rng = random.Random(1)
+        ids = [rng.randint(1, count) for _ in range(10_000)]
+        report("first get of 10000 todos from snapshot", best_of(lambda: [store.get(i) for i in ids], repeat=1))
+        report("decode the rest of the snapshot", best_of(store.all, repeat=1))
+
+
+def handwritten_validate_todo(data):
+    """The POST validator as it was written by hand before validation.py, for comparison"""
+    if not isinstance(data, dict):
+        return (False, "Todo must be a JSON object")
+    if 'task' not in data:
+        return (False, "Task field is required")
+    if not isinstance(data['task'], str):
+        return (False, "Task must be a string")
+    task = data['task'].strip()
+    if len(task) == 0:
+        return (False, "Task cannot be empty or whitespace")
+    if len(task) > 500:
+        return (False, "Task is too long (maximum 500 characters)")
+    if 'completed' in data:
+        if not isinstance(data['completed'], bool):
+            return (False, "Completed field must be a boolean (true/false)")
+    if 'description' in data:
+        if not isinstance(data['description'], str):
+            return (False, "Description must be a string")
+        if len(data['description']) > 1000:
+            return (False, "Description is too long (maximum 1000 characters)")
+    return (True, None)
+
+
+def handwritten_validate_update(data):
+    """The PUT validator as it was written by hand before validation.py, for comparison"""
+    if not isinstance(data, dict):
+        return (False, "Todo must be a JSON object")
+    if len(data) == 0:
+        return (False, "At least one field must be provided for update")
+    if 'task' in data:
+        if not isinstance(data['task'], str):
+            return (False, "Task must be a string")
+        task = data['task'].strip()
+        if len(task) == 0:
+            return (False, "Task cannot be empty or whitespace")
+        if len(task) > 500:
+            return (False, "Task is too long (maximum 500 characters)")
+    if 'completed' in data:
+        if not isinstance(data['completed'], bool):
+            return (False, "Completed field must be a boolean (true/false)")
+    if 'description' in data:
+        if not isinstance(data['description'], str):
+            return (False, "Description must be a string")
+        if len(data['description']) > 1000:
+            return (False, "Description is too long (maximum 1000 characters)")
+    return (True, None)
+
+
+def bench_validation(count):
+    # New todos as a batch would send them (one in 20 of them invalid), and updates
+    items = [{"task": item["task"], "completed": item["completed"]} for item in iter_todos(count)]
+    for item in items[::20]:
+        item["completed"] = "yes"
+    updates = [{"completed": True} if position % 2 else {"task": item["task"]}
+               for position, item in enumerate(items)]
+    expected = [handwritten_validate_todo(item)[1] for item in items]
+    assert [todo_validator.first_error(item) for item in items] == expected
+    assert todo_validator.first_error_each(items) == expected
+
+    # As in timeit: collections triggered by the results would scan every todo in the lists
+    gc.disable()
+    try:
+        compare_validators(count, items, updates)
+    finally:
+        gc.enable()
+
+
+def compare_validators(count, items, updates):
+    for name, handwritten, validator, data in (("todos", handwritten_validate_todo, todo_validator, items),
+                                               ("updates", handwritten_validate_update, update_validator, updates)):
+        # Each run is short, so more of them even out a noisy machine
+        baseline = best_of(lambda: [handwritten(item) for item in data], repeat=15)
+        report(f"hand-written, {count} {name}", baseline)
+        report(f"compiled first_error, {count} {name}",
+               best_of(lambda: [validator.first_error(item) for item in data], repeat=15), baseline, "hand-written")
+        report(f"compiled first_error_each, {count} {name}",
+               best_of(lambda: validator.first_error_each(data), repeat=15), baseline, "hand-written")
+        report(f"compiled errors_each, {count} {name}",
+               best_of(lambda: validator.errors_each(data), repeat=15), baseline, "hand-written")
+
+
+def bench_shards(count, writes=100, writers=8):
+    # Updates from several threads, each saved the way the json mode saves it:
+    # the whole file (of its shard) rewritten and fsynced
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "todos.json")
+        baseline = None
+        for shards in (1, 2, 4, 8):
+            parts = [{} for _ in range(shards)]
+            for todo_id, item in make_todos(count).items():
+                parts[todo_id % shards][todo_id] = item
+            store = ShardedTodoStore(
+                CompactTodoStore(part, on_change=lambda records, index=index: write_file_atomically(
+                    shard_path(path, index), json.dumps(store.shards[index].snapshot(), indent=2).encode()))
+                for index, part in enumerate(parts))
+            rng = random.Random(shards)
+            ids = [rng.randint(1, count) for _ in range(writes)]
+
+            def update(worker):
+                for todo_id in ids[worker::writers]:
+                    store.update(todo_id, {"completed": True})
+
+            def run():
+                threads = [threading.Thread(target=update, args=(worker,)) for worker in range(writers)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+
+            seconds = best_of(run, repeat=1)
+            report(f"{writes} updates, {shards} shard(s) ({writes / seconds:.0f}/s)", seconds, baseline, "1 shard")
+            baseline = baseline or seconds
+
+            # Shard files are read in loader processes (when there is more than one CPU)
+            report(f"load {count} todos from {shards} shard file(s)",
+                   best_of(lambda: load_shards(path, shards), repeat=1))
+            for index in range(shards):
+                os.remove(shard_path(path, index))
+
+
+def bench_serialize(count):
+    # As in bench_validation: collections would scan every todo of the store
+    gc.disable()
+    try:
+        compare_serializers(count)
+    finally:
+        gc.enable()
+
+
+def compare_serializers(count):
+    # The body of a plain GET /todo: the whole list encoded, or joined from the
+    # encodings each todo keeps (after a change to one todo, as between polls)
+    codecs = [STDLIB] + ([make_orjson_codec()] if make_orjson_codec() is not None else [])
+    for layout, store_class in LAYOUTS.items():
+        store = store_class(make_todos(count))
+        baseline = best_of(lambda: json.dumps(store.all()).encode(), repeat=5)
+        report(f"json.dumps(all()), {count} {layout}", baseline)
+        for codec in codecs:
+            if codec is not STDLIB:
+                report(f"{codec.name} dumps(all()), {count} {layout}",
+                       best_of(lambda: codec.dumps(store.all()), repeat=5), baseline, "json.dumps")
+            # Fresh store: the first list encodes every todo and keeps the encodings
+            store = store_class(make_todos(count))
+            join = lambda: b"[" + codec.separator.join(store.fragments(codec.dumps)) + b"]"
+            report(f"{codec.name} first joined, {count} {layout}", best_of(join, repeat=1), baseline, "json.dumps")
+            assert json.loads(join()) == store.all()
+
+            def join_after_update():
+                store.update(count // 2, {"completed": True})
+                return join()
+
+            report(f"{codec.name} joined after a PUT, {count} {layout}",
+                   best_of(join_after_update, repeat=5), baseline, "json.dumps")
+
+
+BENCHMARKS = {"indexes": (bench_indexes, [1_000_000]), "memory": (bench_memory, [100_000, 1_000_000]),
+              "keepalive": (bench_keepalive, [20_000]), "startup": (bench_startup, [1_000_000]),
+              "validation": (bench_validation, [100_000]), "shards": (bench_shards, [20_000]),
+              "serialize": (bench_serialize, [100_000])}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Todo store micro-benchmarks")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--items", type=int, nargs="+",
+                        help="store sizes (or, for keepalive, request counts) to run at "
+                             "(default: depends on the benchmark)")
+    args = parser.parse_args()
+    benchmark, sizes = BENCHMARKS[args.benchmark]
+    for count in args.items or sizes:
+        benchmark(count)
@@ -0,0 +1,112 @@
+"""
+Cache of encoded GET responses.
+
+Every mutation bumps the store version, so an entry is only served while the
+store is still at the version it was encoded from. Entries carry an ETag so
+clients polling with If-None-Match can be answered with 304 and no body.
+Compressed copies of an entry's body are kept with it, so an unchanged list is
+compressed once rather than on every poll.
+"""
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+
+# encodings maps a content coding to the body compressed with it
+CachedResponse = namedtuple("CachedResponse", ["version", "etag", "body", "encodings"])
+
+
+def make_etag(body):
+    """Strong ETag derived from the response bytes, so it stays valid across restarts."""
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def encoded_etag(etag, encoding):
+    """Returns: the ETag of a compressed copy - it must differ from the uncompressed one"""
+    return etag if encoding is None else etag[:-1] + "-" + encoding + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """Returns: True if an If-None-Match header value covers etag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def entry_size(entry):
+    return len(entry.body) + sum(len(body) for body in entry.encodings.values())
+
+
+class ResponseCache:
+    """
+    Least-recently-used cache of encoded responses, bounded both by the number
+    of entries and by their total size in bytes. A max_entries of 0 disables it.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        """Returns: the cached response for key if it was stored at this version, else None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, version, body):
+        """
+        Stores an encoded response (unless it is bigger than the whole cache).
+        Returns: the CachedResponse, with its ETag
+        """
+        entry = CachedResponse(version, make_etag(body), body, {})
+        if self.max_entries <= 0 or len(body) > self.max_bytes:
+            return entry
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= entry_size(old)
+            self._entries[key] = entry
+            self._size += len(body)
+            self._evict()
+        return entry
+
+    def encoded(self, key, entry, encoding, encode):
+        """
+        Returns: entry's body compressed with encoding, calling encode(body) only
+                 the first time; the copy counts towards the cache size
+        """
+        with self._lock:
+            body = entry.encodings.get(encoding)
+        if body is not None:
+            return body
+
+        body = encode(entry.body)
+        with self._lock:
+            if self._entries.get(key) is entry and encoding not in entry.encodings:
+                entry.encodings[encoding] = body
+                self._size += len(body)
+                self._evict()
+        return body
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= entry_size(evicted)
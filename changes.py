@@ -0,0 +1,89 @@
+"""
+Change feed: the recent mutations of the store, in the order they were applied.
+
+Every mutation (each item of a batch counts as one) gets the next sequence
+number and is kept in a ring buffer of the last `capacity` changes. A client
+that has seen everything up to sequence number N asks for the changes after N
+and gets only those, instead of downloading the whole list again to notice
+that something changed. Changes are:
+
+  {"seq": 7, "op": "add", "id": 3, "item": {...the new todo...}}
+  {"seq": 8, "op": "update", "id": 3, "fields": {...only the fields sent...}}
+  {"seq": 9, "op": "delete", "id": 3}
+
+Applying one twice gives the same todos as applying it once, so a client may
+replay changes it already has.
+
+When the changes after N have dropped out of the buffer the client has to
+resync: load the full list, then follow the feed from the sequence number it
+was told. Numbering starts from the time the feed was created, in
+microseconds, so the numbers keep growing across server restarts and a cursor
+from before a restart is always older than the buffer.
+"""
+import itertools
+import threading
+import time
+from collections import deque
+
+
+def change_from_record(record):
+    """Returns: the change a store on_change record describes (without its seq)"""
+    if record["op"] == "add":
+        return {"op": "add", "id": record["item"]["id"], "item": record["item"]}
+    return dict(record)
+
+
+class ChangeFeed:
+    """
+    Ring buffer of the last `capacity` changes. publish is meant to be the
+    store's on_change callback (it runs with the store's write lock held, so
+    sequence numbers follow the order the changes were applied in); readers
+    can wait for new changes.
+    """
+
+    def __init__(self, capacity=1000, start=None):
+        if capacity < 1:
+            raise ValueError("Change feed capacity must be at least 1")
+        self.capacity = capacity
+        # Sequence number of the latest change (no change has that number yet at the start)
+        self.last = int(time.time() * 1_000_000) if start is None else start
+        self.waiters = 0
+        self.closed = False
+        self._changes = deque(maxlen=capacity)
+        self._cond = threading.Condition()
+
+    def publish(self, records):
+        """Gives each record of one mutation (or batch) a sequence number and wakes waiting readers."""
+        with self._cond:
+            for record in records:
+                self.last += 1
+                change = change_from_record(record)
+                change["seq"] = self.last
+                self._changes.append(change)
+            self._cond.notify_all()
+
+    def since(self, seq, timeout=0):
+        """
+        Returns the changes after seq, waiting up to timeout seconds for one if
+        there are none yet.
+        Returns: (changes, last) - changes is None if the client has to resync
+                 (the changes after seq are no longer kept, or seq is not from
+                 this feed); last is the sequence number to continue from
+        """
+        with self._cond:
+            if timeout > 0 and seq == self.last and not self.closed:
+                self.waiters += 1
+                try:
+                    self._cond.wait_for(lambda: self.last != seq or self.closed, timeout)
+                finally:
+                    self.waiters -= 1
+            oldest = self.last - len(self._changes)
+            if not oldest <= seq <= self.last:
+                return None, self.last
+            return list(itertools.islice(self._changes, seq - oldest, None)), self.last
+
+    def close(self):
+        """Wakes every waiting reader; from now on nobody waits (for a clean shutdown)."""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
@@ -0,0 +1,63 @@
+"""
+Compact in-memory representation of the todos.
+
+A todo dict costs far more than its contents: a small dict is ~200 bytes
+before counting its keys and values. CompactTodoStore keeps each todo as a
+tuple of its values followed by its shape, the tuple of its field names:
+
+    {"id": 7, "task": "Buy milk", "completed": False}
+    -> (7, "Buy milk", False, ("id", "task", "completed"))
+
+Shapes are interned, so the million todos that share a shape share one tuple
+of field names, and the id is the same int object as the dict key. Extra
+fields and the order of the fields are kept, so a todo comes back as exactly
+the dict that was stored.
+"""
+import sys
+
+from store import TodoStore
+
+
+def pack_todo(item, shapes):
+    """Returns: the packed tuple for a todo dict, its shape interned in shapes"""
+    shape = tuple(item)
+    interned = shapes.get(shape)
+    if interned is None:
+        interned = shapes[shape] = tuple(sys.intern(key) for key in shape)
+    return (*item.values(), interned)
+
+
+def unpack_todo(row):
+    """Returns: the todo dict for a packed tuple"""
+    # zip stops at the end of the shape, so the shape itself is left out
+    return dict(zip(row[-1], row))
+
+
+class CompactTodoStore(TodoStore):
+    """
+    TodoStore that holds its todos packed (see pack_todo).
+
+    Reads unpack a fresh dict, which costs a little per todo returned; writes
+    pack the merged dict that TodoStore builds anyway. The dict passed in is
+    packed in place, so a large file's dicts are freed as they are converted
+    rather than all at the end.
+    """
+
+    def __init__(self, todo=None, on_change=None):
+        super().__init__(todo, on_change)
+        self._shapes = {}
+        for todo_id, item in self.todo.items():
+            self.todo[todo_id] = pack_todo(item, self._shapes)
+
+    def all(self):
+        with self.lock.read_locked():
+            return self.snapshot()
+
+    def snapshot(self):
+        return [unpack_todo(row) for row in self.todo.values()]
+
+    def _item(self, todo_id):
+        return unpack_todo(self.todo[todo_id])
+
+    def _put(self, item):
+        self.todo[item["id"]] = pack_todo(item, self._shapes)
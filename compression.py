@@ -0,0 +1,87 @@
+"""
+gzip/deflate content codings for responses and request bodies.
+
+A JSON list of todos repeats the same keys in every item, so it typically
+shrinks to a fraction of its size. Responses are only compressed when the
+client asks for it in Accept-Encoding and the body is big enough to be worth it.
+"""
+import zlib
+
+# Codings we can produce, in order of preference when the client rates them equally
+ENCODINGS = ("gzip", "deflate")
+
+# zlib window bits: gzip wrapper, zlib wrapper ("deflate" in HTTP), raw deflate
+WBITS = {"gzip": 31, "deflate": 15}
+RAW_DEFLATE_WBITS = -15
+
+
+def choose_encoding(accept_encoding):
+    """
+    Picks the content coding for a response from an Accept-Encoding header.
+    Returns: "gzip", "deflate" or None (send the body as is)
+    """
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, *params = part.strip().split(";")
+        weight = 1.0
+        for param in params:
+            name, _, value = param.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding.strip().lower()] = weight
+
+    best, best_weight = None, 0.0
+    for coding in ENCODINGS:
+        weight = weights.get(coding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+def compress(body, encoding, level=6):
+    """Returns: body compressed with the gzip or deflate coding"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, WBITS[encoding])
+    return compressor.compress(body) + compressor.flush()
+
+
+class StreamCompressor:
+    """Compresses a body piece by piece, flushing each piece so the client can decode it at once."""
+
+    def __init__(self, encoding, level=6):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, WBITS[encoding])
+
+    def compress(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+def decompress(body, encoding, max_size):
+    """
+    Decodes a request body sent with Content-Encoding gzip or deflate.
+    deflate is accepted both zlib-wrapped (as the standard says) and raw, as
+    some clients send it.
+    Returns: the decoded bytes
+    Raises: ValueError if the body is corrupt, truncated or decodes to more
+            than max_size bytes
+    """
+    wbits = WBITS[encoding]
+    if encoding == "deflate" and body[:1] and (body[0] & 0x0F != 8 or int.from_bytes(body[:2], "big") % 31):
+        wbits = RAW_DEFLATE_WBITS
+
+    decompressor = zlib.decompressobj(wbits)
+    try:
+        data = decompressor.decompress(body, max_size + 1)
+    except zlib.error as e:
+        raise ValueError(f"Invalid {encoding} body: {e}")
+    if len(data) > max_size:
+        raise ValueError(f"Body decodes to more than {max_size} bytes")
+    if not decompressor.eof:
+        raise ValueError(f"Truncated {encoding} body")
+    return data
@@ -0,0 +1,91 @@
+"""
+Secondary indexes over the in-memory todos.
+
+by_completed maps True/False to the ids of the todos with that completed value,
+and postings maps every word of a todo's task and description to the ids of
+the todos containing it. TodoStore keeps both up to date on every change, so
+"all incomplete tasks" or "tasks mentioning X" never has to scan the store.
+"""
+import re
+
+TOKEN_PATTERN = re.compile(r"\w+")
+TEXT_FIELDS = ("task", "description")
+
+
+def tokenize(text):
+    """Returns: the set of lower-cased words in text"""
+    return set(TOKEN_PATTERN.findall(text.lower()))
+
+
+def todo_tokens(item):
+    """Returns: the set of words in a todo's indexed text fields"""
+    tokens = set()
+    for field in TEXT_FIELDS:
+        value = item.get(field)
+        if isinstance(value, str):
+            tokens |= tokenize(value)
+    return tokens
+
+
+def is_completed(item):
+    return item.get("completed") is True
+
+
+class TodoIndexes:
+    """Completed-flag and word indexes; the caller serializes access."""
+
+    def __init__(self, items=()):
+        self.by_completed = {True: set(), False: set()}
+        self.postings = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        todo_id = item["id"]
+        self.by_completed[is_completed(item)].add(todo_id)
+        for token in todo_tokens(item):
+            self.postings.setdefault(token, set()).add(todo_id)
+
+    def remove(self, item):
+        todo_id = item["id"]
+        self.by_completed[is_completed(item)].discard(todo_id)
+        for token in todo_tokens(item):
+            self._unpost(token, todo_id)
+
+    def replace(self, old, new):
+        """Moves a todo from its old to its new version, touching only what changed."""
+        todo_id = new["id"]
+        if is_completed(old) != is_completed(new):
+            self.by_completed[is_completed(old)].discard(todo_id)
+            self.by_completed[is_completed(new)].add(todo_id)
+
+        if any(old.get(field) != new.get(field) for field in TEXT_FIELDS):
+            old_tokens = todo_tokens(old)
+            new_tokens = todo_tokens(new)
+            for token in old_tokens - new_tokens:
+                self._unpost(token, todo_id)
+            for token in new_tokens - old_tokens:
+                self.postings.setdefault(token, set()).add(todo_id)
+
+    def search(self, terms):
+        """
+        Intersects the posting lists of terms, smallest first.
+        Returns: the set of ids of todos containing every one of the words in
+                 terms - possibly the index's own set, so don't modify it
+        """
+        if not terms:
+            return set()
+        posting_lists = sorted((self.postings.get(term, set()) for term in terms), key=len)
+        result = posting_lists[0]
+        for posting in posting_lists[1:]:
+            if not result:
+                break
+            result = result & posting
+        return result
+
+    def _unpost(self, token, todo_id):
+        ids = self.postings.get(token)
+        if ids is not None:
+            ids.discard(todo_id)
+            if not ids:
+                del self.postings[token]
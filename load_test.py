@@ -0,0 +1,320 @@
+"""
+Load test for the todo server, run entirely on localhost.
+
+For each store size the server is started on a free port with a freshly
+generated todos file, and is polled until it answers. Then client processes,
+each with one kept-alive connection, send a weighted mix of requests for a
+fixed time. One JSON object per run is written to stdout (or appended to
+--output), so runs can be compared with each other:
+
+    python load_test.py --sizes 1000 100000 --concurrency 8 --duration 10 \\
+        --mix get=60,list=20,create=10,update=10 --output results.jsonl
+
+Server settings are passed through as environment variables, for example
+--env TODO_PERSISTENCE=group --env TODO_DURABILITY=async.
+
+To overload the server on purpose, run more clients than it admits at once,
+for example --concurrency 32 --env TODO_MAX_CONCURRENT=4 --env TODO_MAX_QUEUE=8.
+Turned away requests (429/503) are counted as "rejected", and
+"served_latency_ms" shows the latency of the requests that were served.
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import iter_todos
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+
+# Request kinds for --mix; each gets the client's rng and the store size
+OPERATIONS = {
+    "get": lambda rng, size: ("GET", f"/todo/id/{rng.randint(1, size)}", None),
+    "list": lambda rng, size: ("GET", f"/todo?limit=100&cursor={rng.randint(0, size)}", None),
+    "search": lambda rng, size: ("GET", "/todo?q=milk&limit=100", None),
+    "full": lambda rng, size: ("GET", "/todo", None),
+    # What a client following the change feed sends instead of polling "full"
+    "changes": lambda rng, size: ("GET", "/todo/changes", None),
+    "create": lambda rng, size: ("POST", "/todo", {"task": f"Load test {rng.random()}", "completed": False}),
+    "update": lambda rng, size: ("PUT", f"/todo/id/{rng.randint(1, size)}", {"completed": rng.random() < 0.5}),
+    "delete": lambda rng, size: ("DELETE", f"/todo/id/{rng.randint(1, size)}", None),
+}
+DEFAULT_MIX = "get=60,list=20,create=10,update=10"
+
+# Statuses the server answers with when admission control turns a request away
+REJECTED = (429, 503)
+
+
+def parse_mix(text):
+    """Returns: dict of operation -> weight for a "get=60,create=40" style mix"""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation in mix: {name}")
+        mix[name] = float(weight or 1)
+    if not any(weight > 0 for weight in mix.values()):
+        raise ValueError("Mix needs at least one operation with a positive weight")
+    return mix
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def write_todos(path, size):
+    """Writes a todos file with size generated todos (ids 1..size)."""
+    with open(path, "w") as f:
+        f.write("[")
+        for item in iter_todos(size):
+            if item["id"] > 1:
+                f.write(",")
+            f.write(json.dumps(item))
+        f.write("]")
+
+
+def start_server(workdir, size, engine, env_overrides, ready_timeout):
+    """
+    Starts server.py on a free port with size todos, and waits until it answers.
+    Returns: (process, port)
+    """
+    todo_file = os.path.join(workdir, "todos.json")
+    write_todos(todo_file, size)
+    port = free_port()
+    env = {**os.environ, "TODO_FILE": todo_file, "TODO_DB": os.path.join(workdir, "todos.db"), **env_overrides}
+    args = [sys.executable, SERVER_SCRIPT, "--port", str(port)]
+    if engine:
+        args += ["--engine", engine]
+    log = open(os.path.join(workdir, "server.log"), "wb")
+    process = subprocess.Popen(args, env=env, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    try:
+        wait_until_ready(process, port, ready_timeout, os.path.join(workdir, "server.log"))
+    except BaseException:
+        stop_server(process)
+        raise
+    return process, port
+
+
+def wait_until_ready(process, port, timeout, log_path):
+    """Polls the server until it answers a request (loading a big store can take a while)."""
+    deadline = time.monotonic() + timeout
+    while True:
+        if process.poll() is not None:
+            with open(log_path, errors="replace") as f:
+                raise RuntimeError(f"Server exited with code {process.returncode}:\n{f.read()[-2000:]}")
+        try:
+            conn = http.client.HTTPConnection("localhost", port, timeout=1)
+            conn.request("GET", "/todo?limit=1")
+            if conn.getresponse().status == 200:
+                conn.close()
+                return
+            conn.close()
+        except OSError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Server not ready after {timeout} seconds")
+        time.sleep(0.05)
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def run_client(port, size, mix, start_at, warmup, duration, seed, keepalive):
+    """
+    Sends requests from one client process in a closed loop until the time is up.
+    Returns: list of (operation, latency in seconds, status) after the warmup;
+             status is 0 when the request failed without a response
+    """
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    results = []
+    conn = None
+
+    time.sleep(max(0.0, start_at - time.time()))
+    measure_from = time.perf_counter() + warmup
+    stop_at = measure_from + duration
+    while True:
+        now = time.perf_counter()
+        if now >= stop_at:
+            break
+        name = rng.choices(names, weights)[0]
+        method, path, body = OPERATIONS[name](rng, size)
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+
+        start = time.perf_counter()
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection("localhost", port, timeout=30)
+            conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+            if not keepalive or response.will_close:
+                conn.close()
+                conn = None
+        except (OSError, http.client.HTTPException):
+            status = 0
+            if conn is not None:
+                conn.close()
+            conn = None
+        if start >= measure_from:
+            results.append((name, time.perf_counter() - start, status))
+
+    if conn is not None:
+        conn.close()
+    return results
+
+
+def percentile(sorted_values, fraction):
+    """Returns: the nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * fraction // 1))
+    return sorted_values[int(rank) - 1]
+
+
+def latency_summary(latencies):
+    """Returns: p50/p95/p99/max of already sorted latencies, in ms"""
+    return {name: round(percentile(latencies, fraction) * 1000, 3) if latencies else None
+            for name, fraction in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99), ("max", 1.0))}
+
+
+def summarize(results, duration):
+    """
+    Returns: dict with requests, req/s, errors, rejections, statuses and latency
+             percentiles (ms) of all requests and of those that were served.
+             429 and 503 answers are admission control turning requests away,
+             so they count as rejected rather than as errors.
+    """
+    latencies = sorted(latency for _, latency, _ in results)
+    served = sorted(latency for _, latency, status in results if status and status not in REJECTED)
+    statuses = {}
+    for _, _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    rejected = sum(count for status, count in statuses.items() if int(status) in REJECTED)
+    errors = sum(count for status, count in statuses.items()
+                 if status == "0" or (status.startswith("5") and int(status) not in REJECTED))
+    return {
+        "requests": len(results),
+        "rps": round(len(results) / duration, 1),
+        "errors": errors,
+        "rejected": rejected,
+        "statuses": statuses,
+        "latency_ms": latency_summary(latencies),
+        "served_latency_ms": latency_summary(served),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(SERVER_SCRIPT), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(size, mix, concurrency=4, duration=10.0, warmup=1.0, engine=None, env=None,
+        seed=0, keepalive=True, ready_timeout=120.0):
+    """
+    Runs one load test against a fresh server holding size todos.
+    Returns: the result dict that is written out as one JSON line
+    """
+    env = env or {}
+    with tempfile.TemporaryDirectory(prefix="todo-load-") as workdir:
+        started = time.monotonic()
+        process, port = start_server(workdir, size, engine, env, ready_timeout)
+        startup = time.monotonic() - started
+        try:
+            context = multiprocessing.get_context("spawn")
+            start_at = time.time() + 1.0
+            with context.Pool(concurrency) as pool:
+                runs = pool.starmap(run_client, [
+                    (port, size, mix, start_at, warmup, duration, seed + client, keepalive)
+                    for client in range(concurrency)])
+        finally:
+            stop_server(process)
+
+    results = [result for client_results in runs for result in client_results]
+    by_operation = {name: summarize([r for r in results if r[0] == name], duration) for name in mix}
+    return {
+        "size": size,
+        "engine": engine or env.get("TODO_ENGINE") or os.environ.get("TODO_ENGINE", "threaded"),
+        "env": env,
+        "mix": mix,
+        "concurrency": concurrency,
+        "keepalive": keepalive,
+        "duration_s": duration,
+        "warmup_s": warmup,
+        "seed": seed,
+        "startup_s": round(startup, 3),
+        **summarize(results, duration),
+        "operations": by_operation,
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the todo server on localhost")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000], help="store sizes to test (default: 1000)")
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help=f"weighted operations, from {', '.join(OPERATIONS)} (default: {DEFAULT_MIX})")
+    parser.add_argument("--concurrency", type=int, default=4, help="client processes (default: 4)")
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds per run (default: 10)")
+    parser.add_argument("--warmup", type=float, default=1.0, help="unmeasured seconds first (default: 1)")
+    parser.add_argument("--engine", choices=("threaded", "pool", "asyncio", "single"),
+                        help="server engine (default: the server's own default)")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE",
+                        help="environment variable for the server, may be repeated")
+    parser.add_argument("--no-keepalive", dest="keepalive", action="store_false",
+                        help="open a new connection for every request")
+    parser.add_argument("--seed", type=int, default=0, help="random seed (default: 0)")
+    parser.add_argument("--ready-timeout", type=float, default=120.0,
+                        help="seconds to wait for the server to answer (default: 120)")
+    parser.add_argument("--output", help="append results to this file instead of printing them")
+    args = parser.parse_args(argv)
+
+    try:
+        mix = parse_mix(args.mix)
+        env = dict(item.split("=", 1) for item in args.env)
+    except ValueError as e:
+        parser.error(str(e))
+
+    for size in args.sizes:
+        result = run(size, mix, args.concurrency, args.duration, args.warmup, args.engine, env,
+                     args.seed, args.keepalive, args.ready_timeout)
+        line = json.dumps(result)
+        if args.output:
+            with open(args.output, "a") as f:
+                f.write(line + "\n")
+        else:
+            print(line, flush=True)
+        latency = result["latency_ms"]
+        print(f"size={size} rps={result['rps']} p50={latency['p50']}ms p95={latency['p95']}ms "
+              f"p99={latency['p99']}ms errors={result['errors']} rejected={result['rejected']}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
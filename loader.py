@@ -0,0 +1,279 @@
+"""
+Streaming reader for the todos file.
+
+json.load needs the whole file as one string and then every parsed todo on
+top of it, and a single bad byte anywhere makes it give up on all of them.
+TodoFileReader reads the file a chunk at a time, so besides the todos
+themselves it only ever holds about a chunk of text and the todos decoded from
+it. The complete todos in a chunk are decoded by one json call; only a chunk
+that fails to decode is gone through one todo at a time.
+
+A record that doesn't decode is reported in `errors` and skipped: reading
+resumes at the next "," followed by "{", which is where the next todo of a
+list of objects starts. Records that aren't objects are reported too (the
+store can't use them). A file cut short keeps every todo before the cut.
+"""
+import codecs
+import json
+import os
+import re
+import time
+from collections import namedtuple
+
+CHUNK_SIZE = 1024 * 1024
+# A record still undecoded after this many characters is treated as malformed
+MAX_RECORD_SIZE = 16 * 1024 * 1024
+
+LoadError = namedtuple("LoadError", "offset message")
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+NEXT_RECORD = re.compile(r",[ \t\n\r]*\{")
+
+
+class TodoFileReader:
+    """
+    Iterates over the todos in a JSON list read from a binary file object.
+
+    errors collects a LoadError (character offset, message) per skipped record
+    or structural problem. progress, if given, is called as
+    progress(bytes_read, todos_read) after every chunk and once at the end.
+    """
+
+    def __init__(self, f, progress=None, chunk_size=CHUNK_SIZE, max_record_size=MAX_RECORD_SIZE):
+        self.f = f
+        self.progress = progress
+        self.chunk_size = chunk_size
+        self.max_record_size = max_record_size
+        self.errors = []
+        self.bytes_read = 0
+        self.count = 0
+
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._decode = json.JSONDecoder().raw_decode
+        self._decode_list = json.JSONDecoder().decode
+        self._buffer = ""
+        self._pos = 0
+        # Characters dropped from the front of the buffer, to report file offsets
+        self._base = 0
+        self._eof = False
+        # Set while skipping a damaged stretch, so it is reported only once
+        self._skipping = False
+        self._done = False
+
+    def __iter__(self):
+        yield from self._read_list()
+        if self.progress is not None:
+            self.progress(self.bytes_read, self.count)
+
+    def _read_list(self):
+        if not self._skip_whitespace():
+            # An empty file holds no todos
+            return
+        if self._buffer[self._pos] != "[":
+            self._error("the file is not a JSON list")
+            return
+        self._pos += 1
+
+        while not self._done:
+            # Fast path: every complete todo in the buffer decoded by one call
+            end, last = self._batch_end()
+            if end is not None:
+                items = self._decode_batch(end)
+                if items is not None:
+                    self.count += len(items)
+                    yield from items
+                    self._pos = end + 1
+                    self._done = last
+                    continue
+            # A damaged batch (or a todo bigger than the buffer) goes one todo at a time
+            yield from self._read_records(self._base + end if end is not None else None)
+
+    def _batch_end(self):
+        """
+        Returns: (end, last) - end is the position of the last "," in the buffer
+                 that is followed by a todo, or at the end of the file of the
+                 closing "]" (then last is True); None if there is neither
+        """
+        if self._pos >= len(self._buffer) - 1 and not self._eof:
+            self._fill()
+        buffer = self._buffer
+        if self._eof:
+            end = len(buffer.rstrip(" \t\n\r")) - 1
+            if end >= self._pos and buffer[end] == "]":
+                return end, True
+
+        brace = len(buffer)
+        while True:
+            brace = buffer.rfind("{", self._pos, brace)
+            if brace <= self._pos:
+                return None, False
+            comma = brace - 1
+            while comma > self._pos and buffer[comma] in " \t\n\r":
+                comma -= 1
+            if buffer[comma] == ",":
+                return comma, False
+
+    def _decode_batch(self, end):
+        """Returns: the todos between the current position and end, or None unless they all decode"""
+        text = self._buffer[self._pos:end]
+        if not text.strip():
+            return []
+        try:
+            items = self._decode_list("[" + text + "]")
+        except json.JSONDecodeError:
+            return None
+        for item in items:
+            if type(item) is not dict:
+                return None
+        return items
+
+    def _read_records(self, until):
+        """
+        Decodes todos one at a time, reporting and skipping damaged ones, until
+        past the file offset until (or after one todo if until is None).
+        """
+        while True:
+            if not self._skip_whitespace():
+                self._error("the file ends before the list is closed")
+                self._done = True
+                return
+            if self._buffer[self._pos] == "]":
+                self._done = True
+                return
+
+            item = self._read_record()
+            if item is None:
+                if not self._resync():
+                    self._done = True
+                    return
+            else:
+                self._skipping = False
+                if isinstance(item, dict):
+                    self.count += 1
+                    yield item
+                else:
+                    self._error(f"expected a todo object, found {type(item).__name__}", self._record_start)
+
+                if not self._skip_whitespace():
+                    self._error("the file ends before the list is closed")
+                    self._done = True
+                    return
+                separator = self._buffer[self._pos]
+                if separator == "]":
+                    self._done = True
+                    return
+                if separator == ",":
+                    self._pos += 1
+                elif separator == "{":
+                    # Just the comma is missing; the next todo is right here
+                    self._error("expected ',' between todos")
+                else:
+                    self._error(f"expected ',' or ']', found {separator!r}")
+                    if not self._resync():
+                        self._done = True
+                        return
+
+            if until is None or self._base + self._pos > until:
+                return
+
+    def _read_record(self):
+        """Returns: the decoded record at the current position, or None if it is malformed"""
+        self._record_start = self._pos
+        while True:
+            try:
+                item, end = self._decode(self._buffer, self._pos)
+            except json.JSONDecodeError as e:
+                # A record running past the end of the buffer fails right at its
+                # end, or in a string that doesn't end; anything else is damage
+                cut_short = e.pos >= len(self._buffer) - 8 or e.msg.startswith("Unterminated string")
+                if cut_short and not self._eof and len(self._buffer) - self._pos < self.max_record_size:
+                    self._fill()
+                    self._record_start = self._pos
+                    continue
+                # A "," and "{" inside a damaged todo can look like the next
+                # one; that is still the same damage, reported once
+                if cut_short and self._eof:
+                    self._error("the file ends in the middle of a todo", self._pos)
+                elif not self._skipping:
+                    self._error(f"malformed todo: {e.msg}", self._pos)
+                    self._skipping = True
+                return None
+            self._pos = end
+            return item
+
+    def _resync(self):
+        """
+        Moves to the start of the next record after a malformed one.
+        Returns: False if the file ends first
+        """
+        search_from = self._pos + 1
+        while True:
+            match = NEXT_RECORD.search(self._buffer, search_from)
+            if match:
+                self._pos = match.end() - 1
+                return True
+            if self._eof:
+                return False
+            # Keep the tail, in case the "," and the "{" straddle two chunks
+            self._pos = max(self._pos, len(self._buffer) - 64)
+            self._fill()
+            search_from = self._pos
+
+    def _skip_whitespace(self):
+        """Returns: False if only whitespace is left in the file"""
+        while True:
+            self._pos = WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return True
+            if self._eof:
+                return False
+            self._fill()
+
+    def _fill(self):
+        """Drops what has been consumed and appends the next chunk to the buffer."""
+        data = self.f.read(self.chunk_size)
+        self.bytes_read += len(data)
+        if not data:
+            self._eof = True
+        text = self._decoder.decode(data, final=not data)
+        self._base += self._pos
+        self._buffer = self._buffer[self._pos:] + text
+        self._pos = 0
+        if self.progress is not None:
+            self.progress(self.bytes_read, self.count)
+
+    def _error(self, message, position=None):
+        position = self._pos if position is None else position
+        self.errors.append(LoadError(self._base + position, message))
+
+
+def read_todos(path, errors=None, progress=None):
+    """
+    Yields the todos in a JSON todos file one at a time (see TodoFileReader).
+    Skipped records are appended to errors, if given; progress is called as
+    progress(bytes_read, total_bytes, todos_read).
+    Raises: OSError if the file can't be opened
+    """
+    with open(path, "rb") as f:
+        total = os.fstat(f.fileno()).st_size
+        reader = TodoFileReader(f, progress=(lambda read, count: progress(read, total, count)) if progress else None)
+        try:
+            yield from reader
+        finally:
+            if errors is not None:
+                errors.extend(reader.errors)
+
+
+class ProgressPrinter:
+    """progress callback for read_todos that prints how far loading has got, at most every interval seconds."""
+
+    def __init__(self, label, interval=1.0):
+        self.label = label
+        self.interval = interval
+        self._last = time.monotonic()
+
+    def __call__(self, bytes_read, total, count):
+        now = time.monotonic()
+        if now - self._last >= self.interval:
+            self._last = now
+            print(f"Loading {self.label}: {bytes_read / max(total, 1):.0%} ({count} todos)", flush=True)
@@ -1,29 +1,31 @@
 import requests
 
 BASE_URL = "http://localhost:8000"
+# One session for every call, so they all share a kept-alive connection
+session = requests.Session()
 
 # Test 1: Add a task
 print("\n1. POST /todo - Add task")
-r = requests.post(f"{BASE_URL}/todo",
+r = session.post(f"{BASE_URL}/todo",
                   json={"task": "Exercise4545", "completed": False})
 print(f"   Status: {r.status_code}")
 print(f"   Response: {r.json()}")
 
 # Test 2: Get all tasks
 print("\n2. GET /todo - Get all tasks")
-r = requests.get(f"{BASE_URL}/todo")
+r = session.get(f"{BASE_URL}/todo")
 print(f"   Status: {r.status_code}")
 print(f"   Response: {r.json()}")
 
 # Test 3: Add a second task
 print("\n3. POST /todo - Add second task")
-r = requests.post(f"{BASE_URL}/todo",
+r = session.post(f"{BASE_URL}/todo",
                   json={"task": "Read a book", "completed": False})
 print(f"   Status: {r.status_code}")
 print(f"   Response: {r.json()}")
 
 # Test 4: Get all tasks
 print("\n4. GET /todo - Get all tasks")
-r = requests.get(f"{BASE_URL}/todo")
+r = session.get(f"{BASE_URL}/todo")
 print(f"   Status: {r.status_code}")
 print(f"   Response: {r.json()}")
\ No newline at end of file
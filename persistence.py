@@ -0,0 +1,363 @@
+"""
+Persistence helpers for the todos.
+
+WriteAheadLog: instead of rewriting the whole todos file on every change, each
+mutation is appended to a log as one compact JSON line. On startup the log is
+replayed on top of the last snapshot, and once enough records pile up a
+background thread compacts the log into a single snapshot record.
+
+GroupCommitWriter: keeps the plain JSON file, but a background thread saves
+it once for all the changes that arrive within a short window.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+
+from metrics import registry
+from store import index_todos
+
+BYTES_WRITTEN = registry.counter(
+    "todo_bytes_written_total", "Bytes written to the todos file and the write-ahead log", ["target"])
+SAVE_SECONDS = registry.histogram(
+    "todo_save_seconds", "Time spent encoding and writing a full copy of the todos", ["writer"])
+
+# How often the log is forced to disk:
+#   "always"   - fsync after every append (safest, slowest)
+#   "interval" - a background thread fsyncs every N milliseconds
+#   "never"    - leave it to the operating system
+FSYNC_POLICIES = ("always", "interval", "never")
+
+
+def encode_record(record):
+    """Encodes one log record as a compact JSON line."""
+    return json.dumps(record, separators=(",", ":")).encode() + b"\n"
+
+
+def apply_record(todo, record, skip_missing=False):
+    """
+    Applies one logged mutation to the todos (a dict of todo id -> todo).
+    Records written before todos had ids address them by list position; those
+    are replayed positionally and their todos get ids the same way index_todos does.
+    With skip_missing, an update or delete of a todo that isn't there is left
+    out instead of raising KeyError (see WriteAheadLog).
+    Returns: the todos (a snapshot record replaces them entirely)
+    """
+    op = record["op"]
+    if op == "snapshot":
+        return index_todos(record["items"])
+    if op == "batch":
+        for inner in record["records"]:
+            todo = apply_record(todo, inner, skip_missing)
+        return todo
+    if op == "add":
+        item = record["item"]
+        if "id" not in item:
+            item = {"id": max(todo, default=0) + 1, **item}
+        todo[item["id"]] = item
+        return todo
+
+    if "id" in record:
+        todo_id = record["id"]
+    else:
+        todo_id = list(todo)[record["index"]]
+
+    if skip_missing and op in ("update", "delete") and todo_id not in todo:
+        return todo
+    if op == "update":
+        todo[todo_id] = {**todo[todo_id], **record["fields"]}
+    elif op == "delete":
+        del todo[todo_id]
+    else:
+        raise ValueError(f"Unknown log record: {op}")
+    return todo
+
+
+def fsync_directory(path):
+    """Makes a rename inside the directory of path durable (no-op where unsupported)."""
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_file_atomically(path, data):
+    """Writes bytes to a temp file, fsyncs it and renames it over path."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_directory(path)
+    BYTES_WRITTEN.inc("file", amount=len(data))
+
+
+class WriteAheadLog:
+    """
+    Append-only log of todo mutations.
+
+    snapshot_provider is called (while the caller still holds whatever makes the
+    todos consistent) to copy the current todos when a compaction starts.
+    If export_path is set, every compaction also rewrites that file as a plain
+    JSON list so the "json" persistence mode can still read the data.
+
+    If snapshot_writer is set, compaction hands it the copy to save elsewhere
+    (see snapshot.write_snapshot) instead of writing it into the log, and the
+    compacted log keeps only the records that came after the copy. Should a
+    crash leave the new copy next to the old log, the old log is replayed on top
+    of a copy that already has some of its records applied. Records address
+    todos by id and set them outright, and the log goes on to every later
+    change of the same todo, so the todos still come out the same - except that
+    an update or delete may find its todo already deleted in the copy. Replay
+    skips those when there is a snapshot_writer, rather than stopping there and
+    losing every record after it.
+    """
+
+    def __init__(self, path, snapshot_provider, export_path=None, snapshot_writer=None,
+                 fsync_policy="always", fsync_interval_ms=100, compact_every=1000):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync_policy}")
+        self.path = path
+        self.snapshot_provider = snapshot_provider
+        self.export_path = export_path
+        self.snapshot_writer = snapshot_writer
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval_ms / 1000
+        self.compact_every = compact_every
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._dirty = False
+        self._records_since_compaction = 0
+        self._compactor = None
+        self._closed = threading.Event()
+        self._flusher = None
+
+    def replay(self, todo):
+        """
+        Replays the log on top of the todos loaded from the snapshot file.
+        A record cut short by a crash (or any corrupt record) ends the replay, and
+        the log is truncated back to the last good record so new appends start clean.
+        Returns: the recovered todos
+        """
+        good_offset = 0
+        replayed = 0
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return todo
+
+        with f:
+            for line in f:
+                # A line without its newline is a partially written record
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    todo = apply_record(todo, json.loads(line), skip_missing=self.snapshot_writer is not None)
+                except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+                    break
+                good_offset += len(line)
+                replayed += 1
+            size = f.seek(0, os.SEEK_END)
+
+        if good_offset < size:
+            print(f"Discarding {size - good_offset} bytes of incomplete log data in {self.path}")
+            with open(self.path, "r+b") as f:
+                f.truncate(good_offset)
+                f.flush()
+                os.fsync(f.fileno())
+
+        self._records_since_compaction = replayed
+        return todo
+
+    def append(self, records):
+        """
+        Appends mutation records to the log and syncs them per the fsync policy.
+        Records appended together are written as one batch record, so a crash
+        can never leave only some of them in the log.
+        """
+        if len(records) > 1:
+            data = encode_record({"op": "batch", "records": records})
+        else:
+            data = b"".join(encode_record(record) for record in records)
+        with self._lock:
+            if self._closed.is_set():
+                raise ValueError("Write-ahead log is closed")
+            if self._file is None:
+                self._open()
+            self._file.write(data)
+            self._file.flush()
+            BYTES_WRITTEN.inc("wal", amount=len(data))
+            if self.fsync_policy == "always":
+                os.fsync(self._file.fileno())
+            else:
+                self._dirty = True
+
+            self._records_since_compaction += len(records)
+            if self._records_since_compaction >= self.compact_every and self._compactor is None:
+                self._start_compaction()
+
+    def close(self):
+        """Waits for a running compaction, syncs the log and closes it."""
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                if self.fsync_policy != "never":
+                    os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
+
+    def _open(self):
+        self._file = open(self.path, "ab")
+        if self.fsync_policy == "interval" and self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+            self._flusher.start()
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.fsync_interval):
+            with self._lock:
+                if self._dirty and self._file is not None:
+                    os.fsync(self._file.fileno())
+                    self._dirty = False
+
+    def _start_compaction(self):
+        # Called with the lock held, so the copy matches the log up to this offset
+        items = [dict(item) for item in self.snapshot_provider()]
+        offset = self._file.tell()
+        compacted = self._records_since_compaction
+        self._compactor = threading.Thread(
+            target=self._compact, args=(items, offset, compacted), daemon=True)
+        self._compactor.start()
+
+    def _compact(self, items, offset, compacted):
+        tmp_path = self.path + ".compact"
+        start = time.perf_counter()
+        try:
+            # The big snapshot is written without blocking appends
+            if self.snapshot_writer is not None:
+                self.snapshot_writer(items)
+            with open(tmp_path, "wb") as out:
+                if self.snapshot_writer is None:
+                    out.write(encode_record({"op": "snapshot", "items": items}))
+                    out.flush()
+                    os.fsync(out.fileno())
+
+                with self._lock:
+                    # Carry over the records appended while the snapshot was written
+                    self._file.flush()
+                    with open(self.path, "rb") as old:
+                        old.seek(offset)
+                        shutil.copyfileobj(old, out)
+                    out.flush()
+                    os.fsync(out.fileno())
+                    BYTES_WRITTEN.inc("wal", amount=out.tell())
+                    self._file.close()
+                    try:
+                        os.replace(tmp_path, self.path)
+                        fsync_directory(self.path)
+                        self._records_since_compaction -= compacted
+                    finally:
+                        self._file = open(self.path, "ab")
+
+            if self.export_path:
+                write_file_atomically(self.export_path, json.dumps(items, indent=2).encode())
+            SAVE_SECONDS.observe(time.perf_counter() - start, "wal_compaction")
+        except Exception as e:
+            print(f"Error compacting log: {e}")
+        finally:
+            self._compactor = None
+
+
+class GroupCommitWriter:
+    """
+    Background writer that saves the todos file once per batch of changes.
+
+    submit() is called after every mutation and returns its generation number.
+    The writer waits window_ms for more changes to arrive, takes one snapshot
+    with snapshot_provider() and writes it atomically, which makes every
+    generation submitted before the snapshot durable at once. flush() lets a
+    request wait for that; close() drains everything still pending.
+    """
+
+    def __init__(self, path, snapshot_provider, window_ms=10):
+        self.path = path
+        self.snapshot_provider = snapshot_provider
+        self.window = window_ms / 1000
+
+        self._cond = threading.Condition()
+        self._submitted = 0
+        self._durable = 0
+        self._failed = 0
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self):
+        """Returns: the generation number of the change just made"""
+        with self._cond:
+            self._submitted += 1
+            self._cond.notify_all()
+            return self._submitted
+
+    def flush(self, generation=None, timeout=None):
+        """
+        Blocks until a generation (default: everything submitted so far) is on disk.
+        Returns: True once it is durable, False if its write failed or timed out
+        """
+        with self._cond:
+            target = self._submitted if generation is None else generation
+            self._cond.wait_for(lambda: self._durable >= target or self._failed >= target, timeout)
+            return self._durable >= target
+
+    def close(self):
+        """Writes out any pending changes and stops the writer thread."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._submitted > self._durable or self._closing)
+                if self._submitted == self._durable:
+                    return
+                closing = self._closing
+
+            # Give other requests a moment to add their changes to this write
+            if not closing:
+                time.sleep(self.window)
+
+            with self._cond:
+                target = self._submitted
+            try:
+                with SAVE_SECONDS.time("group"):
+                    items = self.snapshot_provider()
+                    write_file_atomically(self.path, json.dumps(items, indent=2).encode())
+            except Exception as e:
+                print(f"Error saving todos: {e}")
+                with self._cond:
+                    self._failed = target
+                    self._cond.notify_all()
+                    if self._closing:
+                        return
+                time.sleep(max(self.window, 0.1))
+                continue
+
+            with self._cond:
+                self._durable = target
+                self._cond.notify_all()
@@ -0,0 +1,196 @@
+"""
+Finding out where the time of a request goes.
+
+Two tools, both off unless configured:
+
+- PhaseTimer splits one request's time into phases (read the body, parse,
+  validate, query or mutate the store, persist, serialize, compress, write).
+  The handler starts one per request and code deep down (the store's
+  on_change, say) marks its phase with phase(name) without being handed the
+  timer. Phases nest: time spent persisting inside a mutation counts as
+  persisting only, so the phases add up to the request's time. The handler
+  logs requests over a latency threshold with their breakdown.
+
+- RequestProfiler runs a sample of the requests (or those that ask for it)
+  under cProfile and adds their statistics up, for GET /debug/profile or a
+  file that pstats (and tools like snakeviz) can read. Only one request is
+  profiled at a time: profiling makes a request several times slower, and the
+  sample should stay a sample when requests pile up.
+"""
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+PHASES = ("read", "parse", "validate", "query", "mutate", "persist", "serialize", "compress", "write")
+SORT_KEYS = ("cumulative", "tottime", "calls")
+
+_local = threading.local()
+_no_timer = nullcontext()
+
+
+class PhaseTimer:
+    """
+    Time of one request per phase, each phase counting only its own time (not
+    the phases inside it), as read from clock (seconds, like time.perf_counter).
+    """
+
+    def __init__(self, start=None, clock=time.perf_counter):
+        self.clock = clock
+        self.start = clock() if start is None else start
+        self.seconds = {}
+        self._running = []
+        self._since = None
+
+    @contextmanager
+    def phase(self, name):
+        now = self.clock()
+        self._stop(now)
+        self._running.append(name)
+        self._since = now
+        try:
+            yield
+        finally:
+            now = self.clock()
+            self._stop(now)
+            self._running.pop()
+            # The enclosing phase, if any, goes on from here
+            self._since = now
+
+    def _stop(self, now):
+        if self._running:
+            name = self._running[-1]
+            self.seconds[name] = self.seconds.get(name, 0) + now - self._since
+
+    def breakdown(self, end=None):
+        """
+        Returns: the phases that took any time as (name, seconds) in PHASES
+                 order, then "other" for the time outside every phase
+        """
+        total = (self.clock() if end is None else end) - self.start
+        phases = [(name, self.seconds[name]) for name in PHASES if name in self.seconds]
+        phases += [(name, seconds) for name, seconds in self.seconds.items() if name not in PHASES]
+        return phases + [("other", max(0.0, total - sum(seconds for _, seconds in phases)))]
+
+
+def start_timer(start=None, clock=time.perf_counter):
+    """Starts timing the phases of the request this thread is handling. Returns: its PhaseTimer"""
+    _local.timer = PhaseTimer(start, clock)
+    return _local.timer
+
+
+def stop_timer():
+    """Returns: the timer of this thread's request (None if there is none) and forgets it"""
+    timer = getattr(_local, "timer", None)
+    _local.timer = None
+    return timer
+
+
+def phase(name):
+    """Context manager marking a phase of the request being timed on this thread; does nothing when none is."""
+    timer = getattr(_local, "timer", None)
+    return timer.phase(name) if timer is not None else _no_timer
+
+
+def format_breakdown(phases):
+    """Returns: (name, seconds) pairs as "read 0.1 ms, parse 2.3 ms, ..." """
+    return ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in phases)
+
+
+class RequestProfiler:
+    """
+    Profiles a fraction `rate` of the requests (0 to 1), plus those that ask
+    for it when allow_header is set, and keeps their added up statistics.
+    With path set, the statistics are also written there (in the pstats
+    format) at most every dump_interval seconds, and by dump().
+    """
+
+    def __init__(self, rate=0.0, allow_header=False, path=None, dump_interval=10):
+        if not 0 <= rate <= 1:
+            raise ValueError("Profiling rate must be between 0 and 1")
+        self.rate = rate
+        self.allow_header = allow_header
+        self.path = path
+        self.dump_interval = dump_interval
+        self.profiled = 0
+        self._stats = None
+        self._busy = threading.Lock()
+        self._lock = threading.Lock()
+        self._dumped = time.monotonic()
+
+    @property
+    def enabled(self):
+        return self.rate > 0 or self.allow_header
+
+    def start(self, requested=False):
+        """
+        Decides whether to profile a request (requested: it asked to be) and if
+        so starts profiling this thread.
+        Returns: the running profile, to hand to finish(), or None
+        """
+        if not (requested and self.allow_header) and not (self.rate and random.random() < self.rate):
+            return None
+        if not self._busy.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except Exception:
+            self._busy.release()
+            raise
+        return profile
+
+    def finish(self, profile):
+        """Stops a profile from start() and adds it to the statistics."""
+        profile.disable()
+        self._busy.release()
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+            self.profiled += 1
+            due = self.path and time.monotonic() - self._dumped >= self.dump_interval
+        if due:
+            self.dump()
+
+    def report(self, sort="cumulative", limit=50):
+        """Returns: the statistics as text, the limit slowest functions by sort (one of SORT_KEYS)"""
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Sort must be one of {', '.join(SORT_KEYS)}")
+        out = io.StringIO()
+        with self._lock:
+            if self._stats is None:
+                return "No requests profiled yet\n"
+            print(f"{self.profiled} request(s) profiled", file=out)
+            self._stats.stream = out
+            self._stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def dump_bytes(self):
+        """Returns: the statistics in the pstats file format (what pstats.Stats.dump_stats writes)"""
+        with self._lock:
+            return marshal.dumps(self._stats.stats if self._stats is not None else {})
+
+    def dump(self):
+        """Writes the statistics to path, through a temp file so readers never see half of them."""
+        if not self.path:
+            return
+        data = self.dump_bytes()
+        try:
+            with open(self.path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(self.path + ".tmp", self.path)
+        except OSError as e:
+            print(f"Error writing profile: {e}")
+        self._dumped = time.monotonic()
+
+    def reset(self):
+        with self._lock:
+            self._stats = None
+            self.profiled = 0
@@ -1,64 +1,350 @@
+import argparse
 import json
 import os
-from http.server import BaseHTTPRequestHandler, HTTPServer
+import shutil
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from admission import ConcurrencyLimiter, RateLimiter, overloaded_response, reject_connection, retry_after_header
+from async_server import AsyncHTTPServer
+from cache import ResponseCache, encoded_etag, etag_matches
+from changes import ChangeFeed
+from codec import get_codec
+from compact import CompactTodoStore
+from compression import ENCODINGS, StreamCompressor, choose_encoding, compress, decompress
+from loader import ProgressPrinter, read_todos
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, registry
+from persistence import SAVE_SECONDS, GroupCommitWriter, WriteAheadLog, write_file_atomically
+from profiling import RequestProfiler, format_breakdown, phase, start_timer, stop_timer
+from sharded import ShardedTodoStore, existing_shard_paths, load_shards, remove_extra_shards, shard_path
+from snapshot import LazyTodos, SnapshotError, load_snapshot, write_snapshot
+from sqlite_store import MAX_ID, SqliteTodoStore
+from store import TodoStore, index_todos, is_valid_id
+from validation import todo_validator, update_validator
 
 # Allow tests to specify a different file via environment variable
 
 TODO_FILENAME = os.environ.get('TODO_FILE', 'todos.json')
 
+# Storage backend: "json" keeps every todo in memory and persists them to
+# TODO_FILENAME (see TODO_PERSISTENCE), "sqlite" keeps them in the TODO_DB database
+STORAGE_BACKEND = os.environ.get('TODO_STORAGE', 'json')
+TODO_DB = os.environ.get('TODO_DB', 'todos.db')
+
+# How the json backend holds todos in memory: "dict" keeps the plain dicts,
+# "compact" packs each one into a tuple (see compact.py) for a fraction of the
+# memory, but unpacks every todo to read them back, so each save of the json
+# file (under the write lock) and each full listing is several times slower
+MEMORY_LAYOUT = os.environ.get('TODO_MEMORY', 'dict')
+
+# Binary snapshot (see snapshot.py) the json backend starts from instead of
+# parsing TODO_FILENAME, decoding each todo when it is first read. In wal mode
+# every compaction rewrites it; otherwise it is only used while it is at least
+# as new as TODO_FILENAME. Create one with: python snapshot.py to-snapshot
+SNAPSHOT_FILENAME = os.environ.get('TODO_SNAPSHOT', '')
+
+# Sharded json backend (see sharded.py): with TODO_SHARDS above 1 the todos are
+# split by id over that many files next to TODO_FILENAME, each with its own
+# lock, and a change rewrites only the file of its shard. Only the "json"
+# persistence mode is supported, and no snapshot is used. Shard files are read
+# by up to TODO_SHARD_LOADERS processes at once (default: one per CPU). Back on
+# one shard, the shard files are merged into TODO_FILENAME on startup.
+SHARDS = int(os.environ.get('TODO_SHARDS', '1'))
+SHARD_LOADERS = int(os.environ.get('TODO_SHARD_LOADERS', '0')) or None
+
+# Persistence mode: "json" rewrites TODO_FILENAME on every change, "wal" appends
+# one record per change to TODO_FILENAME + ".wal" and compacts it in the background,
+# "group" rewrites TODO_FILENAME from a background writer once per TODO_COMMIT_WINDOW_MS
+PERSISTENCE_MODE = os.environ.get('TODO_PERSISTENCE', 'json')
+FSYNC_POLICY = os.environ.get('TODO_FSYNC', 'always')
+FSYNC_INTERVAL_MS = int(os.environ.get('TODO_FSYNC_INTERVAL_MS', '100'))
+WAL_COMPACT_EVERY = int(os.environ.get('TODO_WAL_COMPACT_EVERY', '1000'))
+COMMIT_WINDOW_MS = int(os.environ.get('TODO_COMMIT_WINDOW_MS', '10'))
+
+# In group mode, whether a mutating request waits for its change to reach disk
+# ("wait") or is answered straight away ("async"). Clients can pick per request
+# with an X-Durability header.
+DEFAULT_DURABILITY = os.environ.get('TODO_DURABILITY', 'wait')
+
+# Server engine: "threaded" (a thread per connection), "pool" (a fixed pool of
+# TODO_WORKERS threads), "asyncio" (an event loop owns the connections and hands
+# requests to TODO_WORKERS threads) or "single" (one request at a time).
+# The --engine command-line flag overrides it.
+ENGINES = ('threaded', 'pool', 'asyncio', 'single')
+SERVER_ENGINE = os.environ.get('TODO_ENGINE', 'threaded')
+SERVER_WORKERS = int(os.environ.get('TODO_WORKERS', '16'))
+
+# Seconds a kept-alive connection may sit idle between requests before it is closed
+IDLE_TIMEOUT = float(os.environ.get('TODO_IDLE_TIMEOUT', '60'))
+
+# Responses of at least TODO_COMPRESS_MIN_BYTES are gzip/deflate compressed for
+# clients that accept it; compressed request bodies may inflate to at most
+# TODO_MAX_INFLATED_BYTES
+COMPRESS_MIN_BYTES = int(os.environ.get('TODO_COMPRESS_MIN_BYTES', '1024'))
+COMPRESS_LEVEL = int(os.environ.get('TODO_COMPRESS_LEVEL', '6'))
+MAX_INFLATED_BYTES = int(os.environ.get('TODO_MAX_INFLATED_BYTES', str(64 * 1024 * 1024)))
+
+# Admission control (see admission.py). At most TODO_MAX_CONCURRENT requests
+# run at once (0: no limit); up to TODO_MAX_QUEUE more wait for at most
+# TODO_QUEUE_TIMEOUT_MS, and the pool and asyncio engines queue at most
+# TODO_MAX_QUEUE requests for a worker. Past that requests get 503 with
+# Retry-After: TODO_RETRY_AFTER. TODO_RATE_LIMIT requests a second per client
+# address, in bursts of up to TODO_RATE_BURST, get through; more get 429
+# (0 turns rate limiting off). Bodies over TODO_MAX_BODY_BYTES get 413.
+MAX_CONCURRENT = int(os.environ.get('TODO_MAX_CONCURRENT', '64'))
+MAX_QUEUE = int(os.environ.get('TODO_MAX_QUEUE', '128'))
+QUEUE_TIMEOUT_MS = int(os.environ.get('TODO_QUEUE_TIMEOUT_MS', '1000'))
+RETRY_AFTER = int(os.environ.get('TODO_RETRY_AFTER', '1'))
+RATE_LIMIT = float(os.environ.get('TODO_RATE_LIMIT', '0'))
+RATE_BURST = int(os.environ.get('TODO_RATE_BURST', '100'))
+MAX_BODY_BYTES = int(os.environ.get('TODO_MAX_BODY_BYTES', str(16 * 1024 * 1024)))
+# Connections the OS queues for accept (socketserver's default is 5)
+LISTEN_BACKLOG = int(os.environ.get('TODO_LISTEN_BACKLOG', '1024'))
+
+# Paging and streaming of GET /todo
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+
+# JSON codec for request and response bodies (see codec.py): "auto" (orjson if
+# it is installed, else the stdlib), "json" or "orjson". A plain GET /todo is
+# joined from the encodings of its todos, each kept until its todo changes
+# (see TodoStore.fragments); TODO_FRAGMENT_CACHE=0 encodes the whole list every
+# time instead, saving the memory the encodings take
+JSON_CODEC = os.environ.get('TODO_JSON_CODEC', 'auto')
+FRAGMENT_CACHE = os.environ.get('TODO_FRAGMENT_CACHE', '1') == '1'
+
+# Encoded GET responses kept for If-None-Match polling (0 entries disables the cache)
+CACHE_ENTRIES = int(os.environ.get('TODO_CACHE_ENTRIES', '256'))
+CACHE_BYTES = int(os.environ.get('TODO_CACHE_BYTES', str(64 * 1024 * 1024)))
+
+# Change feed at GET /todo/changes (see changes.py): the last TODO_CHANGES_BUFFER
+# changes are kept. A long poll waits at most TODO_CHANGES_MAX_WAIT seconds, and an
+# event stream is ended after TODO_CHANGES_STREAM_SECONDS (clients reconnect
+# with Last-Event-ID), with a comment line every CHANGES_HEARTBEAT seconds
+# while nothing changes so dead connections are noticed
+CHANGES_BUFFER = int(os.environ.get('TODO_CHANGES_BUFFER', '1000'))
+CHANGES_MAX_WAIT = float(os.environ.get('TODO_CHANGES_MAX_WAIT', '30'))
+CHANGES_STREAM_SECONDS = float(os.environ.get('TODO_CHANGES_STREAM_SECONDS', '300'))
+CHANGES_HEARTBEAT = 15
+# A long poll or event stream holds a thread while it waits. The pool and
+# asyncio engines only have TODO_WORKERS of those, so there at most
+# TODO_CHANGES_MAX_CLIENTS feed clients (default: half of TODO_WORKERS) may wait
+# at once, leaving the other workers to ordinary requests; more get 503 with
+# Retry-After. The threaded engine has a thread per connection and only limits
+# them if TODO_CHANGES_MAX_CLIENTS is set.
+CHANGES_MAX_CLIENTS = int(os.environ.get('TODO_CHANGES_MAX_CLIENTS', '0'))
+
+# Profiling (see profiling.py), off by default. A fraction TODO_PROFILE_RATE of
+# the requests (0.01: one in a hundred) runs under cProfile, and with
+# TODO_PROFILE_HEADER=1 so does any request sent with "X-Profile: 1". Their
+# statistics add up and are served at GET /debug/profile (see send_profile;
+# DELETE starts over) and, with TODO_PROFILE_FILE set, written there in the
+# pstats format every TODO_PROFILE_DUMP_SECONDS and on shutdown.
+# Requests taking TODO_SLOW_REQUEST_MS or longer (0: off) are logged with the
+# time of each of their phases; long polls and event streams are left out.
+PROFILE_RATE = float(os.environ.get('TODO_PROFILE_RATE', '0'))
+PROFILE_HEADER = os.environ.get('TODO_PROFILE_HEADER', '0') == '1'
+PROFILE_FILE = os.environ.get('TODO_PROFILE_FILE', '')
+PROFILE_DUMP_SECONDS = float(os.environ.get('TODO_PROFILE_DUMP_SECONDS', '10'))
+SLOW_REQUEST_MS = float(os.environ.get('TODO_SLOW_REQUEST_MS', '0'))
+
+# Most items (creates + updates + deletes) accepted by one POST /todo/batch
+BATCH_LIMIT = int(os.environ.get('TODO_BATCH_LIMIT', '10000'))
+BATCH_SECTIONS = ("create", "update", "delete")
+
+# Served at GET /metrics (see metrics.py); persistence.py adds bytes written and save times
+REQUESTS = registry.counter(
+    "todo_http_requests_total", "HTTP requests answered", ["method", "route", "status"])
+ERRORS = registry.counter(
+    "todo_http_errors_total", "HTTP responses with a 4xx or 5xx status", ["status"])
+REQUEST_SECONDS = registry.histogram(
+    "todo_http_request_duration_seconds", "Time from reading a request to finishing its response",
+    ["method", "route"])
+JSON_SECONDS = registry.histogram(
+    "todo_json_seconds", "Time spent encoding responses and decoding request bodies", ["op"])
+REJECTED = registry.counter(
+    "todo_http_rejected_total", "Requests turned away by admission control", ["reason"])
+SLOW_REQUESTS = registry.counter(
+    "todo_http_slow_requests_total", "Requests that took TODO_SLOW_REQUEST_MS or longer", ["method", "route"])
+registry.gauge("todo_store_todos", "Todos in the store", lambda: len(store))
+registry.gauge("todo_http_requests_active", "Requests running right now", lambda: limiter.active)
+registry.gauge("todo_http_requests_waiting", "Requests waiting for a free slot", lambda: limiter.waiting)
+
+registry.gauge("todo_changes_waiting", "Clients waiting for changes on GET /todo/changes",
+               lambda: change_feed.waiters)
+
+limiter = ConcurrencyLimiter(MAX_CONCURRENT, MAX_QUEUE, QUEUE_TIMEOUT_MS / 1000)
+rate_limiter = RateLimiter(RATE_LIMIT, RATE_BURST) if RATE_LIMIT > 0 else None
+codec = get_codec(JSON_CODEC)
+profiler = RequestProfiler(PROFILE_RATE, PROFILE_HEADER, PROFILE_FILE or None, PROFILE_DUMP_SECONDS)
+
+change_feed = ChangeFeed(CHANGES_BUFFER)
+
+if STORAGE_BACKEND == 'json' and SHARDS > 1 and PERSISTENCE_MODE != 'json':
+    raise ValueError("Sharded mode (TODO_SHARDS) only supports TODO_PERSISTENCE=json")
+
+wal = None
+if STORAGE_BACKEND == 'json' and PERSISTENCE_MODE == 'wal':
+    wal = WriteAheadLog(
+        TODO_FILENAME + ".wal",
+        snapshot_provider=lambda: store.snapshot(),
+        export_path=TODO_FILENAME,
+        snapshot_writer=(lambda items: write_snapshot(SNAPSHOT_FILENAME, items)) if SNAPSHOT_FILENAME else None,
+        fsync_policy=FSYNC_POLICY,
+        fsync_interval_ms=FSYNC_INTERVAL_MS,
+        compact_every=WAL_COMPACT_EVERY,
+    )
+
+writer = None
+if STORAGE_BACKEND == 'json' and PERSISTENCE_MODE == 'group':
+    writer = GroupCommitWriter(TODO_FILENAME, snapshot_provider=lambda: store.all(),
+                               window_ms=COMMIT_WINDOW_MS)
+
 def load_todos():
+    """
+    Loads the todos as a dict of todo id -> todo.
+    Files written before todos had ids get them assigned in list order; the ids
+    are the same on every load and are written out with the next save.
+    The file is read one todo at a time (see loader.py); damaged records are
+    skipped and reported rather than costing every other todo.
+    With a current snapshot (see SNAPSHOT_FILENAME) the todos come from it
+    instead, as a snapshot.LazyTodos.
+    """
+    todo = None
+    if snapshot_is_current():
+        try:
+            todo = load_snapshot(SNAPSHOT_FILENAME)
+        except (OSError, SnapshotError) as e:
+            print(f"Error loading snapshot, falling back to {TODO_FILENAME}: {e}")
+    if todo is None:
+        errors = []
         try:
-            with open(TODO_FILENAME, "r") as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return []
+            todo = index_todos(read_todos(TODO_FILENAME, errors, progress=ProgressPrinter(TODO_FILENAME)))
+        except FileNotFoundError:
+            todo = {}
+        if errors:
+            keep_damaged_file(errors)
+
+    # In wal mode the file is only the starting point; the log holds later changes
+    if wal is not None:
+        todo = wal.replay(todo)
+    return todo
+
+def keep_damaged_file(errors, path=None):
+    """
+    Reports the records skipped while loading path (default: TODO_FILENAME) and
+    copies the file aside, since the next save writes out only the todos that
+    were loaded.
+    """
+    path = path or TODO_FILENAME
+    backup = f"{path}.damaged-{time.strftime('%Y%m%d-%H%M%S')}"
+    try:
+        shutil.copyfile(path, backup)
+        print(f"Skipped {len(errors)} damaged part(s) of {path}; the original is kept as {backup}")
+    except OSError as e:
+        print(f"Error copying damaged {path} aside: {e}")
+    for error in errors[:10]:
+        print(f"  at character {error.offset}: {error.message}")
+    if len(errors) > 10:
+        print(f"  ... and {len(errors) - 10} more")
+
+def snapshot_is_current():
+    """Returns: True if there is a snapshot and it doesn't predate the todos file"""
+    if not SNAPSHOT_FILENAME or not os.path.exists(SNAPSHOT_FILENAME):
+        return False
+    if wal is not None or not os.path.exists(TODO_FILENAME):
+        return True
+    return os.path.getmtime(SNAPSHOT_FILENAME) >= os.path.getmtime(TODO_FILENAME)
 
-def save_todos(todo):
+def save_todos(todo, path=None):
+    # Written to a temp file and renamed, so a crash never leaves a half-written file
     try:
-        with open(TODO_FILENAME, "w") as f:
-            json.dump(todo, f, indent = 2)
+        with SAVE_SECONDS.time("json"):
+            write_file_atomically(path or TODO_FILENAME, json.dumps(todo, indent = 2).encode())
     except Exception as e:
         print(f"Error saving todos: {e}")
 
-def validate_todo_data(data):
+def record_change(records):
     """
-    Validates todo item data for POST (full object required).
-    Returns: (is_valid, error_message)
+    Persists the records of one mutation (or of a whole batch) of the todos,
+    then publishes them to the change feed.
+    In wal mode only the records are appended, in group mode the background
+    writer is told to save; otherwise the whole list is saved once right here.
     """
-    # Check if data is a dictionary
-    if not isinstance(data, dict):
-        return (False, "Todo must be a JSON object")
+    with phase("persist"):
+        if writer is not None:
+            writer.submit()
+        elif wal is None:
+            save_todos(store.snapshot())
+        else:
+            try:
+                wal.append(records)
+            except Exception as e:
+                print(f"Error writing log: {e}")
+    change_feed.publish(records)
 
-    # Check if 'task' field exists
-    if 'task' not in data:
-        return (False, "Task field is required")
+def record_shard_change(index, records):
+    """on_change of shard index in sharded mode: rewrites that shard's file only."""
+    with phase("persist"):
+        save_todos(store.shards[index].snapshot(), shard_path(TODO_FILENAME, index))
+    change_feed.publish(records)
 
-    # Check if 'task' is a string
-    if not isinstance(data['task'], str):
-        return (False, "Task must be a string")
+def close_persistence():
+    """Drains pending writes and closes the log or database on a clean shutdown."""
+    change_feed.close()
+    if writer is not None:
+        writer.close()
+    if wal is not None:
+        wal.close()
+    store.close()
 
-    # Check if 'task' is not empty or just whitespace
-    task = data['task'].strip()
-    if len(task) == 0:
-        return (False, "Task cannot be empty or whitespace")
+def encode_json(data):
+    with phase("serialize"):
+        start = time.perf_counter()
+        body = codec.dumps(data)
+        JSON_SECONDS.observe(time.perf_counter() - start, "encode")
+    return body
 
-    # Check task length (1-500 characters)
-    if len(task) > 500:
-        return (False, "Task is too long (maximum 500 characters)")
+def encode_todo_list():
+    """Returns: the body of a plain GET /todo, joined from the todos' kept encodings (see FRAGMENT_CACHE)"""
+    with phase("serialize"):
+        start = time.perf_counter()
+        body = b"[" + codec.separator.join(store.fragments(codec.dumps)) + b"]"
+        JSON_SECONDS.observe(time.perf_counter() - start, "encode")
+    return body
 
-    # Check optional 'completed' field if present
-    if 'completed' in data:
-        if not isinstance(data['completed'], bool):
-            return (False, "Completed field must be a boolean (true/false)")
+def decode_json(body):
+    """Raises: ValueError (or json.JSONDecodeError) if body isn't valid JSON"""
+    with phase("parse"):
+        start = time.perf_counter()
+        data = codec.loads(body)
+        JSON_SECONDS.observe(time.perf_counter() - start, "decode")
+    return data
 
-    # Check optional 'description' field if present
-    if 'description' in data:
-        if not isinstance(data['description'], str):
-            return (False, "Description must be a string")
-        if len(data['description']) > 1000:
-            return (False, "Description is too long (maximum 1000 characters)")
+def route_of(path):
+    """Returns: the route a request path belongs to, so metrics get one series per route"""
+    path = urlsplit(path).path
+    if path in ("/todo", "/todo/batch", "/todo/changes", "/metrics", "/debug/profile"):
+        return path
+    if path.startswith("/todo/id/"):
+        return "/todo/id/{id}"
+    if path.startswith("/todo/"):
+        return "/todo/{index}"
+    return "other"
 
-    return (True, None)
+def validate_todo_data(data):
+    """
+    Validates todo item data for POST (full object required), see validation.py.
+    Returns: (is_valid, error_message)
+    """
+    error_message = todo_validator.first_error(data)
+    return (error_message is None, error_message)
 
 
 def validate_partial_todo_data(data):
@@ -66,140 +352,934 @@ def validate_partial_todo_data(data):
     Validates partial todo data for PUT (only validates fields that are present).
     Returns: (is_valid, error_message)
     """
-    # Check if data is a dictionary
+    error_message = update_validator.first_error(data)
+    return (error_message is None, error_message)
+
+
+def parse_batch(data):
+    """
+    Validates a POST /todo/batch body:
+      {"create": [todo, ...], "update": [{"id": 1, ...fields}, ...], "delete": [id, ...]}
+    Every item is checked against the same schema as the single-item routes,
+    each section in one pass, and every problem with an item is reported.
+    Returns: (error_message, operations, item_errors)
+      error_message - set when the body as a whole is unusable
+      operations    - (creates, updates as (id, fields) pairs, deletes)
+      item_errors   - per section, the list of problems with every item
+                      (empty if it has none)
+    """
     if not isinstance(data, dict):
-        return (False, "Todo must be a JSON object")
+        return ("Batch must be a JSON object", None, None)
+    for name in data:
+        if name not in BATCH_SECTIONS:
+            return (f"Unknown batch section: {name}", None, None)
+
+    sections = {}
+    for name in BATCH_SECTIONS:
+        sections[name] = data.get(name, [])
+        if not isinstance(sections[name], list):
+            return (f"'{name}' must be a list", None, None)
+
+    total = sum(len(items) for items in sections.values())
+    if total == 0:
+        return ("Batch is empty", None, None)
+    if total > BATCH_LIMIT:
+        return (f"Batch is too large (maximum {BATCH_LIMIT} items)", None, None)
+
+    item_errors = {"create": todo_validator.errors_each(sections["create"])}
+
+    updates = []
+    has_id = []
+    for item in sections["update"]:
+        has_id.append(isinstance(item, dict) and is_valid_id(item.get("id")))
+        if has_id[-1]:
+            updates.append((item["id"], {key: value for key, value in item.items() if key != "id"}))
+    field_errors = iter(update_validator.errors_each([fields for _, fields in updates]))
+    item_errors["update"] = [next(field_errors) if valid else ["Update must be an object with a numeric id"]
+                             for valid in has_id]
 
-    # Check if at least one field is provided
-    if len(data) == 0:
-        return (False, "At least one field must be provided for update")
+    item_errors["delete"] = [[] if is_valid_id(todo_id) else ["Delete must be a numeric id"]
+                             for todo_id in sections["delete"]]
 
-    # Validate 'task' field if present
-    if 'task' in data:
-        if not isinstance(data['task'], str):
-            return (False, "Task must be a string")
+    return (None, (sections["create"], updates, sections["delete"]), item_errors)
 
-        task = data['task'].strip()
-        if len(task) == 0:
-            return (False, "Task cannot be empty or whitespace")
 
-        if len(task) > 500:
-            return (False, "Task is too long (maximum 500 characters)")
+def parse_list_query(query):
+    """
+    Parses the query string of GET /todo.
+    Returns: dict with limit, cursor, completed, q and format (None when not given)
+    Raises: ValueError with a client-facing message for bad values
+    """
+    params = {name: values[-1] for name, values in parse_qs(query).items()}
+    parsed = {"limit": None, "cursor": None, "completed": None, "q": params.get("q"),
+              "format": params.get("format")}
+
+    if "limit" in params:
+        try:
+            parsed["limit"] = int(params["limit"])
+        except ValueError:
+            raise ValueError("Invalid limit")
+        if not 1 <= parsed["limit"] <= MAX_PAGE_SIZE:
+            raise ValueError(f"Limit must be between 1 and {MAX_PAGE_SIZE}")
+
+    if "cursor" in params:
+        try:
+            parsed["cursor"] = int(params["cursor"])
+        except ValueError:
+            raise ValueError("Invalid cursor")
+        if not 0 <= parsed["cursor"] <= MAX_ID:
+            raise ValueError("Invalid cursor")
 
-    # Validate 'completed' field if present
-    if 'completed' in data:
-        if not isinstance(data['completed'], bool):
-            return (False, "Completed field must be a boolean (true/false)")
+    if "completed" in params:
+        if params["completed"] not in ("true", "false"):
+            raise ValueError("Completed filter must be true or false")
+        parsed["completed"] = params["completed"] == "true"
 
-    # Validate 'description' field if present
-    if 'description' in data:
-        if not isinstance(data['description'], str):
-            return (False, "Description must be a string")
-        if len(data['description']) > 1000:
-            return (False, "Description is too long (maximum 1000 characters)")
+    if parsed["format"] not in (None, "json", "ndjson"):
+        raise ValueError("Format must be json or ndjson")
+    return parsed
 
-    return (True, None)
 
+def parse_changes_query(query, last_event_id=None):
+    """
+    Parses the query string of GET /todo/changes. A Last-Event-ID header (sent
+    by a reconnecting event stream) takes the place of since.
+    Returns: dict with since (None when not given), wait (seconds) and format
+    Raises: ValueError with a client-facing message for bad values
+    """
+    params = {name: values[-1] for name, values in parse_qs(query).items()}
+    since = last_event_id if last_event_id is not None else params.get("since")
+    parsed = {"since": None, "wait": 0.0, "format": params.get("format")}
 
-todo = load_todos()
+    if since is not None:
+        try:
+            parsed["since"] = int(since)
+        except ValueError:
+            raise ValueError("Invalid since")
+        if parsed["since"] < 0:
+            raise ValueError("Invalid since")
+
+    if "wait" in params:
+        try:
+            parsed["wait"] = float(params["wait"])
+        except ValueError:
+            raise ValueError("Invalid wait")
+        if not 0 <= parsed["wait"] <= CHANGES_MAX_WAIT:
+            raise ValueError(f"Wait must be between 0 and {CHANGES_MAX_WAIT:g} seconds")
+
+    if parsed["format"] not in (None, "json", "sse"):
+        raise ValueError("Format must be json or sse")
+    return parsed
+
+
+def list_todos(params):
+    """Returns: the GET /todo response body for parsed (non-streaming) query parameters"""
+    if params["limit"] is not None or params["cursor"] is not None:
+        items, next_after = store.page(params["limit"] or DEFAULT_PAGE_SIZE, after=params["cursor"],
+                                       completed=params["completed"], query=params["q"])
+        next_cursor = str(next_after) if next_after is not None else None
+        return {"items": items, "next_cursor": next_cursor}
+    if params["completed"] is not None or params["q"] is not None:
+        items, _ = store.page(None, completed=params["completed"], query=params["q"])
+        return items
+    return store.all()
+
+
+def get_todo(todo_id):
+    """Returns: (status_code, data) for GET /todo/id/<id>"""
+    item = store.get(todo_id)
+    if item is None:
+        return 404, {"error": "Task not found"}
+    return 200, item
+
+
+def make_json_store(todo, on_change=record_change):
+    """Returns: the in-memory store for the json backend, in the configured memory layout"""
+    if MEMORY_LAYOUT not in ('compact', 'dict'):
+        raise ValueError(f"Unknown memory layout: {MEMORY_LAYOUT}")
+    # Packing would decode every todo up front, the very thing a snapshot avoids
+    if MEMORY_LAYOUT == 'dict' or isinstance(todo, LazyTodos):
+        return TodoStore(todo, on_change=on_change)
+    return CompactTodoStore(todo, on_change=on_change)
+
+
+def make_sharded_store():
+    """
+    Returns: the sharded store for the json backend (see SHARDS), with every
+             shard file written out if the todos had to be split up first
+    """
+    parts, errors, rewrite = load_shards(TODO_FILENAME, SHARDS, SHARD_LOADERS)
+    for path, file_errors in errors.items():
+        keep_damaged_file(file_errors, path)
+    sharded = ShardedTodoStore(make_json_store(part, on_change=lambda records, index=index:
+                                               record_shard_change(index, records))
+                               for index, part in enumerate(parts))
+    if rewrite:
+        for index, shard in enumerate(sharded.shards):
+            save_todos(shard.snapshot(), shard_path(TODO_FILENAME, index))
+        remove_extra_shards(TODO_FILENAME, SHARDS)
+    return sharded
+
+
+def merge_shard_files():
+    """
+    Merges the shard files left by an earlier run with TODO_SHARDS above 1 into
+    TODO_FILENAME, which sharded mode leaves as it was, and deletes them.
+    Raises: ValueError in wal mode, where the log would be replayed over them
+    """
+    if not existing_shard_paths(TODO_FILENAME):
+        return
+    if wal is not None:
+        raise ValueError(f"Found shard files of {TODO_FILENAME}: start once with TODO_PERSISTENCE=json "
+                         "to merge them before switching to wal mode")
+    parts, errors, _ = load_shards(TODO_FILENAME, 1, SHARD_LOADERS)
+    for path, file_errors in errors.items():
+        keep_damaged_file(file_errors, path)
+    # Not save_todos: the shard files only go once the merged file is safely written
+    write_file_atomically(TODO_FILENAME, json.dumps(list(parts[0].values()), indent = 2).encode())
+    remove_extra_shards(TODO_FILENAME, 0)
+    print(f"Merged the shard files of {TODO_FILENAME} back into it")
+
+
+if STORAGE_BACKEND == 'sqlite':
+    store = SqliteTodoStore(TODO_DB, fsync_policy=FSYNC_POLICY, on_change=change_feed.publish)
+elif STORAGE_BACKEND == 'json' and SHARDS > 1:
+    store = make_sharded_store()
+elif STORAGE_BACKEND == 'json':
+    merge_shard_files()
+    store = make_json_store(load_todos())
+else:
+    raise ValueError(f"Unknown storage backend: {STORAGE_BACKEND}")
+response_cache = ResponseCache(CACHE_ENTRIES, CACHE_BYTES)
 
 class ToDoHandler(BaseHTTPRequestHandler):
+    # Persistent connections: every response carries its length (or is chunked),
+    # and a connection idle for IDLE_TIMEOUT seconds is closed
+    protocol_version = "HTTP/1.1"
+    timeout = IDLE_TIMEOUT
+    # Headers and body are separate writes; with Nagle's algorithm on, the body
+    # of a kept-alive response would wait for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def handle_one_request(self):
+        self.request_start = None
+        self.response_status = None
+        self.admitted = False
+        self.profile = None
+        self.feed_slot = None
+        try:
+            super().handle_one_request()
+        finally:
+            if self.profile is not None:
+                profiler.finish(self.profile)
+            if self.feed_slot is not None:
+                self.feed_slot.leave()
+            if self.admitted:
+                limiter.leave()
+            timer = stop_timer()
+        if self.request_start is not None and self.response_status is not None:
+            method = self.command or "UNKNOWN"
+            route = route_of(self.path) if self.command else "other"
+            end = time.perf_counter()
+            REQUEST_SECONDS.observe(end - self.request_start, method, route)
+            REQUESTS.inc(method, route, str(self.response_status))
+            if self.response_status >= 400:
+                ERRORS.inc(str(self.response_status))
+            if timer is not None and (end - self.request_start) * 1000 >= SLOW_REQUEST_MS:
+                SLOW_REQUESTS.inc(method, route)
+                print(f"Slow request: {method} {self.path} {self.response_status} in "
+                      f"{(end - self.request_start) * 1000:.1f} ms ({format_breakdown(timer.breakdown(end))})")
+
+    def send_response(self, code, message=None):
+        self.response_status = code
+        super().send_response(code, message)
+
+    def parse_request(self):
+        # Timed from here: the request line has arrived, idle time is over
+        self.request_start = time.perf_counter()
+        if SLOW_REQUEST_MS > 0:
+            start_timer(self.request_start)
+        self.body_read = False
+        if not super().parse_request():
+            return False
+        if "Transfer-Encoding" in self.headers:
+            # Request bodies must come with a Content-Length
+            self.send_error(411)
+            return False
+        if self.body_encoding() not in ("identity", *ENCODINGS):
+            self.send_error(415, "Unsupported Content-Encoding")
+            return False
+        if not self.admit():
+            return False
+        if profiler.enabled and urlsplit(self.path).path != "/debug/profile":
+            self.profile = profiler.start(requested=self.headers.get("X-Profile", "").strip() == "1")
+        return True
+
+    def admit(self):
+        """
+        Applies admission control before the request runs (see admission.py).
+        /metrics and /debug/profile are exempt, so an overloaded server can still be watched.
+        Returns: False if the request was turned away (its response has been sent)
+        """
+        if urlsplit(self.path).path in ("/metrics", "/debug/profile"):
+            return True
+        try:
+            too_big = int(self.headers.get("Content-Length", 0)) > MAX_BODY_BYTES
+        except ValueError:
+            # read_body answers an invalid length with 400
+            too_big = False
+        if too_big:
+            REJECTED.inc("body_too_large")
+            self.send_json_response(413, {"error": f"Request body is larger than {MAX_BODY_BYTES} bytes"})
+            return False
+        if rate_limiter is not None:
+            wait = rate_limiter.check(self.client_address[0])
+            if wait:
+                REJECTED.inc("rate_limited")
+                self.send_json_response(429, {"error": "Too many requests"}, {"Retry-After": retry_after_header(wait)})
+                return False
+        if not limiter.enter():
+            REJECTED.inc("overloaded")
+            self.send_json_response(503, {"error": "Server is overloaded, retry later"},
+                                    {"Retry-After": retry_after_header(RETRY_AFTER)})
+            return False
+        self.admitted = True
+        return True
+
+    def enter_feed(self):
+        """
+        Takes a slot for a feed client about to wait (see CHANGES_MAX_CLIENTS).
+        Returns: False if there is none left (a 503 response has been sent)
+        """
+        feed_limiter = getattr(self.server, "feed_limiter", None)
+        if feed_limiter is None:
+            return True
+        if not feed_limiter.enter():
+            REJECTED.inc("feed_full")
+            self.send_json_response(503, {"error": "Too many clients waiting for changes, retry later"},
+                                    {"Retry-After": retry_after_header(RETRY_AFTER)})
+            return False
+        self.feed_slot = feed_limiter
+        return True
+
+    def release_admission(self):
+        """
+        Gives up the request's admission slot, before it waits for changes
+        rather than working. Waiting isn't slowness, so the request isn't
+        logged as slow either.
+        """
+        stop_timer()
+        if self.admitted:
+            limiter.leave()
+            self.admitted = False
+
+    def body_encoding(self):
+        return self.headers.get("Content-Encoding", "identity").strip().lower()
+
+    def read_body(self):
+        """
+        Reads the request body, inflating it if it was sent gzip or deflate
+        compressed. It must be read in full before the next request on the
+        connection can be parsed.
+        Returns: the body as bytes
+        Raises: ValueError if Content-Length is not a valid length or the
+                compressed body can't be decoded
+        """
+        content_length = int(self.headers.get("Content-Length", 0))
+        if content_length < 0:
+            raise ValueError("Negative Content-Length")
+        self.body_read = True
+        with phase("read"):
+            body = self.rfile.read(content_length)
+            if self.body_encoding() != "identity":
+                body = decompress(body, self.body_encoding(), MAX_INFLATED_BYTES)
+        return body
+
+    def end_headers(self):
+        # A body that was never read would be parsed as the next request, and in
+        # the pool engine an idle connection keeps others waiting for a worker,
+        # so in both cases the connection is closed after this response
+        if not self.close_connection and (self.body_pending() or self.server_is_busy()):
+            self.send_header("Connection", "close")
+        super().end_headers()
+
+    def body_pending(self):
+        """Returns: True if the request came with a body that hasn't been read"""
+        if self.body_read:
+            return False
+        return self.headers.get("Content-Length", "0").strip() not in ("", "0")
+
+    def server_is_busy(self):
+        is_busy = getattr(self.server, "has_waiting_connections", None)
+        return is_busy is not None and is_busy()
+
+    def send_json_response(self, status_code, data, headers=None):
+        self.send_json_bytes(status_code, encode_json(data), headers)
+
+    def send_json_bytes(self, status_code, body, headers=None):
+        encoding = self.response_encoding(body)
+        if encoding is not None:
+            with phase("compress"):
+                body = compress(body, encoding, COMPRESS_LEVEL)
+        self.send_encoded(status_code, body, encoding, headers)
+
+    def response_encoding(self, body):
+        """Returns: the content coding to send body with, or None to send it as is"""
+        if len(body) < COMPRESS_MIN_BYTES:
+            return None
+        return choose_encoding(self.headers.get("Accept-Encoding"))
+
+    def send_encoded(self, status_code, body, encoding, headers=None, content_type="application/json"):
+        """Sends a body that is already compressed with encoding (None if it isn't)."""
+        with phase("write"):
+            self.send_response(status_code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Vary", "Accept-Encoding")
+            if encoding is not None:
+                self.send_header("Content-Encoding", encoding)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+    def send_cached_json(self, produce, encoded=False):
+        """
+        Answers a GET from the response cache while the store is unchanged since
+        the response was encoded, and with 304 if the client already has it.
+        produce() returns (status_code, data) and is only called on a miss (with
+        encoded set, data is the body, already encoded); only 200 responses are
+        cached, along with their compressed copies.
+        """
+        version = store.version
+        entry = response_cache.get(self.path, version)
+        if entry is None:
+            with phase("query"):
+                status_code, data = produce()
+            body = data if encoded else encode_json(data)
+            if status_code != 200:
+                self.send_json_bytes(status_code, body)
+                return
+            entry = response_cache.put(self.path, version, body)
+
+        encoding = self.response_encoding(entry.body)
+        etag = encoded_etag(entry.etag, encoding)
+        if etag_matches(self.headers.get("If-None-Match"), etag):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+        elif encoding is None:
+            self.send_encoded(200, entry.body, None, {"ETag": etag})
+        else:
+            with phase("compress"):
+                body = response_cache.encoded(self.path, entry, encoding,
+                                              lambda body: compress(body, encoding, COMPRESS_LEVEL))
+            self.send_encoded(200, body, encoding, {"ETag": etag})
+
+    def todo_id_from_path(self):
+        """
+        Works out which todo a /todo/... path refers to.
+        /todo/id/<id> addresses a todo by its stable id. The old positional
+        /todo/<index> routes still work: the index is mapped to the id currently
+        at that position and the response is marked as deprecated.
+        Returns: (todo_id, extra_headers) - todo_id is None for an out of range index
+        Raises: ValueError if the id or index is not a number
+        """
+        parts = self.path.split("/")
+        if len(parts) == 4 and parts[2] == "id":
+            return int(parts[3]), {}
 
+        index = int(parts[-1])
+        with phase("query"):
+            todo_id = store.id_at(index)
+        headers = {"Deprecation": "true"}
+        if todo_id is not None:
+            headers["Link"] = f'</todo/id/{todo_id}>; rel="successor-version"'
+        return todo_id, headers
 
-    def send_json_response(self, status_code, data):
-        self.send_response(status_code)
-        self.send_header("Content-Type", "application/json")
+    def send_todo_list(self, query):
+        """
+        GET /todo with query parameters:
+          completed=true|false   only todos with that completed value
+          q=words                only todos whose task or description contain
+                                 every word (case-insensitive)
+          limit=N&cursor=C       one page of at most N todos after cursor C, sent as
+                                 {"items": [...], "next_cursor": "..." or null}
+          format=ndjson          every matching todo streamed as one JSON line each
+                                 (also chosen by Accept: application/x-ndjson)
+        Without limit or cursor the response is a plain list like GET /todo.
+        """
+        try:
+            params = parse_list_query(query)
+        except ValueError as e:
+            self.send_json_response(400, {"error": str(e)})
+            return
+
+        wants_ndjson = "application/x-ndjson" in (self.headers.get("Accept") or "")
+        if params["format"] == "ndjson" or (params["format"] is None and wants_ndjson):
+            self.stream_todos(params["completed"], params["q"])
+        elif FRAGMENT_CACHE and all(params[name] is None for name in ("limit", "cursor", "completed", "q")):
+            self.send_cached_json(lambda: (200, encode_todo_list()), encoded=True)
+        else:
+            self.send_cached_json(lambda: (200, list_todos(params)))
+
+    def stream_todos(self, completed, query=None):
+        """
+        Writes matching todos as NDJSON a batch at a time, so neither the whole
+        list nor its encoding is ever held in memory. The read lock is only held
+        while each batch is fetched, so slow clients don't hold up writers.
+        """
+        # The length isn't known up front: HTTP/1.1 clients get one chunk per
+        # batch, older ones get the body up to the end of the connection
+        chunked = self.request_version != "HTTP/1.0"
+        encoding = choose_encoding(self.headers.get("Accept-Encoding"))
+        compressor = StreamCompressor(encoding, COMPRESS_LEVEL) if encoding is not None else None
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Vary", "Accept-Encoding")
+        if encoding is not None:
+            self.send_header("Content-Encoding", encoding)
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Connection", "close")
+        self.end_headers()
+
+        def write(data):
+            if data:
+                with phase("write"):
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data) if chunked else data)
+
+        after = None
+        while True:
+            with phase("query"):
+                items, after = store.page(STREAM_BATCH_SIZE, after=after, completed=completed, query=query)
+            if items:
+                with phase("serialize"):
+                    start = time.perf_counter()
+                    data = b"".join(codec.dumps(item) + b"\n" for item in items)
+                    JSON_SECONDS.observe(time.perf_counter() - start, "encode")
+                # Each batch is flushed through the compressor so it can be decoded on arrival
+                if compressor is not None:
+                    with phase("compress"):
+                        data = compressor.compress(data)
+                write(data)
+            if after is None:
+                break
+        if compressor is not None:
+            write(compressor.finish())
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
+
+    def send_changes(self, query):
+        """
+        GET /todo/changes, the change feed (see changes.py):
+          since=N        the changes after sequence number N; without it none,
+                         only the number to follow the feed from
+          wait=S         long poll: with no changes yet, wait up to S seconds for one
+          format=sse     Server-Sent Events, one event per change for as long as
+                         the stream lasts (also chosen by Accept: text/event-stream)
+        Answered with {"changes": [...], "last_seq": M}; ask for since=M next.
+        If the changes after N are gone the answer is 410, also with last_seq:
+        reload GET /todo, then follow the feed from there.
+        """
+        try:
+            params = parse_changes_query(query, self.headers.get("Last-Event-ID"))
+        except ValueError as e:
+            self.send_json_response(400, {"error": str(e)})
+            return
+
+        wants_sse = "text/event-stream" in (self.headers.get("Accept") or "")
+        if params["format"] == "sse" or (params["format"] is None and wants_sse):
+            self.stream_changes(params["since"])
+            return
+
+        # A waiting long poll costs a thread, not work, so it doesn't hold an admission slot
+        if params["wait"]:
+            if not self.enter_feed():
+                return
+            self.release_admission()
+        since = params["since"] if params["since"] is not None else change_feed.last
+        changes, last = change_feed.since(since, params["wait"])
+        if changes is None:
+            self.send_json_response(410, {"error": "Changes since this sequence number are gone, reload the todos",
+                                          "last_seq": last})
+        else:
+            self.send_json_response(200, {"changes": changes, "last_seq": last})
+
+    def stream_changes(self, since):
+        """
+        Sends changes as Server-Sent Events until the client goes away or
+        CHANGES_STREAM_SECONDS have passed. Every event carries its sequence
+        number as id, so a reconnecting EventSource resumes where it stopped.
+        A "resync" event means the changes in between are gone: reload the
+        todos, the stream goes on from there.
+        """
+        if not self.enter_feed():
+            return
+        self.release_admission()
+        chunked = self.request_version != "HTTP/1.0"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Connection", "close")
         self.end_headers()
-        self.wfile.write(json.dumps(data).encode())
 
-    
+        def write(data):
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data) if chunked else data)
+
+        seq = since if since is not None else change_feed.last
+        deadline = time.monotonic() + CHANGES_STREAM_SECONDS
+        try:
+            # An id without data sets where a reconnect resumes, without an event
+            write(b"id: %d\n\n" % seq)
+            while not change_feed.closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                changes, last = change_feed.since(seq, min(CHANGES_HEARTBEAT, remaining))
+                if changes is None:
+                    write(b"id: %d\nevent: resync\ndata: %s\n\n" % (last, encode_json({"last_seq": last})))
+                elif changes:
+                    write(b"".join(b"id: %d\nevent: change\ndata: %s\n\n" % (change["seq"], encode_json(change))
+                                   for change in changes))
+                else:
+                    write(b": keep-alive\n\n")
+                seq = last
+            if chunked:
+                self.wfile.write(b"0\r\n\r\n")
+        except ConnectionError:
+            # Most streams end with the client going away
+            self.close_connection = True
+
+    def wait_for_durability(self):
+        """
+        In group mode, waits until the change just made is on disk, unless the
+        client asked not to with "X-Durability: async".
+        Returns: False if saving failed (a 500 response has been sent)
+        """
+        if writer is None:
+            return True
+        durability = self.headers.get("X-Durability", DEFAULT_DURABILITY).strip().lower()
+        if durability == "async":
+            return True
+        with phase("persist"):
+            if writer.flush():
+                return True
+        self.send_json_response(500, {"error": "Change was applied but could not be saved"})
+        return False
+
+    def send_invalid_path_error(self):
+        if self.path.startswith("/todo/id/"):
+            self.send_json_response(400, {"error": "Invalid id"})
+        else:
+            self.send_json_response(400, {"error": "Invalid index"})
+
+    def send_metrics(self):
+        body = registry.render()
+        encoding = self.response_encoding(body)
+        if encoding is not None:
+            body = compress(body, encoding, COMPRESS_LEVEL)
+        self.send_encoded(200, body, encoding, content_type=METRICS_CONTENT_TYPE)
+
+    def send_profile(self, query):
+        """
+        GET /debug/profile, the statistics of the profiled requests (see PROFILE_RATE):
+          sort=cumulative|tottime|calls   how the functions are ordered (default cumulative)
+          limit=N                         how many of them are listed (default 50)
+          format=pstats                   the statistics in the pstats file format
+                                          (for pstats.Stats or snakeviz) instead of text
+        404 while profiling is off.
+        """
+        if not profiler.enabled:
+            self.send_json_response(404, {"error": "Profiling is off"})
+            return
+        params = {name: values[-1] for name, values in parse_qs(query).items()}
+        if params.get("format") == "pstats":
+            self.send_encoded(200, profiler.dump_bytes(), None, content_type="application/octet-stream")
+            return
+        try:
+            limit = int(params.get("limit", "50"))
+            if limit < 1:
+                raise ValueError
+        except ValueError:
+            self.send_json_response(400, {"error": "Invalid limit"})
+            return
+        try:
+            body = profiler.report(params.get("sort", "cumulative"), limit).encode()
+        except ValueError as e:
+            self.send_json_response(400, {"error": str(e)})
+            return
+        encoding = self.response_encoding(body)
+        if encoding is not None:
+            body = compress(body, encoding, COMPRESS_LEVEL)
+        self.send_encoded(200, body, encoding, content_type="text/plain; charset=utf-8")
 
     def do_GET(self):
-        if self.path == "/todo":
-        # Get ALL todos
-            self.send_json_response(200, todo)
+        url = urlsplit(self.path)
+        if url.path == "/metrics":
+            self.send_metrics()
+        elif url.path == "/debug/profile":
+            self.send_profile(url.query)
+        elif url.path == "/todo":
+        # Get ALL todos (or a filtered page / stream of them)
+            self.send_todo_list(url.query)
+        elif url.path == "/todo/changes":
+            self.send_changes(url.query)
         elif self.path.startswith("/todo/"):
             try:
-                index = int(self.path.split("/")[-1])
+                todo_id, headers = self.todo_id_from_path()
 
-                if 0<= index< len(todo):
-                    self.send_json_response(200, todo[index])
+                if not headers:
+                    # Only the stable id routes are cached; the positional
+                    # ones answer with their deprecation headers every time
+                    self.send_cached_json(lambda: get_todo(todo_id))
+                    return
+
+                item = store.get(todo_id)
+                if item is not None:
+                    self.send_json_response(200, item, headers)
                 else:
-                    self.send_json_response(404, {"error": "Task not found"})
+                    self.send_json_response(404, {"error": "Task not found"}, headers)
             except ValueError:
-                self.send_json_response(400, {"error": "Invalid index"})
+                self.send_invalid_path_error()
         else:
             self.send_json_response(404, {"error": "Path not found"})
 
+    def handle_batch(self):
+        """
+        POST /todo/batch: validates every item, then applies the whole batch
+        atomically with a single save. Each item gets its own result; if any item
+        fails, nothing is applied and the others are reported as 424. An invalid
+        item's result lists all its problems in "errors", the first in "error".
+        """
+        try:
+            data = decode_json(self.read_body())
+        except (ValueError, json.JSONDecodeError):
+            self.send_json_response(400, {"error": "Invalid JSON"})
+            return
+
+        with phase("validate"):
+            error_message, operations, item_errors = parse_batch(data)
+        if error_message is not None:
+            self.send_json_response(400, {"error": error_message})
+            return
+
+        creates, updates, deletes = operations
+        missing = []
+        failed = any(errors for section_errors in item_errors.values() for errors in section_errors)
+        if not failed:
+            with phase("mutate"):
+                created, missing = store.apply_batch(creates, updates, deletes)
+            failed = bool(missing)
+            if not failed and not self.wait_for_durability():
+                return
+
+        if failed:
+            results = {}
+            for name, section_errors in item_errors.items():
+                results[name] = []
+                for position, errors in enumerate(section_errors):
+                    if (name, position) in missing:
+                        results[name].append({"status": 404, "error": "Task not found"})
+                    elif errors:
+                        results[name].append({"status": 400, "error": errors[0], "errors": errors})
+                    else:
+                        results[name].append({"status": 424, "error": "Not applied because another item failed"})
+            self.send_json_response(400, {"error": "Batch rejected, nothing was applied", "results": results})
+            return
+
+        results = {
+            "create": [{"status": 201, "id": item["id"]} for item in created],
+            "update": [{"status": 200, "id": todo_id} for todo_id, _ in updates],
+            "delete": [{"status": 200, "id": todo_id} for todo_id in deletes],
+        }
+        self.send_json_response(200, {"message": "Batch applied successfully", "results": results})
+
     def do_POST(self):
-        if self.path == "/todo":
+        if self.path == "/todo/batch":
+            self.handle_batch()
+        elif self.path == "/todo":
 
             try:
-                content_length = int(self.headers['Content-Length'])
-                post_data = self.rfile.read(content_length)
-                new_todo = json.loads(post_data.decode())
+                new_todo = decode_json(self.read_body())
 
                 # Validate the todo data
-                is_valid, error_message = validate_todo_data(new_todo)
+                with phase("validate"):
+                    is_valid, error_message = validate_todo_data(new_todo)
                 if not is_valid:
                     self.send_json_response(400, {"error": error_message})
                     return
 
-                todo.append(new_todo)
-                save_todos(todo)
-                self.send_json_response(201, {"message": "Task added successfully"})
+                with phase("mutate"):
+                    added = store.add(new_todo)
+                if not self.wait_for_durability():
+                    return
+                self.send_json_response(201, {"message": "Task added successfully", "id": added["id"]})
             except (ValueError, json.JSONDecodeError):
                 self.send_json_response(400, {"error": "Invalid JSON"})
         else:
             self.send_json_response(404, {"error": "Path not found"})
 
     def do_DELETE(self):
-        if self.path.startswith("/todo/"):
+        if self.path == "/debug/profile" and profiler.enabled:
+            profiler.reset()
+            self.send_json_response(200, {"message": "Profile cleared"})
+        elif self.path.startswith("/todo/"):
             try:
-                index = int(self.path.split("/")[-1])
-                if 0 <= index < len(todo):
-                    del todo[index]
-                    save_todos(todo)
-                    self.send_json_response(200, {"message": "Task deleted successfully"})
+                todo_id, headers = self.todo_id_from_path()
+                with phase("mutate"):
+                    deleted = store.delete(todo_id)
+                if deleted:
+                    if not self.wait_for_durability():
+                        return
+                    self.send_json_response(200, {"message": "Task deleted successfully"}, headers)
                 else:
-                    self.send_json_response(404, {"error": "Task not found"})       
+                    self.send_json_response(404, {"error": "Task not found"}, headers)
             except ValueError:
-                self.send_json_response(400, {"error": "Invalid index"})       
+                self.send_invalid_path_error()
         else:
             self.send_json_response(404, {"error": "Path not found"})
 
     def do_PUT(self):
         if self.path.startswith("/todo/"):
             try:
-                index = int(self.path.split("/")[-1])
-                if 0 <= index < len(todo):
+                todo_id, headers = self.todo_id_from_path()
+                if store.get(todo_id) is not None:
                     try:
-                        content_length = int(self.headers['Content-Length'])
-                        updated_fields = json.loads(self.rfile.read(content_length).decode())
+                        updated_fields = decode_json(self.read_body())
 
                         # Validate the partial update data
-                        is_valid, error_message = validate_partial_todo_data(updated_fields)
+                        with phase("validate"):
+                            is_valid, error_message = validate_partial_todo_data(updated_fields)
                         if not is_valid:
-                            self.send_json_response(400, {"error": error_message})
+                            self.send_json_response(400, {"error": error_message}, headers)
                             return
 
                         # Merge the updated fields with existing todo
                         # This keeps fields that weren't sent in the update
-                        existing_todo = todo[index]
-                        for key, value in updated_fields.items():
-                            existing_todo[key] = value
+                        with phase("mutate"):
+                            updated = store.update(todo_id, updated_fields)
+                        if updated is None:
+                            # Another request deleted it while we were reading the body
+                            self.send_json_response(404, {"error": "Task not found"}, headers)
+                            return
+                        if not self.wait_for_durability():
+                            return
 
-                        save_todos(todo)
-                        self.send_json_response(200, {"message": "Task updated successfully"})
+                        self.send_json_response(200, {"message": "Task updated successfully"}, headers)
                     except (ValueError, json.JSONDecodeError):
-                        self.send_json_response(400, {"error": "Invalid JSON"})
+                        self.send_json_response(400, {"error": "Invalid JSON"}, headers)
                 else:
-                    self.send_json_response(404, {"error": "Task not found"})
+                    self.send_json_response(404, {"error": "Task not found"}, headers)
             except ValueError:
-                self.send_json_response(400, {"error": "Invalid index"})
+                self.send_invalid_path_error()
+        else:
+            self.send_json_response(404, {"error": "Path not found"})
+
+class ThreadedHTTPServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer with a listen backlog that can take a burst of connections."""
+
+    request_queue_size = LISTEN_BACKLOG
+
+class PooledHTTPServer(HTTPServer):
+    """
+    HTTPServer that hands each connection to a fixed pool of worker threads.
+    Once max_queue connections are waiting for a worker, new ones are answered
+    with 503 (by a small separate pool, so the accept loop never blocks).
+    """
+
+    request_queue_size = LISTEN_BACKLOG
+
+    def __init__(self, server_address, handler_class, workers=SERVER_WORKERS, max_queue=MAX_QUEUE):
+        super().__init__(server_address, handler_class)
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.rejector = ThreadPoolExecutor(max_workers=2)
+        self.max_queue = max_queue
+        self.waiting = 0
+        self.waiting_lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        with self.waiting_lock:
+            if self.max_queue and self.waiting >= self.max_queue:
+                REJECTED.inc("queue_full")
+                self.rejector.submit(reject_connection, request, overloaded_response(RETRY_AFTER))
+                return
+            self.waiting += 1
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def has_waiting_connections(self):
+        """Returns: True if accepted connections are queued for a free worker"""
+        return self.waiting > 0
+
+    def process_request_thread(self, request, client_address):
+        with self.waiting_lock:
+            self.waiting -= 1
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+        self.rejector.shutdown(wait=True)
+
+class SingleHTTPServer(HTTPServer):
+    """HTTPServer that serves one connection at a time, so it never keeps one open."""
+
+    request_queue_size = LISTEN_BACKLOG
+
+    def has_waiting_connections(self):
+        return True
+
+def make_server(server_address, engine=SERVER_ENGINE):
+    """Creates the HTTP server for the selected engine."""
+    if engine == 'threaded':
+        httpd = ThreadedHTTPServer(server_address, ToDoHandler)
+    elif engine == 'pool':
+        httpd = PooledHTTPServer(server_address, ToDoHandler)
+    elif engine == 'asyncio':
+        httpd = AsyncHTTPServer(server_address, ToDoHandler, workers=SERVER_WORKERS,
+                                idle_timeout=ToDoHandler.timeout, max_pending=MAX_QUEUE,
+                                max_body_bytes=MAX_BODY_BYTES,
+                                overload_response=overloaded_response(RETRY_AFTER),
+                                on_reject=lambda: REJECTED.inc("queue_full"))
+    elif engine == 'single':
+        httpd = SingleHTTPServer(server_address, ToDoHandler)
+    else:
+        raise ValueError(f"Unknown server engine: {engine}")
+
+    # Feed clients waiting on a fixed set of worker threads (see CHANGES_MAX_CLIENTS)
+    max_feed_clients = CHANGES_MAX_CLIENTS
+    if not max_feed_clients and engine in ('pool', 'asyncio'):
+        max_feed_clients = max(1, SERVER_WORKERS // 2)
+    httpd.feed_limiter = ConcurrencyLimiter(max_feed_clients, 0, 0) if max_feed_clients else None
+    return httpd
 
 # Runs server only if script is executed directly, if imported by another module it wont run
 if __name__ == "__main__":
-    server = HTTPServer(("localhost", 8000), ToDoHandler)
-    print("Server started at http://localhost:8000")
-    server.serve_forever()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Todo API server")
+    parser.add_argument("--engine", choices=ENGINES, default=SERVER_ENGINE,
+                        help="how connections are served (default: TODO_ENGINE or threaded)")
+    parser.add_argument("--host", default="localhost", help="address to listen on (default: localhost)")
+    parser.add_argument("--port", type=int, default=8000, help="port to listen on (default: 8000)")
+    args = parser.parse_args()
+
+    server = make_server((args.host, args.port), engine=args.engine)
+    # Treat SIGTERM like Ctrl+C so pending writes are drained before exiting
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"Server started at http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        close_persistence()
+        profiler.dump()
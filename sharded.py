@@ -0,0 +1,258 @@
+"""
+Sharded todo store: the todos split by id over N partitions.
+
+Todo id i lives in shard i % N. Every shard is a TodoStore of its own, with
+its own read/write lock and its own file (todos.json is split into
+todos.shard-0.json, todos.shard-1.json, ...), so writes to different shards
+don't wait for each other and a change rewrites only the file of its shard.
+
+Reads that span shards (the full list, pages, filters) take the read locks of
+all shards, always in shard order, and merge the shards' todos by id, so the
+list comes out in the same order as from a single store. A batch takes the
+write locks of all shards in the same order: the two can't deadlock, and no
+read sees half a batch.
+
+New ids still go up in the order todos are created. The next id decides the
+shard, but it may be taken by the time the shard's lock is held; the todo
+then gets the next id that belongs in that shard, leaving a gap.
+
+Startup reads the shard files in parallel, in a pool of processes when there
+is more than one CPU (parsing JSON doesn't run in parallel on threads). If
+there are no shard files yet, the single file is split up; if the number of
+shards changed, the todos are redistributed. Either way every shard file is
+written out again (the single file is left as it was, until a start with one
+shard merges the shard files back into it).
+"""
+import glob
+import heapq
+import multiprocessing
+import os
+import re
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager
+from itertools import chain, islice
+from operator import itemgetter
+
+from loader import read_todos
+from store import TodoStorage, index_todos, is_valid_id
+
+todo_id_of = itemgetter("id")
+
+
+def shard_path(path, index):
+    """Returns: the file of shard index of the todos file path"""
+    base, ext = os.path.splitext(path)
+    return f"{base}.shard-{index}{ext}"
+
+
+def existing_shard_paths(path):
+    """Returns: the shard files of path that exist, as a dict of shard index -> file"""
+    base, ext = os.path.splitext(path)
+    pattern = re.compile(re.escape(base) + r"\.shard-(\d+)" + re.escape(ext) + "$")
+    found = {}
+    for name in glob.glob(glob.escape(base) + ".shard-*" + glob.escape(ext)):
+        match = pattern.match(name)
+        if match:
+            found[int(match.group(1))] = name
+    return found
+
+
+def remove_extra_shards(path, count):
+    """Deletes the shard files of path left over from a store with more than count shards."""
+    for index, name in existing_shard_paths(path).items():
+        if index >= count:
+            os.remove(name)
+
+
+def read_shard(path, index, count):
+    """
+    Reads one file of todos, in a loader process.
+    Returns: (todo, misplaced, errors) - todo is the dict of id -> todo for
+             shard index of count shards, misplaced every todo that doesn't
+             belong there, errors the LoadErrors of damaged records
+    """
+    errors = []
+    todo = {}
+    misplaced = []
+    for item in read_todos(path, errors):
+        todo_id = item.get("id")
+        if is_valid_id(todo_id) and todo_id % count == index and todo_id not in todo:
+            todo[todo_id] = item
+        else:
+            misplaced.append(item)
+    ids = list(todo)
+    if any(a > b for a, b in zip(ids, ids[1:])):
+        todo = dict(sorted(todo.items()))
+    return todo, misplaced, errors
+
+
+def load_shards(path, count, workers=None):
+    """
+    Loads the todos of a store of count shards kept next to the todos file path.
+    workers is the most files read at once (default: one per CPU).
+    Returns: (parts, errors, rewrite) - parts holds the dict of id -> todo of
+             every shard, errors the LoadErrors of damaged records as a dict
+             of file -> errors (only files with any), and rewrite
+             is True if the todos had to be split up or redistributed, so every
+             shard should be written out
+    """
+    found = existing_shard_paths(path)
+    if found:
+        sources = sorted(found.items())
+    elif os.path.exists(path):
+        sources = [(None, path)]
+    else:
+        return [{} for _ in range(count)], {}, False
+
+    workers = workers or os.cpu_count() or 1
+    # A shard that doesn't exist for this count keeps every todo as misplaced
+    args = [(source, index if index is not None and index < count else -1, count) for index, source in sources]
+    if workers > 1 and len(args) > 1 and "fork" in multiprocessing.get_all_start_methods():
+        # Forked, so the loaders don't import the server module over again
+        with ProcessPoolExecutor(min(workers, len(args)), mp_context=multiprocessing.get_context("fork")) as pool:
+            results = list(pool.map(read_shard, *zip(*args)))
+    else:
+        results = [read_shard(*arg) for arg in args]
+
+    errors = {source: file_errors for (_, source), (_, _, file_errors) in zip(sources, results) if file_errors}
+    if len(results) == count and all(index == position for position, (index, _) in enumerate(sources)) \
+            and not any(misplaced for _, misplaced, _ in results):
+        return [todo for todo, _, _ in results], errors, False
+
+    # Split up the single file, or the shards of another count: ids are
+    # assigned (or reassigned on duplicates) as on an unsharded load
+    parts = [{} for _ in range(count)]
+    everything = chain.from_iterable(chain(todo.values(), misplaced) for todo, misplaced, _ in results)
+    for todo_id, item in index_todos(everything).items():
+        parts[todo_id % count][todo_id] = item
+    return parts, errors, True
+
+
+class ShardedTodoStore(TodoStorage):
+    """
+    TodoStorage over shards, a list of TodoStores (or CompactTodoStores) where
+    shards[k] holds the todos with id % len(shards) == k. Each shard persists
+    itself through its own on_change.
+    """
+
+    def __init__(self, shards):
+        self.shards = list(shards)
+        self.next_id = max(shard.next_id for shard in self.shards)
+        self._id_lock = threading.Lock()
+
+    @property
+    def version(self):
+        # Every mutation bumps the version of one shard (or of several), so the sum always goes up
+        return sum(shard.version for shard in self.shards)
+
+    def shard_of(self, todo_id):
+        return self.shards[todo_id % len(self.shards)]
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def all(self):
+        with self._all_locked(read=True):
+            return list(heapq.merge(*(shard.snapshot() for shard in self.shards), key=todo_id_of))
+
+    def fragments(self, encode):
+        """Returns: every shard's fragments (see TodoStore.fragments), merged by id"""
+        with self._all_locked(read=True):
+            shards = [list(zip(shard.todo, shard._fragments_of(shard.todo, encode))) for shard in self.shards]
+        return [fragment for _, fragment in heapq.merge(*shards, key=itemgetter(0))]
+
+    def get(self, todo_id):
+        # None stands for an out of range positional index; no shard holds it
+        if not is_valid_id(todo_id):
+            return None
+        return self.shard_of(todo_id).get(todo_id)
+
+    def id_at(self, index):
+        # islice takes no more than sys.maxsize, and no list is that long
+        if not 0 <= index <= sys.maxsize:
+            return None
+        with self._all_locked(read=True):
+            return next(islice(heapq.merge(*(iter(shard.todo) for shard in self.shards)), index, None), None)
+
+    def page(self, limit, after=None, completed=None, query=None):
+        """
+        Every shard's page, merged by id and cut to limit.
+        Returns: (todos, next_after) - see TodoStore.page
+        """
+        with self._all_locked(read=True):
+            pages = [shard._page(limit, after, completed, query) for shard in self.shards]
+        merged = heapq.merge(*(items for items, _ in pages), key=todo_id_of)
+        page = list(islice(merged, limit))
+        more = any(next_after is not None for _, next_after in pages) or next(merged, None) is not None
+        return page, (page[-1]["id"] if more and page else None)
+
+    def add(self, item):
+        index = self.next_id % len(self.shards)
+        shard = self.shards[index]
+        with shard.lock.write_locked():
+            with self._id_lock:
+                # The first free id that belongs in this shard
+                todo_id = self.next_id + (index - self.next_id) % len(self.shards)
+                self.next_id = todo_id + 1
+            item = shard._add(item, todo_id)
+            shard._changed([{"op": "add", "item": item}])
+            return item
+
+    def update(self, todo_id, fields):
+        if not is_valid_id(todo_id):
+            return None
+        return self.shard_of(todo_id).update(todo_id, fields)
+
+    def delete(self, todo_id):
+        if not is_valid_id(todo_id):
+            return False
+        return self.shard_of(todo_id).delete(todo_id)
+
+    def apply_batch(self, creates=(), updates=(), deletes=()):
+        """
+        Applies a batch across shards as one unit, see TodoStore.apply_batch.
+        Each shard's on_change gets the records of its own todos.
+        Returns: (created_todos, missing)
+        """
+        with self._all_locked(read=False):
+            missing = [("update", position) for position, (todo_id, _) in enumerate(updates)
+                       if todo_id not in self.shard_of(todo_id).todo]
+            deleting = set()
+            for position, todo_id in enumerate(deletes):
+                if todo_id not in self.shard_of(todo_id).todo or todo_id in deleting:
+                    missing.append(("delete", position))
+                deleting.add(todo_id)
+            if missing:
+                return [], missing
+
+            records = {}
+            created = []
+            for item in creates:
+                with self._id_lock:
+                    todo_id = self.next_id
+                    self.next_id += 1
+                shard = self.shard_of(todo_id)
+                item = shard._add(item, todo_id)
+                created.append(item)
+                records.setdefault(shard, []).append({"op": "add", "item": item})
+            for todo_id, fields in updates:
+                shard = self.shard_of(todo_id)
+                records.setdefault(shard, []).append(shard._update(todo_id, fields)[1])
+            for todo_id in deletes:
+                shard = self.shard_of(todo_id)
+                shard._delete(todo_id)
+                records.setdefault(shard, []).append({"op": "delete", "id": todo_id})
+
+            for shard, shard_records in records.items():
+                shard._changed(shard_records)
+            return created, []
+
+    @contextmanager
+    def _all_locked(self, read):
+        """Holds the read (or write) locks of every shard, taken in shard order."""
+        with ExitStack() as stack:
+            for shard in self.shards:
+                stack.enter_context(shard.lock.read_locked() if read else shard.lock.write_locked())
+            yield
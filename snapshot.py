@@ -0,0 +1,345 @@
+"""
+Binary snapshot of the todos, for starting a big store without parsing JSON.
+
+The file is memory-mapped and only its header and index are checked at
+startup; each todo is decoded the first time it is read. Layout:
+
+    header   magic, format version, flags, todo count, index offset,
+             CRC32 of the index, CRC32 of the header itself
+    records  each todo as compact JSON, in id order
+    index    four arrays of count entries each: ids, record offsets,
+             record lengths and a CRC32 per record
+
+The index arrays are in the byte order of the machine that wrote them (a flag
+records which) and are read in place, so opening a snapshot costs a checksum
+over 24 bytes per todo instead of a parse of the whole store. A record's CRC is
+checked when it is decoded, and `verify` checks all of them up front.
+
+Convert between the formats with:
+
+    python snapshot.py to-snapshot todos.json todos.snap
+    python snapshot.py to-json todos.snap todos.json
+    python snapshot.py verify todos.snap
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left
+from collections.abc import MutableMapping
+
+from loader import read_todos
+from persistence import BYTES_WRITTEN, fsync_directory
+from store import index_todos, is_valid_id
+
+MAGIC = b"TODOSNAP"
+VERSION = 1
+FLAG_BIG_ENDIAN = 1
+
+decode_json = json.JSONDecoder().decode
+
+# magic, version, flags, count, index offset, index CRC; then the CRC of those bytes
+HEADER = struct.Struct("<8sHHQQI")
+HEADER_CRC = struct.Struct("<I")
+HEADER_SIZE = HEADER.size + HEADER_CRC.size
+
+
+class SnapshotError(ValueError):
+    """The file is not a snapshot this version can read, or it is corrupt."""
+
+
+def write_snapshot(path, items):
+    """
+    Writes todos (in id order, each with its "id") to a snapshot file.
+    Written to a temp file and renamed, so a crash never leaves a half-written snapshot.
+    Returns: the number of bytes written
+    """
+    ids, offsets, lengths, crcs = array("Q"), array("Q"), array("I"), array("I")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(bytes(HEADER_SIZE))
+        offset = HEADER_SIZE
+        for item in items:
+            todo_id = item["id"]
+            if ids and todo_id <= ids[-1]:
+                raise ValueError(f"Todos must be in increasing id order (got {todo_id} after {ids[-1]})")
+            record = json.dumps(item, separators=(",", ":")).encode()
+            f.write(record)
+            ids.append(todo_id)
+            offsets.append(offset)
+            lengths.append(len(record))
+            crcs.append(zlib.crc32(record))
+            offset += len(record)
+
+        # Align the index so its arrays can be read in place
+        padding = -offset % 8
+        f.write(bytes(padding))
+        index_offset = offset + padding
+        index = b"".join(column.tobytes() for column in (ids, offsets, lengths, crcs))
+        f.write(index)
+
+        flags = FLAG_BIG_ENDIAN if sys.byteorder == "big" else 0
+        header = HEADER.pack(MAGIC, VERSION, flags, len(ids), index_offset, zlib.crc32(index))
+        f.seek(0)
+        f.write(header + HEADER_CRC.pack(zlib.crc32(header)))
+        size = index_offset + len(index)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_directory(path)
+    BYTES_WRITTEN.inc("snapshot", amount=size)
+    return size
+
+
+class Snapshot:
+    """
+    A snapshot file mapped into memory.
+
+    Opening checks the header and the index checksum; records are decoded (and
+    their checksum checked) one at a time by get(). Raises SnapshotError if the
+    file isn't a readable snapshot.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SnapshotError(f"{path} is empty")
+        try:
+            self._views = []
+            self._open()
+        except BaseException:
+            self.close()
+            raise
+
+    def _open(self):
+        if len(self._map) < HEADER_SIZE:
+            raise SnapshotError(f"{self.path} is too short to be a snapshot")
+        header = self._map[:HEADER.size]
+        magic, version, flags, count, index_offset, index_crc = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise SnapshotError(f"{self.path} is not a todo snapshot")
+        if version != VERSION:
+            raise SnapshotError(f"{self.path} is snapshot version {version}, this server reads version {VERSION}")
+        (header_crc,) = HEADER_CRC.unpack_from(self._map, HEADER.size)
+        if zlib.crc32(header) != header_crc:
+            raise SnapshotError(f"{self.path} has a corrupt header")
+        if bool(flags & FLAG_BIG_ENDIAN) != (sys.byteorder == "big"):
+            raise SnapshotError(f"{self.path} was written on a machine with the other byte order; "
+                                "convert it through JSON")
+
+        index_size = count * 24
+        if index_offset % 8 or index_offset + index_size != len(self._map):
+            raise SnapshotError(f"{self.path} is truncated or has a corrupt index")
+        index = memoryview(self._map)[index_offset:]
+        self._views.append(index)
+        if zlib.crc32(index) != index_crc:
+            raise SnapshotError(f"{self.path} has a corrupt index")
+
+        self.count = count
+        self.ids = self._column(index, 0, count * 8, "Q")
+        self.offsets = self._column(index, count * 8, count * 16, "Q")
+        self.lengths = self._column(index, count * 16, count * 20, "I")
+        self.crcs = self._column(index, count * 20, count * 24, "I")
+
+    def _column(self, index, start, end, typecode):
+        view = index[start:end].cast(typecode)
+        self._views.append(view)
+        return view
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, todo_id):
+        return self.position(todo_id) is not None
+
+    def position(self, todo_id):
+        """Returns: where todo_id is in the index, or None if it isn't in the snapshot"""
+        position = bisect_left(self.ids, todo_id)
+        if position < self.count and self.ids[position] == todo_id:
+            return position
+        return None
+
+    def get(self, todo_id):
+        """Returns: the decoded todo with this id, or None"""
+        position = self.position(todo_id)
+        return None if position is None else self.decode(position)
+
+    def decode(self, position):
+        """Returns: the todo at this position in the index"""
+        # Decoding to str first skips json.loads' encoding detection, twice as fast on small records
+        return decode_json(self._record(position).decode())
+
+    def _record(self, position):
+        """Raises: SnapshotError if the record doesn't match its checksum"""
+        offset = self.offsets[position]
+        record = self._map[offset:offset + self.lengths[position]]
+        if zlib.crc32(record) != self.crcs[position]:
+            raise SnapshotError(f"{self.path} has a corrupt record for todo {self.ids[position]}")
+        return record
+
+    def __iter__(self):
+        """Yields every todo in id order, decoding as it goes."""
+        for position in range(self.count):
+            yield self.decode(position)
+
+    def verify(self):
+        """Raises: SnapshotError unless every record matches its checksum"""
+        for position in range(self.count):
+            self._record(position)
+
+    def close(self):
+        # The map can only be closed once nothing points into it
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._map.close()
+
+
+class LazyTodos(MutableMapping):
+    """
+    The id -> todo mapping of a store loaded from a snapshot.
+
+    A todo is decoded on first access and kept in `loaded`, so it is decoded
+    only once. The snapshot itself is never written to: stored todos go into
+    `loaded` as well, and deleted ids into `deleted`. Todos added after the
+    snapshot was written have higher ids than any in it and are kept apart in
+    `added`, so iterating stays in id order, as with the dict TodoStore
+    normally holds.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.loaded = {}
+        self.deleted = set()
+        self.added = {}
+        self._last_snapshot_id = snapshot.ids[-1] if len(snapshot) else 0
+
+    def __getitem__(self, todo_id):
+        # Like a dict, anything that can't be an id (None for an out of range index, say) is just missing
+        if not is_valid_id(todo_id):
+            raise KeyError(todo_id)
+        if todo_id > self._last_snapshot_id:
+            return self.added[todo_id]
+        item = self.loaded.get(todo_id)
+        if item is not None:
+            return item
+        position = self.snapshot.position(todo_id) if todo_id not in self.deleted else None
+        if position is None:
+            raise KeyError(todo_id)
+        item = self.loaded[todo_id] = self.snapshot.decode(position)
+        return item
+
+    def __contains__(self, todo_id):
+        if not is_valid_id(todo_id):
+            return False
+        if todo_id > self._last_snapshot_id:
+            return todo_id in self.added
+        return todo_id in self.loaded or (todo_id not in self.deleted and todo_id in self.snapshot)
+
+    def __setitem__(self, todo_id, item):
+        if todo_id > self._last_snapshot_id:
+            self.added[todo_id] = item
+        else:
+            self.deleted.discard(todo_id)
+            self.loaded[todo_id] = item
+
+    def __delitem__(self, todo_id):
+        if todo_id in self.added:
+            del self.added[todo_id]
+        elif todo_id in self:
+            self.loaded.pop(todo_id, None)
+            self.deleted.add(todo_id)
+        else:
+            raise KeyError(todo_id)
+
+    def __len__(self):
+        return len(self.snapshot) - len(self.deleted) + len(self.added)
+
+    def __iter__(self):
+        deleted = self.deleted
+        for todo_id in self.snapshot.ids:
+            if todo_id not in deleted:
+                yield todo_id
+        yield from self.added
+
+    def __reversed__(self):
+        yield from reversed(self.added)
+        ids = self.snapshot.ids
+        for position in range(len(ids) - 1, -1, -1):
+            if ids[position] not in self.deleted:
+                yield ids[position]
+
+    def values(self):
+        """Returns: a list of every todo in id order, decoding those not read yet"""
+        # Walks the snapshot once instead of looking up every id
+        loaded, deleted, snapshot = self.loaded, self.deleted, self.snapshot
+        items = []
+        for position, todo_id in enumerate(snapshot.ids):
+            item = loaded.get(todo_id)
+            if item is None:
+                if todo_id in deleted:
+                    continue
+                item = loaded[todo_id] = snapshot.decode(position)
+            items.append(item)
+        items.extend(self.added.values())
+        return items
+
+
+def load_snapshot(path):
+    """
+    Opens a snapshot file for a store.
+    Returns: a LazyTodos over it (the file stays mapped while the todos are in use)
+    Raises: OSError if the file can't be read, SnapshotError if it isn't a valid snapshot
+    """
+    return LazyTodos(Snapshot(path))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert todos between the JSON file and a binary snapshot")
+    commands = parser.add_subparsers(dest="command", required=True)
+    to_snapshot = commands.add_parser("to-snapshot", help="write a snapshot from a JSON todos file")
+    to_snapshot.add_argument("source")
+    to_snapshot.add_argument("target")
+    to_json = commands.add_parser("to-json", help="write a JSON todos file from a snapshot")
+    to_json.add_argument("source")
+    to_json.add_argument("target")
+    verify = commands.add_parser("verify", help="check every checksum in a snapshot")
+    verify.add_argument("source")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "to-snapshot":
+            errors = []
+            todo = index_todos(read_todos(args.source, errors))
+            for error in errors:
+                print(f"Skipped damaged record at character {error.offset}: {error.message}", file=sys.stderr)
+            size = write_snapshot(args.target, todo.values())
+            print(f"Wrote {len(todo)} todos ({size} bytes) to {args.target}")
+        elif args.command == "to-json":
+            snapshot = Snapshot(args.source)
+            items = list(snapshot)
+            snapshot.close()
+            # Same indented format the server saves
+            with open(args.target, "w") as f:
+                json.dump(items, f, indent=2)
+            print(f"Wrote {len(items)} todos to {args.target}")
+        else:
+            snapshot = Snapshot(args.source)
+            snapshot.verify()
+            print(f"{args.source}: {len(snapshot)} todos, all checksums match")
+            snapshot.close()
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
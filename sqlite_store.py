@@ -0,0 +1,316 @@
+"""
+SQLite storage backend for the todos.
+
+Each todo is one row, so startup doesn't read the dataset, lookups by id use
+the primary key and a change only writes the rows it touches. The database
+runs in WAL journal mode so readers never wait for the writer.
+
+Run as a script to migrate a todos JSON file (and its .wal log, if any):
+    python sqlite_store.py todos.json todos.db
+"""
+import argparse
+import json
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from indexes import tokenize
+from loader import read_todos
+from persistence import WriteAheadLog
+from store import TodoStorage, index_todos, is_valid_id
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS todos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    completed INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS todos_completed ON todos (completed, id);
+"""
+
+# Full-text index over task and description, kept in step with todos by triggers
+TODO_TEXT = "coalesce(json_extract({row}.data, '$.task'), '') || ' ' || " \
+            "coalesce(json_extract({row}.data, '$.description'), '')"
+TEXT_SCHEMA = (
+    "CREATE VIRTUAL TABLE todos_text USING fts5"
+    "(text, tokenize = \"unicode61 remove_diacritics 0 tokenchars '_'\")",
+    f"""CREATE TRIGGER todos_text_insert AFTER INSERT ON todos BEGIN
+        INSERT INTO todos_text (rowid, text) VALUES (new.id, {TODO_TEXT.format(row="new")});
+    END""",
+    f"""CREATE TRIGGER todos_text_update AFTER UPDATE OF data ON todos BEGIN
+        UPDATE todos_text SET text = {TODO_TEXT.format(row="new")} WHERE rowid = new.id;
+    END""",
+    """CREATE TRIGGER todos_text_delete AFTER DELETE ON todos BEGIN
+        DELETE FROM todos_text WHERE rowid = old.id;
+    END""",
+    f"INSERT INTO todos_text (rowid, text) SELECT id, {TODO_TEXT.format(row='todos')} FROM todos",
+)
+
+# TODO_FSYNC policy -> SQLite synchronous setting
+SYNCHRONOUS = {"always": "FULL", "interval": "NORMAL", "never": "OFF"}
+
+# Largest id (and cursor) SQLite can take; larger ints raise OverflowError when bound
+MAX_ID = 2 ** 63 - 1
+
+
+def storable_id(todo_id):
+    """Returns: True if todo_id could be the id of a row (no row has any other)"""
+    return is_valid_id(todo_id) and todo_id <= MAX_ID
+
+
+def encode_row(item):
+    """Returns: the (completed, data) columns of a todo; its id has a column of its own"""
+    fields = {key: value for key, value in item.items() if key != "id"}
+    return (1 if fields.get("completed") is True else 0, json.dumps(fields))
+
+
+def decode_row(todo_id, data):
+    return {"id": todo_id, **json.loads(data)}
+
+
+def match_expression(terms):
+    """Returns: an FTS5 query matching rows that contain every term"""
+    return " ".join('"' + term.replace('"', '""') + '"' for term in sorted(terms))
+
+
+class SqliteTodoStore(TodoStorage):
+    """
+    Todo storage in an SQLite database.
+
+    Reads use a pool of connections and run in parallel; writes go through one
+    connection, one transaction at a time. Ids come from AUTOINCREMENT, so an
+    id is never handed out twice, even after its todo was deleted.
+    on_change(records) is called after every committed mutation, with the same
+    records TodoStore passes and the write lock still held.
+    """
+
+    def __init__(self, path, fsync_policy="always", on_change=None):
+        if fsync_policy not in SYNCHRONOUS:
+            raise ValueError(f"Unknown fsync policy: {fsync_policy}")
+        self.path = path
+        self.synchronous = SYNCHRONOUS[fsync_policy]
+        self.on_change = on_change
+        self.version = 0
+        self._records = []
+        self._write_lock = threading.Lock()
+        self._readers = queue.LifoQueue()
+        self._writer = self._connect()
+        self._writer.executescript(SCHEMA)
+        self._create_text_index()
+
+    def __len__(self):
+        with self._reading() as conn:
+            return conn.execute("SELECT COUNT(*) FROM todos").fetchone()[0]
+
+    def all(self):
+        with self._reading() as conn:
+            rows = conn.execute("SELECT id, data FROM todos ORDER BY id").fetchall()
+        return [decode_row(*row) for row in rows]
+
+    def get(self, todo_id):
+        if not storable_id(todo_id):
+            return None
+        with self._reading() as conn:
+            row = conn.execute("SELECT data FROM todos WHERE id = ?", (todo_id,)).fetchone()
+        return decode_row(todo_id, row[0]) if row else None
+
+    def id_at(self, index):
+        # SQLite can't take an offset beyond its integers, and no table is that long
+        if not 0 <= index <= MAX_ID:
+            return None
+        with self._reading() as conn:
+            row = conn.execute("SELECT id FROM todos ORDER BY id LIMIT 1 OFFSET ?", (index,)).fetchone()
+        return row[0] if row else None
+
+    def page(self, limit, after=None, completed=None, query=None):
+        sql = "SELECT id, data FROM todos WHERE id > ?"
+        params = [after if after is not None else 0]
+        if completed is not None:
+            sql += " AND completed = ?"
+            params.append(int(completed))
+        if query is not None:
+            terms = tokenize(query)
+            if not terms:
+                return [], None
+            sql += " AND id IN (SELECT rowid FROM todos_text WHERE todos_text MATCH ?)"
+            params.append(match_expression(terms))
+        sql += " ORDER BY id"
+        if limit is not None:
+            # One extra row tells us whether there is another page
+            sql += " LIMIT ?"
+            params.append(limit + 1)
+
+        with self._reading() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        if limit is not None and len(rows) > limit:
+            items = [decode_row(*row) for row in rows[:limit]]
+            return items, items[-1]["id"]
+        return [decode_row(*row) for row in rows], None
+
+    def add(self, item):
+        with self._writing() as conn:
+            return self._insert(conn, item)
+
+    def update(self, todo_id, fields):
+        if not storable_id(todo_id):
+            return None
+        with self._writing() as conn:
+            return self._update(conn, todo_id, fields)
+
+    def delete(self, todo_id):
+        if not storable_id(todo_id):
+            return False
+        with self._writing() as conn:
+            if conn.execute("DELETE FROM todos WHERE id = ?", (todo_id,)).rowcount == 0:
+                return False
+            self._records.append({"op": "delete", "id": todo_id})
+            return True
+
+    def apply_batch(self, creates=(), updates=(), deletes=()):
+        with self._writing() as conn:
+            missing = [("update", position) for position, (todo_id, _) in enumerate(updates)
+                       if not self._exists(conn, todo_id)]
+            deleting = set()
+            for position, todo_id in enumerate(deletes):
+                if todo_id in deleting or not self._exists(conn, todo_id):
+                    missing.append(("delete", position))
+                deleting.add(todo_id)
+            if missing:
+                return [], missing
+
+            created = [self._insert(conn, item) for item in creates]
+            for todo_id, fields in updates:
+                self._update(conn, todo_id, fields)
+            conn.executemany("DELETE FROM todos WHERE id = ?", ((todo_id,) for todo_id in deletes))
+            self._records.extend({"op": "delete", "id": todo_id} for todo_id in deletes)
+            return created, []
+
+    def import_todos(self, todo):
+        """Bulk-inserts a dict of todo id -> todo, keeping the ids, in one transaction."""
+        with self._writing() as conn:
+            conn.executemany("INSERT INTO todos (id, completed, data) VALUES (?, ?, ?)",
+                             ((todo_id, *encode_row(item)) for todo_id, item in todo.items()))
+
+    def close(self):
+        with self._write_lock:
+            self._writer.close()
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        return conn
+
+    def _create_text_index(self):
+        """Creates the full-text index (and fills it) if this database predates it."""
+        with self._writing() as conn:
+            exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'todos_text'").fetchone()
+            if not exists:
+                for statement in TEXT_SCHEMA:
+                    conn.execute(statement)
+
+    @contextmanager
+    def _reading(self):
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    @contextmanager
+    def _writing(self):
+        """
+        One write transaction; version goes up if it changed any row, and the
+        records of what changed are passed to on_change once it is committed.
+        """
+        with self._write_lock:
+            conn = self._writer
+            changes = conn.total_changes
+            self._records = []
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            if conn.total_changes != changes:
+                self.version += 1
+                if self.on_change is not None and self._records:
+                    self.on_change(self._records)
+
+    def _exists(self, conn, todo_id):
+        if not storable_id(todo_id):
+            return False
+        return conn.execute("SELECT 1 FROM todos WHERE id = ?", (todo_id,)).fetchone() is not None
+
+    def _insert(self, conn, item):
+        completed, data = encode_row(item)
+        cursor = conn.execute("INSERT INTO todos (completed, data) VALUES (?, ?)", (completed, data))
+        item = decode_row(cursor.lastrowid, data)
+        self._records.append({"op": "add", "item": item})
+        return item
+
+    def _update(self, conn, todo_id, fields):
+        row = conn.execute("SELECT data FROM todos WHERE id = ?", (todo_id,)).fetchone()
+        if row is None:
+            return None
+        updated = {**decode_row(todo_id, row[0]), **fields, "id": todo_id}
+        conn.execute("UPDATE todos SET completed = ?, data = ? WHERE id = ?",
+                     (*encode_row(updated), todo_id))
+        self._records.append({"op": "update", "id": todo_id,
+                              "fields": {key: value for key, value in fields.items() if key != "id"}})
+        return updated
+
+
+def migrate_json(json_path, db_path, fsync_policy="always"):
+    """
+    Copies the todos from a JSON file into a new SQLite database, keeping their
+    ids. A write-ahead log next to the file (json_path + ".wal") is replayed first.
+    Returns: the number of todos migrated
+    """
+    errors = []
+    try:
+        todo = index_todos(read_todos(json_path, errors))
+    except FileNotFoundError:
+        todo = {}
+    if errors:
+        # Better to stop than to leave damaged todos behind unnoticed
+        raise ValueError(f"{json_path} is damaged at character {errors[0].offset}: {errors[0].message}")
+    if os.path.exists(json_path + ".wal"):
+        todo = WriteAheadLog(json_path + ".wal", snapshot_provider=lambda: ()).replay(todo)
+
+    store = SqliteTodoStore(db_path, fsync_policy)
+    try:
+        if len(store):
+            raise ValueError(f"{db_path} already contains todos")
+        store.import_todos(todo)
+    finally:
+        store.close()
+    return len(todo)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate a todos JSON file into an SQLite database")
+    parser.add_argument("source", nargs="?", default=os.environ.get("TODO_FILE", "todos.json"),
+                        help="JSON file to read (default: TODO_FILE or todos.json)")
+    parser.add_argument("target", nargs="?", default=os.environ.get("TODO_DB", "todos.db"),
+                        help="SQLite database to create (default: TODO_DB or todos.db)")
+    args = parser.parse_args()
+
+    try:
+        count = migrate_json(args.source, args.target)
+    except (ValueError, json.JSONDecodeError, sqlite3.Error) as e:
+        print(f"Migration failed: {e}")
+        raise SystemExit(1)
+    print(f"Migrated {count} todo(s) from {args.source} to {args.target}")
@@ -0,0 +1,411 @@
+"""
+Thread-safe todo store shared by all request handler threads.
+"""
+import sys
+import threading
+from bisect import bisect_right
+from contextlib import contextmanager
+from itertools import islice
+
+from indexes import TodoIndexes, tokenize
+
+
+def is_valid_id(todo_id):
+    return isinstance(todo_id, int) and not isinstance(todo_id, bool) and todo_id > 0
+
+
+def index_todos(items):
+    """
+    Builds the id -> todo dict from todos (a list, or any iterable read once),
+    keeping their order.
+    Todos saved before ids existed (or with a missing, invalid or duplicate id)
+    get the next free ids in list order, so the same file always migrates to the
+    same ids and they become permanent with the next save.
+    The dict is kept in id order, which is also the order todos were created in.
+    Returns: dict of todo id -> todo
+    """
+    todo = {}
+    unnumbered = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        todo_id = item.get("id")
+        if is_valid_id(todo_id) and todo_id not in todo:
+            todo[todo_id] = item
+        else:
+            unnumbered.append(item)
+
+    next_id = max(todo, default=0) + 1
+    for item in unnumbered:
+        item = {"id": next_id, **item}
+        item["id"] = next_id
+        todo[next_id] = item
+        next_id += 1
+
+    ids = list(todo)
+    if any(a > b for a, b in zip(ids, ids[1:])):
+        todo = dict(sorted(todo.items()))
+    return todo
+
+
+class ReadWriteLock:
+    """
+    Lets any number of readers hold the lock at once, while a writer gets it alone.
+    Waiting writers block new readers so a steady stream of GETs can't starve them.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read_locked(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write_locked(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class TodoStorage:
+    """
+    Storage interface the request handlers talk to.
+
+    TodoStore keeps every todo in memory and persists through one of the file
+    modes (json, wal, group); sharded.ShardedTodoStore splits them by id over
+    several TodoStores with a file each; sqlite_store.SqliteTodoStore keeps
+    them in an SQLite database and only reads the rows a request needs.
+    Todos are dicts carrying their integer "id"; version counts mutations.
+    """
+
+    version = 0
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def all(self):
+        """Returns: a list of all todos in id order"""
+        raise NotImplementedError
+
+    def get(self, todo_id):
+        """Returns: the todo with this id, or None"""
+        raise NotImplementedError
+
+    def id_at(self, index):
+        """Returns: the id of the todo at this position in id order, or None"""
+        raise NotImplementedError
+
+    def page(self, limit, after=None, completed=None, query=None):
+        """Returns: (todos, next_after) - see TodoStore.page"""
+        raise NotImplementedError
+
+    def fragments(self, encode):
+        """Returns: every todo encoded with encode(todo) -> bytes, in id order"""
+        return [encode(item) for item in self.all()]
+
+    def add(self, item):
+        """Returns: the stored todo with its new id"""
+        raise NotImplementedError
+
+    def update(self, todo_id, fields):
+        """Returns: the updated todo, or None if there is no such todo"""
+        raise NotImplementedError
+
+    def delete(self, todo_id):
+        """Returns: True if a todo was deleted"""
+        raise NotImplementedError
+
+    def apply_batch(self, creates=(), updates=(), deletes=()):
+        """Returns: (created_todos, missing) - see TodoStore.apply_batch"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class TodoStore(TodoStorage):
+    """
+    Wraps the todos behind a read/write lock.
+
+    Todos live in an insertion-ordered dict keyed by their stable id, so lookups,
+    updates and deletes by id are O(1) and never renumber other todos. Ids are
+    handed out in increasing order, starting after the highest id loaded.
+
+    Items are never modified in place: an update stores a merged copy, so a list
+    returned by all() can be serialized after the lock is released.
+    on_change(records) is called with the write lock still held after every mutation
+    (with all the records of a batch at once), which keeps the persisted order
+    identical to the in-memory order.
+    version goes up by one with every mutation, so anything derived from the
+    todos (such as a cached response) can tell whether it is still current.
+    indexes (see indexes.TodoIndexes) is built on the first filtered read and
+    from then on updated under the same write lock, so a store loaded lazily
+    (see snapshot.LazyTodos) doesn't decode every todo just to start.
+    Each todo's encoding is kept once fragments() has made it, until the todo
+    changes.
+    """
+
+    def __init__(self, todo=None, on_change=None):
+        self.todo = todo if todo is not None else {}
+        self.on_change = on_change
+        self.lock = ReadWriteLock()
+        # Todos are kept in id order, so the last one has the highest id
+        self.next_id = next(reversed(self.todo), 0) + 1
+        self.version = 0
+        self._indexes = None
+        self._indexes_lock = threading.Lock()
+        self._fragments = {}
+        self._fragment_encoder = None
+
+    @property
+    def indexes(self):
+        if self._indexes is None:
+            # Readers may get here together; writers never do, they hold the lock alone
+            with self._indexes_lock:
+                if self._indexes is None:
+                    self._indexes = TodoIndexes(self.snapshot())
+        return self._indexes
+
+    def __len__(self):
+        with self.lock.read_locked():
+            return len(self.todo)
+
+    def all(self):
+        """Returns: a list of all todos in insertion order"""
+        with self.lock.read_locked():
+            return list(self.todo.values())
+
+    def snapshot(self):
+        """
+        Returns: a list of all todos, without taking the lock - for on_change
+                 callbacks, which run with the write lock already held
+        """
+        return list(self.todo.values())
+
+    def get(self, todo_id):
+        """Returns: the todo with this id, or None"""
+        with self.lock.read_locked():
+            return self._item(todo_id) if todo_id in self.todo else None
+
+    def id_at(self, index):
+        """
+        Compatibility lookup for the old positional routes (O(N)).
+        Returns: the id of the todo at this list position, or None if out of range
+        """
+        # islice takes no more than sys.maxsize, and no list is that long
+        if not 0 <= index <= sys.maxsize:
+            return None
+        with self.lock.read_locked():
+            return next(islice(self.todo, index, None), None)
+
+    def page(self, limit, after=None, completed=None, query=None):
+        """
+        Returns up to limit todos (all if limit is None) in id order, starting
+        after the id `after`.
+        completed keeps only todos with that completed value (missing means False),
+        query only those whose task or description contain all of its words.
+        Filters are answered from the indexes. When they match few todos the
+        matches are sorted; otherwise resuming after an id walks the ids that
+        follow it, so a page costs its size plus the number of ids it skips over.
+        Returns: (todos, next_after) - next_after is None when nothing is left
+        """
+        with self.lock.read_locked():
+            return self._page(limit, after, completed, query)
+
+    def fragments(self, encode):
+        """
+        Returns: every todo encoded with encode(todo) -> bytes, in id order.
+        An encoding is kept until its todo changes, so a list in which little
+        changed is joined from encodings it already has rather than encoded
+        again (and a compact or lazily loaded todo isn't even unpacked). The
+        encodings are for one encode function at a time; another one starts over.
+        """
+        with self.lock.read_locked():
+            return self._fragments_of(self.todo, encode)
+
+    def _fragments_of(self, ids, encode):
+        """fragments() of ids, for callers that already hold the lock"""
+        # Readers may fill in encodings side by side; a writer, which drops
+        # them, waits for all readers to be done
+        if encode is not self._fragment_encoder:
+            self._fragments = {}
+            self._fragment_encoder = encode
+        fragments = self._fragments
+        result = list(map(fragments.get, ids))
+        # Encodings are only kept for todos in the store, so any missing shows in the count
+        if len(fragments) < len(result):
+            for position, (todo_id, fragment) in enumerate(zip(ids, result)):
+                if fragment is None:
+                    result[position] = fragments.setdefault(todo_id, encode(self._item(todo_id)))
+        return result
+
+    def _page(self, limit, after, completed, query):
+        """page() for callers that already hold the lock"""
+        terms = tokenize(query) if query is not None else None
+        ids = self._matching_ids(completed, terms)
+        if ids is not None and (limit is None or len(ids) ** 2 <= limit * len(self.todo)):
+            # Few matches: sort them and cut the page out
+            ids = sorted(ids)
+            start = bisect_right(ids, after) if after is not None else 0
+            end = len(ids) if limit is None else start + limit
+            page = [self._item(todo_id) for todo_id in ids[start:end]]
+            return page, (page[-1]["id"] if end < len(ids) and page else None)
+
+        # Many matches: walk the ids in order, a page will come up soon
+        if after is None:
+            candidates = iter(self.todo)
+        else:
+            # Ids below the first todo's can't match, however far back the cursor points
+            start = max(after + 1, next(iter(self.todo), self.next_id))
+            candidates = (todo_id for todo_id in range(start, self.next_id) if todo_id in self.todo)
+        if ids is not None:
+            candidates = (todo_id for todo_id in candidates if todo_id in ids)
+
+        page = list(islice(candidates, limit))
+        if limit is not None and len(page) == limit and next(candidates, None) is not None:
+            return [self._item(todo_id) for todo_id in page], page[-1]
+        return [self._item(todo_id) for todo_id in page], None
+
+    def _matching_ids(self, completed, terms):
+        """Returns: the set of ids that pass the filters, or None if there are no filters"""
+        if terms is not None:
+            ids = self.indexes.search(terms)
+            if completed is True:
+                ids = ids & self.indexes.by_completed[True]
+            elif completed is False:
+                ids = ids - self.indexes.by_completed[True]
+            return ids
+        if completed is not None:
+            return self.indexes.by_completed[completed]
+        return None
+
+    def add(self, item):
+        """
+        Stores a new todo under the next id (any id sent by the client is replaced).
+        Returns: the stored todo
+        """
+        with self.lock.write_locked():
+            item = self._add(item)
+            self._changed([{"op": "add", "item": item}])
+            return item
+
+    def update(self, todo_id, fields):
+        """
+        Merges fields into the todo with this id (the id itself can't be changed).
+        Returns: the updated todo, or None if there is no such todo
+        """
+        with self.lock.write_locked():
+            if todo_id not in self.todo:
+                return None
+            updated, record = self._update(todo_id, fields)
+            self._changed([record])
+            return updated
+
+    def delete(self, todo_id):
+        """Returns: True if a todo was deleted"""
+        with self.lock.write_locked():
+            if todo_id not in self.todo:
+                return False
+            self._delete(todo_id)
+            self._changed([{"op": "delete", "id": todo_id}])
+            return True
+
+    def apply_batch(self, creates=(), updates=(), deletes=()):
+        """
+        Applies new todos, then (todo_id, fields) updates, then deletes by id as
+        one unit under a single write lock, persisted with a single on_change call.
+        Nothing is applied if any update or delete names a missing todo (or a
+        todo is deleted twice).
+        Returns: (created_todos, missing) - missing holds ("update"/"delete", position)
+                 for every bad reference; if it is non-empty nothing changed
+        """
+        with self.lock.write_locked():
+            missing = [("update", position) for position, (todo_id, _) in enumerate(updates)
+                       if todo_id not in self.todo]
+            deleting = set()
+            for position, todo_id in enumerate(deletes):
+                if todo_id not in self.todo or todo_id in deleting:
+                    missing.append(("delete", position))
+                deleting.add(todo_id)
+            if missing:
+                return [], missing
+
+            records = []
+            created = []
+            for item in creates:
+                item = self._add(item)
+                created.append(item)
+                records.append({"op": "add", "item": item})
+            for todo_id, fields in updates:
+                records.append(self._update(todo_id, fields)[1])
+            for todo_id in deletes:
+                self._delete(todo_id)
+                records.append({"op": "delete", "id": todo_id})
+
+            if records:
+                self._changed(records)
+            return created, []
+
+    def _add(self, item, todo_id=None):
+        # sharded.ShardedTodoStore hands out the ids of its shards itself
+        if todo_id is None:
+            todo_id = self.next_id
+        self.next_id = max(self.next_id, todo_id + 1)
+        item = {"id": todo_id, **item}
+        item["id"] = todo_id
+        self._put(item)
+        if self._indexes is not None:
+            self._indexes.add(item)
+        return item
+
+    def _update(self, todo_id, fields):
+        fields = {key: value for key, value in fields.items() if key != "id"}
+        old = self._item(todo_id)
+        updated = dict(old)
+        updated.update(fields)
+        self._put(updated)
+        self._fragments.pop(todo_id, None)
+        if self._indexes is not None:
+            self._indexes.replace(old, updated)
+        return updated, {"op": "update", "id": todo_id, "fields": fields}
+
+    def _delete(self, todo_id):
+        if self._indexes is not None:
+            self._indexes.remove(self._item(todo_id))
+        del self.todo[todo_id]
+        self._fragments.pop(todo_id, None)
+
+    # How todos are held in self.todo; compact.CompactTodoStore packs them
+    def _item(self, todo_id):
+        return self.todo[todo_id]
+
+    def _put(self, item):
+        self.todo[item["id"]] = item
+
+    def _changed(self, records):
+        self.version += 1
+        if self.on_change is not None:
+            self.on_change(records)
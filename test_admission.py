@@ -0,0 +1,70 @@
+import socket
+import threading
+import time
+
+from admission import ConcurrencyLimiter, RateLimiter, overloaded_response, reject_connection, retry_after_header
+
+
+def test_rate_limiter_allows_bursts_then_the_rate(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    limiter = RateLimiter(rate=8, burst=3)
+
+    assert [limiter.check("a") for _ in range(3)] == [0, 0, 0]
+    assert limiter.check("a") == 0.125
+    # Other clients have buckets of their own
+    assert limiter.check("b") == 0
+
+    now[0] += 0.125
+    assert limiter.check("a") == 0 and limiter.check("a") > 0
+    now[0] += 10
+    assert [limiter.check("a") for _ in range(4)][-1] > 0
+    assert retry_after_header(0.01) == "1" and retry_after_header(2.5) == "3"
+
+
+def test_rate_limiter_keeps_a_bounded_number_of_clients():
+    limiter = RateLimiter(rate=1000, burst=1, max_clients=100)
+    for client in range(1000):
+        limiter.check(client)
+    assert len(limiter._buckets) <= 100
+
+
+def test_concurrency_limiter_queues_then_turns_away():
+    limiter = ConcurrencyLimiter(max_active=1, max_waiting=1, timeout=5)
+    assert limiter.enter()
+
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(limiter.enter()))
+    waiter.start()
+    while not limiter.waiting:
+        time.sleep(0.01)
+    # The queue is full, so the next request doesn't wait at all
+    start = time.monotonic()
+    assert not limiter.enter()
+    assert time.monotonic() - start < 0.5
+
+    limiter.leave()
+    waiter.join()
+    assert results == [True] and limiter.active == 1 and limiter.waiting == 0
+
+    # Waiting is bounded by the timeout
+    limiter.timeout = 0.05
+    assert not limiter.enter()
+    limiter.leave()
+    assert limiter.active == 0 and ConcurrencyLimiter(0, 0, 0).enter()
+
+
+def test_rejected_connection_gets_the_whole_response():
+    listener = socket.create_server(("localhost", 0))
+    client = socket.create_connection(listener.getsockname())
+    client.sendall(b"GET /todo HTTP/1.1\r\nHost: x\r\n\r\n")
+    accepted, _ = listener.accept()
+    reject_connection(accepted, overloaded_response(2))
+
+    response = b""
+    while chunk := client.recv(4096):
+        response += chunk
+    assert response.startswith(b"HTTP/1.1 503 ") and b"Retry-After: 2\r\n" in response
+    assert response.endswith(b'{"error": "Server is overloaded, retry later"}')
+    client.close()
+    listener.close()
@@ -6,6 +6,8 @@ import os
 import sys
 
 BASE_URL = "http://localhost:8000"
+# One session for every call, so they all share a kept-alive connection
+session = requests.Session()
 TEST_FILE = "todos_test.json"
 server_process = None
 
@@ -22,10 +24,24 @@ def start_server():
         stderr=subprocess.PIPE,
         env=env
     )
-    time.sleep(2)  # Wait for server to start
+    wait_until_ready()
     print("Server started.\n")
     return server_process
 
+def wait_until_ready(timeout=10):
+    """Polls the server until it answers, rather than guessing how long it takes to start"""
+    deadline = time.monotonic() + timeout
+    while True:
+        if server_process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {server_process.returncode}")
+        try:
+            session.get(f"{BASE_URL}/todo?limit=1", timeout=1)
+            return
+        except requests.exceptions.ConnectionError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
 def stop_server():
     """Stop the server"""
     global server_process
@@ -96,7 +112,7 @@ def test_persistence():
 
     # 1. GET all (should be empty - no file yet)
     print("\n1. GET /todo (should be empty)")
-    r = requests.get(f"{BASE_URL}/todo")
+    r = session.get(f"{BASE_URL}/todo")
     print(f"   Status: {r.status_code}")
     print(f"   Response: {r.json()}")
     assert r.status_code == 200
@@ -105,7 +121,7 @@ def test_persistence():
 
     # 2. POST - Add first task
     print("\n2. POST /todo - Add first task")
-    r = requests.post(f"{BASE_URL}/todo",
+    r = session.post(f"{BASE_URL}/todo",
                      json={"task": "Buy milk", "completed": False})
     print(f"   Status: {r.status_code}")
     print(f"   Response: {r.json()}")
@@ -118,7 +134,7 @@ def test_persistence():
 
     # 4. POST - Add second task
     print("\n4. POST /todo - Add second task")
-    r = requests.post(f"{BASE_URL}/todo",
+    r = session.post(f"{BASE_URL}/todo",
                      json={"task": "Study Python", "completed": False})
     print(f"   Status: {r.status_code}")
     print(f"   Response: {r.json()}")
@@ -126,14 +142,14 @@ def test_persistence():
 
     # 5. POST - Add third task
     print("\n5. POST /todo - Add third task")
-    r = requests.post(f"{BASE_URL}/todo",
+    r = session.post(f"{BASE_URL}/todo",
                      json={"task": "Exercise", "completed": False})
     print(f"   Status: {r.status_code}")
     print(f"   Response: {r.json()}")
     assert r.status_code == 201
 
     print("\n5. POST /todo - Add fourth task")
-    r = requests.post(f"{BASE_URL}/todo",
+    r = session.post(f"{BASE_URL}/todo",
                      json={"task": "Exercise123", "completed": True})
     print(f"   Status: {r.status_code}")
     print(f"   Response: {r.json()}")
@@ -141,7 +157,7 @@ def test_persistence():
 
     # 6. GET all (should have 3 tasks)
     print("\n6. GET /todo (should have 3 tasks)")
-    r = requests.get(f"{BASE_URL}/todo")
+    r = session.get(f"{BASE_URL}/todo")
     print(f"   Status: {r.status_code}")
     print(f"   Response: {r.json()}")
     assert r.status_code == 200
@@ -163,7 +179,7 @@ def test_persistence():
     restart_server()
 
     print("\n8. GET /todo after restart (should STILL have 3 tasks)")
-    r = requests.get(f"{BASE_URL}/todo")
+    r = session.get(f"{BASE_URL}/todo")
     print(f"   Status: {r.status_code}")
     print(f"   Response: {r.json()}")
     assert r.status_code == 200
@@ -181,7 +197,7 @@ def test_persistence():
     print("=" * 60)
 
     print("\n9. GET /todo/0 - Get first task")
-    r = requests.get(f"{BASE_URL}/todo/0")
+    r = session.get(f"{BASE_URL}/todo/0")
     print(f"   Status: {r.status_code}")
     print(f"   Response: {r.json()}")
     assert r.status_code == 200
@@ -196,7 +212,7 @@ def test_persistence():
     print("=" * 60)
 
     print("\n10. PUT /todo/0 - Update first task")
-    r = requests.put(f"{BASE_URL}/todo/0",
+    r = session.put(f"{BASE_URL}/todo/0",
                     json={"task": "Buy eggs instead", "completed": True})
     print(f"   Status: {r.status_code}")
     print(f"   Response: {r.json()}")
@@ -204,7 +220,7 @@ def test_persistence():
     print("   [PASS] Task updated")
 
     print("\n11. GET /todo/0 - Verify update in memory")
-    r = requests.get(f"{BASE_URL}/todo/0")
+    r = session.get(f"{BASE_URL}/todo/0")
     print(f"   Status: {r.status_code}")
     print(f"   Response: {r.json()}")
     assert r.status_code == 200
@@ -222,7 +238,7 @@ def test_persistence():
     restart_server()
 
     print("\n12. GET /todo/0 after restart - Verify update persisted")
-    r = requests.get(f"{BASE_URL}/todo/0")
+    r = session.get(f"{BASE_URL}/todo/0")
     print(f"   Status: {r.status_code}")
     print(f"   Response: {r.json()}")
     assert r.status_code == 200
@@ -238,14 +254,14 @@ def test_persistence():
     print("=" * 60)
 
     print("\n13. DELETE /todo/1 - Delete second task")
-    r = requests.delete(f"{BASE_URL}/todo/1")
+    r = session.delete(f"{BASE_URL}/todo/1")
     print(f"   Status: {r.status_code}")
     print(f"   Response: {r.json()}")
     assert r.status_code == 200
     print("   [PASS] Task deleted")
 
     print("\n14. GET /todo - Verify deletion in memory (should have 2 tasks)")
-    r = requests.get(f"{BASE_URL}/todo")
+    r = session.get(f"{BASE_URL}/todo")
     print(f"   Status: {r.status_code}")
     print(f"   Response: {r.json()}")
     assert r.status_code == 200
@@ -262,7 +278,7 @@ def test_persistence():
     restart_server()
 
     print("\n15. GET /todo after restart - Verify deletion persisted (should have 2)")
-    r = requests.get(f"{BASE_URL}/todo")
+    r = session.get(f"{BASE_URL}/todo")
     print(f"   Status: {r.status_code}")
     print(f"   Response: {r.json()}")
     assert r.status_code == 200
@@ -284,7 +300,7 @@ def test_persistence():
 
     # Invalid index (not a number)
     print("\n17. GET /todo/abc - Invalid index")
-    r = requests.get(f"{BASE_URL}/todo/abc")
+    r = session.get(f"{BASE_URL}/todo/abc")
     print(f"    Status: {r.status_code}")
     print(f"    Response: {r.json()}")
     assert r.status_code == 400
@@ -292,7 +308,7 @@ def test_persistence():
 
     # Index out of range
     print("\n18. GET /todo/999 - Index out of range")
-    r = requests.get(f"{BASE_URL}/todo/999")
+    r = session.get(f"{BASE_URL}/todo/999")
     print(f"    Status: {r.status_code}")
     print(f"    Response: {r.json()}")
     assert r.status_code == 404
@@ -300,7 +316,7 @@ def test_persistence():
 
     # Invalid JSON
     print("\n19. POST /todo - Invalid JSON")
-    r = requests.post(f"{BASE_URL}/todo",
+    r = session.post(f"{BASE_URL}/todo",
                      headers={"Content-Type": "application/json"},
                      data='{bad json}')
     print(f"    Status: {r.status_code}")
@@ -310,7 +326,7 @@ def test_persistence():
 
     # Invalid path
     print("\n20. GET /invalid - Invalid path")
-    r = requests.get(f"{BASE_URL}/invalid")
+    r = session.get(f"{BASE_URL}/invalid")
     print(f"    Status: {r.status_code}")
     print(f"    Response: {r.json()}")
     assert r.status_code == 404
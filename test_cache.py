@@ -0,0 +1,59 @@
+from cache import ResponseCache, encoded_etag, etag_matches
+
+
+def test_entry_is_only_served_at_its_version():
+    cache = ResponseCache()
+    entry = cache.put("/todo", 3, b"[]")
+    assert cache.get("/todo", 3) == entry
+    assert cache.get("/todo", 4) is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2)
+    cache.put("/a", 0, b"a")
+    cache.put("/b", 0, b"b")
+    cache.get("/a", 0)
+    cache.put("/c", 0, b"c")
+    assert cache.get("/b", 0) is None
+    assert cache.get("/a", 0) is not None
+    assert len(cache) == 2
+
+
+def test_cache_is_bounded_by_bytes():
+    cache = ResponseCache(max_bytes=10)
+    cache.put("/a", 0, b"123456")
+    cache.put("/b", 0, b"123456")
+    assert cache.get("/a", 0) is None
+    assert cache.get("/b", 0) is not None
+
+    # Too big to ever fit: returned with an ETag but not stored
+    entry = cache.put("/c", 0, b"x" * 11)
+    assert entry.etag and cache.get("/c", 0) is None
+
+
+def test_etag_matching():
+    etag = ResponseCache().put("/todo", 0, b"[]").etag
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", W/{etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"other"', etag)
+    assert not etag_matches(None, etag)
+
+
+def test_compressed_copies_are_made_once_and_counted():
+    calls = []
+
+    def encode(body):
+        calls.append(body)
+        return body[:2]
+
+    cache = ResponseCache(max_bytes=10)
+    entry = cache.put("/a", 0, b"123456")
+    assert cache.encoded("/a", entry, "gzip", encode) == b"12"
+    assert cache.encoded("/a", entry, "gzip", encode) == b"12"
+    assert len(calls) == 1
+
+    # Body and copy count together: 6 + 2 + 4 no longer fits in 10 bytes
+    cache.put("/b", 0, b"1234")
+    assert cache.get("/a", 0) is None and cache.get("/b", 0) is not None
+    assert encoded_etag(entry.etag, "gzip") != entry.etag
@@ -0,0 +1,68 @@
+import threading
+import time
+
+from changes import ChangeFeed
+from sqlite_store import SqliteTodoStore
+from store import TodoStore
+
+
+def test_changes_are_numbered_in_order():
+    feed = ChangeFeed(capacity=100, start=0)
+    store = TodoStore(on_change=feed.publish)
+    store.add({"task": "Buy milk"})
+    store.update(1, {"completed": True, "id": 5})
+    store.apply_batch([{"task": "Walk dog"}], [], [1])
+
+    changes, last = feed.since(0)
+    assert last == 4 and [change["seq"] for change in changes] == [1, 2, 3, 4]
+    assert changes[0] == {"seq": 1, "op": "add", "id": 1, "item": {"id": 1, "task": "Buy milk"}}
+    assert changes[1] == {"seq": 2, "op": "update", "id": 1, "fields": {"completed": True}}
+    assert [(change["op"], change["id"]) for change in changes[2:]] == [("add", 2), ("delete", 1)]
+    assert feed.since(2) == (changes[2:], 4) and feed.since(4) == ([], 4)
+
+
+def test_old_or_foreign_cursors_have_to_resync():
+    feed = ChangeFeed(capacity=3, start=100)
+    # Nothing is lost yet: the changes after 100 are all kept
+    feed.publish([{"op": "delete", "id": todo_id} for todo_id in range(1, 4)])
+    assert len(feed.since(100)[0]) == 3
+
+    feed.publish([{"op": "delete", "id": 4}])
+    assert feed.since(100) == (None, 104)
+    assert [change["id"] for change in feed.since(101)[0]] == [2, 3, 4]
+    # Cursors from before a restart, or from nowhere
+    assert feed.since(5) == (None, 104) and feed.since(105) == (None, 104)
+    # A new feed numbers from the clock, past anything an older one handed out
+    assert ChangeFeed().since(104)[0] is None and ChangeFeed().last > 104
+
+
+def test_waiting_readers_are_woken():
+    feed = ChangeFeed(start=0)
+    results = []
+    reader = threading.Thread(target=lambda: results.append(feed.since(0, timeout=10)))
+    reader.start()
+    while not feed.waiters:
+        time.sleep(0.01)
+    feed.publish([{"op": "delete", "id": 1}])
+    reader.join()
+    assert results == [([{"seq": 1, "op": "delete", "id": 1}], 1)] and feed.waiters == 0
+
+    start = time.monotonic()
+    assert feed.since(1, timeout=0.05) == ([], 1)
+    feed.close()
+    assert feed.since(1, timeout=10) == ([], 1) and time.monotonic() - start < 5
+
+
+def test_sqlite_store_reports_the_same_records(tmp_path):
+    records = {"memory": [], "sqlite": []}
+    stores = {"memory": TodoStore(on_change=records["memory"].append),
+              "sqlite": SqliteTodoStore(str(tmp_path / "todos.db"), on_change=records["sqlite"].append)}
+    for store in stores.values():
+        store.add({"task": "Buy milk", "completed": False})
+        store.update(1, {"completed": True})
+        store.update(7, {"completed": True})
+        store.delete(7)
+        store.apply_batch([{"task": "Walk dog"}], [(1, {"task": "Buy oat milk"})], [1])
+        store.apply_batch([], [], [99])
+    assert records["sqlite"] == records["memory"] and len(records["memory"]) == 3
+    stores["sqlite"].close()
@@ -0,0 +1,33 @@
+import json
+
+import pytest
+
+from codec import STDLIB, get_codec, make_orjson_codec
+
+CODECS = [STDLIB] + ([make_orjson_codec()] if make_orjson_codec() is not None else [])
+
+
+@pytest.mark.parametrize("codec", CODECS, ids=lambda codec: codec.name)
+def test_codecs_give_the_same_data(codec):
+    data = {"id": 1, "task": "Café ☕", "completed": False, "tags": ["a", None], "n": 2 ** 70}
+    assert json.loads(codec.dumps(data)) == data and codec.loads(json.dumps(data).encode()) == data
+    # A list joined from items encoded one by one is the list encoded whole
+    items = [data, {"id": 2}]
+    assert json.loads(b"[" + codec.separator.join(map(codec.dumps, items)) + b"]") == items
+
+    # Integers beyond 64 bits come back exact, not as floats
+    for big in (123456789012345678901234567890, -2 ** 63 - 1):
+        item = codec.loads(b'{"task": "x", "extra": %d}' % big)
+        assert item["extra"] == big and type(item["extra"]) is int
+
+    # What the stdlib accepts, every codec accepts
+    assert codec.loads(b'{"a": "\\ud800"}') == {"a": "\ud800"}
+    with pytest.raises(ValueError):
+        codec.loads(b'{"a": 1} x')
+
+
+def test_get_codec():
+    assert get_codec("json") is STDLIB
+    assert get_codec("auto").name == ("orjson" if len(CODECS) > 1 else "json")
+    with pytest.raises(ValueError):
+        get_codec("yaml")
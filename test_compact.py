@@ -0,0 +1,35 @@
+from compact import CompactTodoStore, pack_todo, unpack_todo
+
+
+def test_pack_round_trips_any_fields_in_order():
+    shapes = {}
+    item = {"task": "Buy milk", "id": 3, "completed": False, "tags": ["shop"], "due": None}
+    row = pack_todo(item, shapes)
+    assert unpack_todo(row) == item and list(unpack_todo(row)) == list(item)
+
+    # Todos with the same fields share one shape tuple
+    other = pack_todo({"task": "Walk dog", "id": 4, "completed": True, "tags": [], "due": "soon"}, shapes)
+    assert other[-1] is row[-1] and len(shapes) == 1
+
+
+def test_compact_store_behaves_like_dicts():
+    changes = []
+    store = CompactTodoStore({1: {"id": 1, "task": "Buy milk", "completed": False, "notes": "2%"}},
+                             on_change=changes.append)
+    assert isinstance(store.todo[1], tuple)
+
+    store.add({"task": "Walk dog", "id": 42})
+    assert store.update(1, {"completed": True, "priority": 2}) == {
+        "id": 1, "task": "Buy milk", "completed": True, "notes": "2%", "priority": 2}
+    assert store.update(2, {"task": "Walk the dog"})["task"] == "Walk the dog"
+
+    # Returned todos are copies; changing one doesn't reach the store
+    store.get(1)["task"] = "changed"
+    assert store.get(1)["task"] == "Buy milk"
+
+    assert store.all() == store.snapshot() == [
+        {"id": 1, "task": "Buy milk", "completed": True, "notes": "2%", "priority": 2},
+        {"id": 2, "task": "Walk the dog"}]
+    assert store.page(1, completed=True) == ([store.get(1)], None)
+    assert [item["id"] for item in store.page(None, query="dog")[0]] == [2]
+    assert store.delete(1) and store.get(1) is None and len(changes) == 4
@@ -0,0 +1,42 @@
+import gzip
+import zlib
+
+import pytest
+
+from compression import StreamCompressor, choose_encoding, compress, decompress
+
+
+def test_choose_encoding_follows_accept_encoding():
+    assert choose_encoding(None) is None
+    assert choose_encoding("gzip, deflate, br") == "gzip"
+    assert choose_encoding("deflate") == "deflate"
+    assert choose_encoding("gzip;q=0.5, deflate;q=0.8") == "deflate"
+    assert choose_encoding("gzip;q=0, identity") is None
+    assert choose_encoding("*") == "gzip"
+    assert choose_encoding("br, identity") is None
+
+
+def test_round_trips_and_standard_decoders():
+    body = b'{"task": "Buy milk", "completed": false}' * 100
+    assert gzip.decompress(compress(body, "gzip")) == body
+    assert zlib.decompress(compress(body, "deflate")) == body
+    for encoding in ("gzip", "deflate"):
+        assert decompress(compress(body, encoding), encoding, len(body)) == body
+
+    # Raw deflate, as some clients send for "deflate"
+    raw = zlib.compressobj(wbits=-15)
+    assert decompress(raw.compress(body) + raw.flush(), "deflate", len(body)) == body
+
+    compressor = StreamCompressor("gzip")
+    pieces = [compressor.compress(body), compressor.compress(body), compressor.finish()]
+    assert gzip.decompress(b"".join(pieces)) == body * 2
+
+
+def test_decompress_rejects_bad_bodies():
+    body = compress(b"x" * 10000, "gzip")
+    with pytest.raises(ValueError):
+        decompress(body, "gzip", 9999)
+    with pytest.raises(ValueError):
+        decompress(body[:-10], "gzip", 10000)
+    with pytest.raises(ValueError):
+        decompress(b"not gzip", "gzip", 10000)
@@ -0,0 +1,516 @@
+import gzip
+import http.client
+import json
+import marshal
+import random
+import socket
+import threading
+import time
+from itertools import chain
+
+import pytest
+
+import server
+from admission import ConcurrencyLimiter, RateLimiter
+from cache import ResponseCache
+from compact import CompactTodoStore
+from profiling import RequestProfiler
+from sharded import existing_shard_paths, load_shards
+from snapshot import load_snapshot, write_snapshot
+from sqlite_store import SqliteTodoStore
+from store import TodoStore
+
+WORKERS = 8
+POSTS_PER_WORKER = 40
+DELETES_PER_WORKER = 10
+
+
+@pytest.fixture(params=[(engine, "json", layout) for engine in ("threaded", "pool", "asyncio")
+                        for layout in ("dict", "compact")]
+                       + [("threaded", "sqlite", None), ("threaded", "sharded", None), ("threaded", "snapshot", None)],
+                ids=lambda param: "-".join(filter(None, param)))
+def live_server(request, tmp_path, monkeypatch):
+    """Runs ToDoHandler on a free port with an empty store backed by a temp file."""
+    engine, storage, layout = request.param
+    if storage == "sqlite":
+        store = SqliteTodoStore(str(tmp_path / "todos.db"), on_change=server.change_feed.publish)
+        monkeypatch.setattr(server, "store", store)
+    elif storage == "sharded":
+        monkeypatch.setattr(server, "TODO_FILENAME", str(tmp_path / "todos.json"))
+        monkeypatch.setattr(server, "SHARDS", 3)
+        monkeypatch.setattr(server, "store", server.make_sharded_store())
+    elif storage == "snapshot":
+        # The json backend started from an (empty) snapshot, on snapshot.LazyTodos
+        monkeypatch.setattr(server, "TODO_FILENAME", str(tmp_path / "todos.json"))
+        write_snapshot(str(tmp_path / "todos.snap"), [])
+        store = TodoStore(load_snapshot(str(tmp_path / "todos.snap")), on_change=server.record_change)
+        monkeypatch.setattr(server, "store", store)
+    else:
+        monkeypatch.setattr(server, "TODO_FILENAME", str(tmp_path / "todos.json"))
+        monkeypatch.setattr(server, "MEMORY_LAYOUT", layout)
+        monkeypatch.setattr(server, "store", server.make_json_store({}))
+    # Cached responses are keyed by store version, which every new store starts again from
+    monkeypatch.setattr(server, "response_cache", ResponseCache(server.CACHE_ENTRIES, server.CACHE_BYTES))
+
+    httpd = server.make_server(("localhost", 0), engine=engine)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd.server_address[1], storage, tmp_path
+    httpd.shutdown()
+    httpd.server_close()
+    server.store.close()
+
+
+def call(port, method, path, body=None):
+    conn = http.client.HTTPConnection("localhost", port, timeout=10)
+    try:
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        conn.request(method, path, body=json.dumps(body) if body is not None else None,
+                     headers=headers)
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        conn.close()
+
+
+def test_mixed_concurrent_crud(live_server):
+    port, storage, tmp_path = live_server
+    deleted = []
+    errors = []
+
+    def worker(worker_id):
+        rng = random.Random(worker_id)
+        try:
+            for i in range(POSTS_PER_WORKER):
+                status, _ = call(port, "POST", "/todo",
+                                 {"task": f"w{worker_id}-{i}", "completed": False})
+                assert status == 201
+
+                # Mix reads and partial updates in between the writes
+                status, items = call(port, "GET", "/todo")
+                assert status == 200 and isinstance(items, list)
+                if items:
+                    index = rng.randrange(len(items))
+                    status, _ = call(port, "PUT", f"/todo/{index}", {"completed": True})
+                    assert status in (200, 404)
+
+            for _ in range(DELETES_PER_WORKER):
+                status, _ = call(port, "DELETE", "/todo/0")
+                if status == 200:
+                    deleted.append(1)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(WORKERS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors, errors
+
+    status, items = call(port, "GET", "/todo")
+    assert status == 200
+    assert len(items) == WORKERS * POSTS_PER_WORKER - len(deleted)
+
+    # No task was duplicated or mangled by an interleaved write
+    tasks = [item["task"] for item in items]
+    assert len(tasks) == len(set(tasks))
+    assert all(set(item) <= {"id", "task", "completed"} for item in items)
+    assert len({item["id"] for item in items}) == len(items)
+
+    # What reached disk is exactly what the server returns
+    if storage == "sqlite":
+        reopened = SqliteTodoStore(str(tmp_path / "todos.db"))
+        assert reopened.all() == items
+        reopened.close()
+    elif storage == "sharded":
+        parts, _, _ = load_shards(server.TODO_FILENAME, 3)
+        assert sorted(chain.from_iterable(part.values() for part in parts), key=lambda item: item["id"]) == items
+    else:
+        with open(server.TODO_FILENAME) as f:
+            assert json.load(f) == items
+
+
+def read_response(rfile):
+    """Returns: (status, headers, body) of the next response on a socket's file"""
+    status = int(rfile.readline().split()[1])
+    headers = {}
+    while True:
+        line = rfile.readline().decode().strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return status, headers, rfile.read(int(headers.get("content-length", 0)))
+
+
+def test_out_of_range_index_is_not_found(live_server):
+    port, _, _ = live_server
+    call(port, "POST", "/todo", {"task": "Only one", "completed": False})
+    assert call(port, "GET", "/todo/5") == (404, {"error": "Task not found"})
+    assert call(port, "PUT", "/todo/5", {"completed": True}) == (404, {"error": "Task not found"})
+    assert call(port, "DELETE", "/todo/5") == (404, {"error": "Task not found"})
+
+
+def test_unknown_path_is_not_found(live_server):
+    port, _, _ = live_server
+    for method in ("GET", "POST", "PUT", "DELETE"):
+        assert call(port, method, "/other", {}) == (404, {"error": "Path not found"})
+
+
+def test_out_of_range_cursor_and_id(live_server):
+    port, _, _ = live_server
+    assert call(port, "GET", "/todo?limit=5&cursor=-1000000000000") == (400, {"error": "Invalid cursor"})
+    assert call(port, "GET", "/todo?limit=5&cursor=99999999999999999999") == (400, {"error": "Invalid cursor"})
+    assert call(port, "GET", "/todo/id/99999999999999999999") == (404, {"error": "Task not found"})
+    assert call(port, "DELETE", "/todo/id/99999999999999999999") == (404, {"error": "Task not found"})
+    for method in ("GET", "PUT", "DELETE"):
+        assert call(port, method, "/todo/99999999999999999999", {}) == (404, {"error": "Task not found"})
+
+
+def test_connection_is_kept_alive_and_pipelined(live_server):
+    port, _, _ = live_server
+    conn = http.client.HTTPConnection("localhost", port, timeout=10)
+    for task in ("one", "two"):
+        conn.request("POST", "/todo", body=json.dumps({"task": task, "completed": False}),
+                     headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        assert response.status == 201 and int(response.headers["Content-Length"]) > 0
+        response.read()
+    sock = conn.sock
+
+    # Streamed responses are chunked, so the connection survives them too
+    conn.request("GET", "/todo?format=ndjson")
+    response = conn.getresponse()
+    assert response.headers["Transfer-Encoding"] == "chunked"
+    assert [json.loads(line)["task"] for line in response.read().splitlines()] == ["one", "two"]
+    conn.request("GET", "/todo")
+    assert len(json.loads(conn.getresponse().read())) == 2
+    assert conn.sock is sock
+
+    # A body the server didn't read closes the connection rather than being
+    # taken for the next request
+    conn.request("PUT", "/todo/id/999", body=json.dumps({"completed": True}))
+    response = conn.getresponse()
+    assert response.status == 404 and response.headers["Connection"] == "close"
+    response.read()
+    conn.close()
+
+    # Pipelined requests are answered in order on one connection
+    with socket.create_connection(("localhost", port), timeout=10) as sock:
+        sock.sendall(b"GET /todo/id/1 HTTP/1.1\r\nHost: x\r\n\r\n"
+                     b"GET /todo/id/999 HTTP/1.1\r\nHost: x\r\n\r\n"
+                     b"GET /todo/id/2 HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+        rfile = sock.makefile("rb")
+        responses = [read_response(rfile) for _ in range(3)]
+        assert [status for status, _, _ in responses] == [200, 404, 200]
+        assert [json.loads(body).get("task") for _, _, body in responses] == ["one", None, "two"]
+        assert rfile.read() == b""
+
+
+@pytest.mark.parametrize("engine", ["threaded", "asyncio"])
+def test_idle_connection_is_closed(engine, monkeypatch):
+    monkeypatch.setattr(server.ToDoHandler, "timeout", 0.3)
+    httpd = server.make_server(("localhost", 0), engine=engine)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        with socket.create_connection(httpd.server_address[:2], timeout=10) as sock:
+            sock.sendall(b"GET /nowhere HTTP/1.1\r\nHost: x\r\n\r\n")
+            rfile = sock.makefile("rb")
+            assert read_response(rfile)[0] == 404
+            start = time.monotonic()
+            assert rfile.read() == b""
+            assert time.monotonic() - start < 5
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_compression_is_negotiated(live_server, monkeypatch):
+    port, _, _ = live_server
+    monkeypatch.setattr(server, "COMPRESS_MIN_BYTES", 200)
+    conn = http.client.HTTPConnection("localhost", port, timeout=10)
+
+    # A gzip compressed request body
+    batch = {"create": [{"task": f"Task {i}", "completed": False} for i in range(20)]}
+    conn.request("POST", "/todo/batch", body=gzip.compress(json.dumps(batch).encode()),
+                 headers={"Content-Type": "application/json", "Content-Encoding": "gzip"})
+    response = conn.getresponse()
+    assert response.status == 200 and response.read()
+
+    conn.request("GET", "/todo", headers={"Accept-Encoding": "gzip"})
+    response = conn.getresponse()
+    assert response.headers["Content-Encoding"] == "gzip"
+    items = json.loads(gzip.decompress(response.read()))
+    assert len(items) == 20
+    etag = response.headers["ETag"]
+
+    # The compressed copy has its own ETag, and is what the client gets back 304 for
+    conn.request("GET", "/todo", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    response = conn.getresponse()
+    assert response.status == 304 and response.read() == b""
+    conn.request("GET", "/todo", headers={"If-None-Match": etag})
+    response = conn.getresponse()
+    assert response.status == 200 and "Content-Encoding" not in response.headers
+    assert json.loads(response.read()) == items
+
+    # Small responses and streams
+    conn.request("GET", "/todo/id/1", headers={"Accept-Encoding": "gzip"})
+    response = conn.getresponse()
+    assert "Content-Encoding" not in response.headers and json.loads(response.read())["id"] == 1
+    conn.request("GET", "/todo?format=ndjson", headers={"Accept-Encoding": "gzip"})
+    response = conn.getresponse()
+    assert len(gzip.decompress(response.read()).splitlines()) == 20
+
+    conn.request("POST", "/todo", body=b"{}", headers={"Content-Encoding": "br"})
+    assert conn.getresponse().status == 415
+    conn.close()
+
+
+def test_metrics_count_requests(live_server):
+    port, _, _ = live_server
+    before = server.REQUESTS.value("POST", "/todo", "201")
+    call(port, "POST", "/todo", {"task": "Measured", "completed": False})
+    call(port, "GET", "/todo/id/424242")
+
+    conn = http.client.HTTPConnection("localhost", port, timeout=10)
+    conn.request("GET", "/metrics")
+    response = conn.getresponse()
+    text = response.read().decode()
+    conn.close()
+    assert response.status == 200 and response.headers["Content-Type"].startswith("text/plain")
+    assert server.REQUESTS.value("POST", "/todo", "201") == before + 1
+    assert 'todo_http_errors_total{status="404"}' in text
+    assert 'todo_http_request_duration_seconds_count{method="GET",route="/todo/id/{id}"}' in text
+    assert "todo_store_todos 1" in text
+
+
+def test_admission_control(live_server, monkeypatch):
+    port, _, _ = live_server
+    monkeypatch.setattr(server, "MAX_BODY_BYTES", 100)
+    status, body = call(port, "POST", "/todo", {"task": "x" * 200, "completed": False})
+    assert status == 413 and "larger than 100 bytes" in body["error"]
+
+    # Every slot taken and no room to wait: turned away at once
+    monkeypatch.setattr(server, "limiter", ConcurrencyLimiter(1, 0, 0))
+    server.limiter.enter()
+    conn = http.client.HTTPConnection("localhost", port, timeout=10)
+    conn.request("GET", "/todo")
+    response = conn.getresponse()
+    assert response.status == 503 and response.headers["Retry-After"] == "1"
+    response.read()
+    conn.request("GET", "/metrics")
+    response = conn.getresponse()
+    assert response.status == 200 and 'todo_http_rejected_total{reason="overloaded"}' in response.read().decode()
+    server.limiter.leave()
+
+    # A client over its rate gets 429 until its bucket refills
+    monkeypatch.setattr(server, "rate_limiter", RateLimiter(rate=2, burst=3))
+    statuses = []
+    for _ in range(5):
+        conn.request("GET", "/todo/id/1")
+        response = conn.getresponse()
+        response.read()
+        statuses.append(response.status)
+    assert statuses[:3] == [404, 404, 404] and statuses[3:] == [429, 429]
+    assert response.headers["Retry-After"] == "1"
+    conn.close()
+
+
+def test_profiling_and_slow_requests(live_server, monkeypatch, capsys):
+    port, _, _ = live_server
+    status, _ = call(port, "GET", "/debug/profile")
+    assert status == 404
+
+    monkeypatch.setattr(server, "profiler", RequestProfiler(allow_header=True))
+    monkeypatch.setattr(server, "SLOW_REQUEST_MS", 0.001)
+    conn = http.client.HTTPConnection("localhost", port, timeout=10)
+    conn.request("POST", "/todo", body=json.dumps({"task": "Profiled", "completed": False}),
+                 headers={"Content-Type": "application/json", "X-Profile": "1"})
+    response = conn.getresponse()
+    assert response.status == 201
+    response.read()
+    conn.request("GET", "/debug/profile?sort=tottime&limit=10")
+    response = conn.getresponse()
+    report = response.read().decode()
+    assert response.status == 200 and report.startswith("1 request(s) profiled")
+    conn.request("GET", "/debug/profile?format=pstats")
+    response = conn.getresponse()
+    assert any(name == "do_POST" for (_, _, name) in marshal.loads(response.read()))
+    conn.request("DELETE", "/debug/profile")
+    response = conn.getresponse()
+    assert response.status == 200 and server.profiler.profiled == 0
+    response.read()
+    conn.close()
+
+    # Every request is over the threshold, and logged with its phases
+    log = capsys.readouterr().out
+    assert "Slow request: POST /todo 201 in" in log
+    line = next(line for line in log.splitlines() if "POST /todo 201" in line)
+    assert all(f"{name} " in line for name in ("read", "parse", "validate", "mutate", "serialize", "write"))
+    assert server.SLOW_REQUESTS.value("POST", "/todo") >= 1
+
+
+def test_change_feed(live_server):
+    port, _, _ = live_server
+    status, body = call(port, "GET", "/todo/changes")
+    assert status == 200 and body["changes"] == []
+    since = body["last_seq"]
+
+    call(port, "POST", "/todo", {"task": "Buy milk", "completed": False})
+    call(port, "PUT", "/todo/id/1", {"completed": True})
+    call(port, "POST", "/todo/batch", {"create": [{"task": "Walk dog", "completed": False}], "delete": [1]})
+    status, body = call(port, "GET", f"/todo/changes?since={since}")
+    assert status == 200 and body["last_seq"] == since + 4
+    assert [(change["op"], change["id"]) for change in body["changes"]] == [
+        ("add", 1), ("update", 1), ("add", 2), ("delete", 1)]
+    assert body["changes"][1] == {"seq": since + 2, "op": "update", "id": 1, "fields": {"completed": True}}
+    since = body["last_seq"]
+
+    # A long poll is answered as soon as something changes
+    threading.Timer(0.2, call, (port, "DELETE", "/todo/id/2")).start()
+    start = time.monotonic()
+    status, body = call(port, "GET", f"/todo/changes?since={since}&wait=5")
+    assert status == 200 and [change["op"] for change in body["changes"]] == ["delete"]
+    assert time.monotonic() - start < 4
+    status, body = call(port, "GET", f"/todo/changes?since={since + 1}&wait=0.1")
+    assert status == 200 and body == {"changes": [], "last_seq": since + 1}
+
+    # Changes that are no longer kept mean reloading the list
+    status, body = call(port, "GET", "/todo/changes?since=1")
+    assert status == 410 and body["last_seq"] == since + 1
+    assert call(port, "GET", "/todo/changes?wait=999")[0] == 400
+    assert call(port, "GET", "/todo/changes?since=-1")[0] == 400
+
+
+def read_event(response):
+    """Returns: the fields of the next server-sent event, skipping comments"""
+    fields = {}
+    while True:
+        line = response.readline().decode().rstrip("\n")
+        if line and not line.startswith(":"):
+            name, _, value = line.partition(": ")
+            fields[name] = value
+        elif not line and fields:
+            return fields
+
+
+def test_change_feed_streams_events(live_server, monkeypatch):
+    port, _, _ = live_server
+    monkeypatch.setattr(server, "CHANGES_HEARTBEAT", 0.1)
+    conn = http.client.HTTPConnection("localhost", port, timeout=10)
+    conn.request("GET", "/todo/changes", headers={"Accept": "text/event-stream"})
+    response = conn.getresponse()
+    assert response.status == 200 and response.headers["Content-Type"] == "text/event-stream"
+    since = int(read_event(response)["id"])
+
+    call(port, "POST", "/todo", {"task": "Streamed", "completed": False})
+    event = read_event(response)
+    assert event["id"] == str(since + 1) and event["event"] == "change"
+    assert json.loads(event["data"])["item"]["task"] == "Streamed"
+    conn.close()
+
+    # A reconnecting client picks up after the last event it saw
+    for last_event_id, expected in ((since, "change"), (1, "resync")):
+        conn = http.client.HTTPConnection("localhost", port, timeout=10)
+        conn.request("GET", "/todo/changes?format=sse", headers={"Last-Event-ID": str(last_event_id)})
+        response = conn.getresponse()
+        assert read_event(response) == {"id": str(last_event_id)}
+        event = read_event(response)
+        assert event["event"] == expected and event["id"] == str(since + 1)
+        conn.close()
+
+
+def test_feed_clients_leave_workers_for_other_requests(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "SERVER_WORKERS", 4)
+    # Streams notice their client is gone at the next heartbeat
+    monkeypatch.setattr(server, "CHANGES_HEARTBEAT", 0.1)
+    monkeypatch.setattr(server, "TODO_FILENAME", str(tmp_path / "todos.json"))
+    monkeypatch.setattr(server, "store", CompactTodoStore(on_change=server.record_change))
+    httpd = server.make_server(("localhost", 0), engine="asyncio")
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    port = httpd.server_address[1]
+    streams = []
+    try:
+        # Half of the 4 workers may wait for changes
+        for _ in range(2):
+            conn = http.client.HTTPConnection("localhost", port, timeout=10)
+            conn.request("GET", "/todo/changes?format=sse")
+            response = conn.getresponse()
+            assert response.status == 200 and "id" in read_event(response)
+            streams.append(conn)
+        status, body = call(port, "GET", "/todo/changes?since=1&wait=5")
+        assert status == 503 and "waiting for changes" in body["error"]
+
+        start = time.monotonic()
+        assert call(port, "GET", "/todo") == (200, [])
+        assert time.monotonic() - start < 1
+    finally:
+        for conn in streams:
+            conn.close()
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_pool_sheds_connections_past_its_queue(monkeypatch):
+    monkeypatch.setattr(server.ToDoHandler, "timeout", 5)
+    httpd = server.PooledHTTPServer(("localhost", 0), server.ToDoHandler, workers=1, max_queue=1)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    address = httpd.server_address[:2]
+    try:
+        # The only worker sits on an idle kept-alive connection, one more connection waits
+        busy = socket.create_connection(address, timeout=10)
+        busy.sendall(b"GET /nowhere HTTP/1.1\r\nHost: x\r\n\r\n")
+        assert read_response(busy.makefile("rb"))[0] == 404
+        waiting = socket.create_connection(address, timeout=10)
+        time.sleep(0.2)
+
+        start = time.monotonic()
+        with socket.create_connection(address, timeout=10) as sock:
+            sock.sendall(b"GET /todo HTTP/1.1\r\nHost: x\r\n\r\n")
+            status, headers, _ = read_response(sock.makefile("rb"))
+        assert status == 503 and headers["retry-after"] == "1"
+        assert time.monotonic() - start < 1
+        busy.close()
+        waiting.close()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_asyncio_shutdown_waits_for_the_loop_to_start_and_stop():
+    httpd = server.make_server(("localhost", 0), engine="asyncio")
+    stopping = threading.Thread(target=httpd.shutdown, daemon=True)
+    stopping.start()
+    time.sleep(0.1)
+    assert stopping.is_alive()
+
+    serving = threading.Thread(target=httpd.serve_forever, daemon=True)
+    serving.start()
+    stopping.join(5)
+    serving.join(5)
+    assert not stopping.is_alive() and not serving.is_alive()
+    httpd.server_close()
+
+
+def test_switching_back_to_one_shard_merges_the_shard_files(tmp_path, monkeypatch):
+    path = str(tmp_path / "todos.json")
+    with open(path, "w") as f:
+        json.dump([{"id": 1, "task": "original"}], f)
+    monkeypatch.setattr(server, "TODO_FILENAME", path)
+    monkeypatch.setattr(server, "SHARDS", 3)
+    monkeypatch.setattr(server, "store", server.make_sharded_store())
+    for i in range(4):
+        server.store.add({"task": f"new {i}"})
+    todos = server.store.all()
+
+    # The log would be replayed over the merged todos
+    monkeypatch.setattr(server, "wal", object())
+    with pytest.raises(ValueError):
+        server.merge_shard_files()
+    monkeypatch.setattr(server, "wal", None)
+
+    monkeypatch.setattr(server, "SHARDS", 1)
+    server.merge_shard_files()
+    assert list(server.load_todos().values()) == todos and existing_shard_paths(path) == {}
@@ -0,0 +1,30 @@
+import pytest
+
+from load_test import parse_mix, percentile, run
+
+
+def test_parse_mix_and_percentile():
+    assert parse_mix("get=3,create=1") == {"get": 3.0, "create": 1.0}
+    with pytest.raises(ValueError):
+        parse_mix("fly=1")
+    assert percentile(list(range(1, 101)), 0.99) == 99
+    assert percentile([5], 0.5) == 5 and percentile([], 0.5) is None
+
+
+def test_short_run_reports_latencies():
+    result = run(50, parse_mix("get=2,create=1"), concurrency=2, duration=0.5, warmup=0.1,
+                 env={"TODO_PERSISTENCE": "group", "TODO_DURABILITY": "async"})
+    assert result["requests"] > 0 and result["errors"] == 0
+    assert set(result["statuses"]) <= {"200", "201"}
+    assert result["latency_ms"]["p50"] <= result["latency_ms"]["p99"] <= result["latency_ms"]["max"]
+    assert set(result["operations"]) == {"get", "create"}
+
+
+def test_overload_is_turned_away_quickly():
+    # Far more clients than the server admits: the excess gets 503 straight
+    # away, and the requests that are served aren't stuck behind a queue
+    result = run(2000, parse_mix("full=1,get=3"), concurrency=8, duration=1, warmup=0.2,
+                 env={"TODO_MAX_CONCURRENT": "1", "TODO_MAX_QUEUE": "1", "TODO_QUEUE_TIMEOUT_MS": "20"})
+    assert result["rejected"] > 0 and result["errors"] == 0
+    assert set(result["statuses"]) <= {"200", "503"}
+    assert result["served_latency_ms"]["p99"] < 1000
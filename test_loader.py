@@ -0,0 +1,109 @@
+import io
+import json
+import os
+import random
+import resource
+
+import pytest
+
+import server
+from loader import TodoFileReader, read_todos
+from store import index_todos
+
+# The multi-GB test writes and reads a file this many GB big; it is opt-in
+LARGE_FILE_GB = float(os.environ.get("TODO_LARGE_FILE_GB", "0"))
+
+
+def make_todos(count):
+    return [{"id": todo_id, "task": f"Task {todo_id}, {{with braces}}", "completed": todo_id % 3 == 0,
+             "tags": [{"name": "home"}] if todo_id % 5 == 0 else []} for todo_id in range(1, count + 1)]
+
+
+def read(text, **options):
+    reader = TodoFileReader(io.BytesIO(text.encode()), **options)
+    return list(reader), reader.errors
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 100, 1024 * 1024])
+def test_reads_the_same_todos_as_json_load(chunk_size):
+    todos = make_todos(200)
+    for text in (json.dumps(todos, indent=2), json.dumps(todos), "[]", " [ ] \n"):
+        assert read(text, chunk_size=chunk_size) == (json.loads(text), [])
+
+
+@pytest.mark.parametrize("chunk_size", [7, 1024 * 1024])
+def test_damaged_records_are_skipped(chunk_size):
+    todos = make_todos(300)
+    text = json.dumps(todos, indent=2)
+    rng = random.Random(7)
+    damaged = sorted(rng.sample(range(1, 299), 12))
+    for todo_id in reversed(damaged):
+        # Break the record's "task" key, deep inside it
+        start = text.index(f'"id": {todo_id},')
+        text = text[:start] + text[start:].replace('"task":', '"task" ', 1)
+
+    items, errors = read(text, chunk_size=chunk_size)
+    assert [item["id"] for item in items] == [item["id"] for item in todos if item["id"] not in damaged]
+    assert len(errors) == len(damaged)
+    assert all(text[error.offset:].startswith("{") or "delimiter" in error.message for error in errors)
+
+
+def test_structural_damage_is_reported():
+    assert read('[{"id": 1}, 5, "x", {"id": 2}]')[0] == [{"id": 1}, {"id": 2}]
+    assert read('[{"id": 1} {"id": 2}]') == ([{"id": 1}, {"id": 2}], [(11, "expected ',' between todos")])
+    assert read('{"id": 1}') == ([], [(0, "the file is not a JSON list")])
+    assert read("") == ([], [])
+
+    # A file cut short keeps every todo before the cut
+    text = json.dumps(make_todos(50), indent=2)
+    items, errors = read(text[:len(text) // 2], chunk_size=64)
+    assert len(items) > 20 and items == make_todos(len(items))
+    assert errors == [(errors[0].offset, "the file ends in the middle of a todo")]
+
+
+def test_progress_and_load_errors_from_a_file(tmp_path):
+    path = tmp_path / "todos.json"
+    path.write_text(json.dumps(make_todos(1000)).replace('"id": 500,', '"id": 500,,'))
+    calls = []
+    errors = []
+    todo = index_todos(read_todos(str(path), errors, progress=lambda *args: calls.append(args)))
+    assert len(todo) == 999 and 500 not in todo and len(errors) == 1
+    assert calls[-1] == (path.stat().st_size, path.stat().st_size, 999)
+
+
+def test_server_keeps_a_damaged_file(tmp_path, monkeypatch, capsys):
+    path = tmp_path / "todos.json"
+    path.write_text('[{"id": 1, "task": "Buy milk"}, {"id": 2, "task": oops}, {"id": 3, "task": "Walk dog"}]')
+    monkeypatch.setattr(server, "TODO_FILENAME", str(path))
+    monkeypatch.setattr(server, "SNAPSHOT_FILENAME", "")
+    monkeypatch.setattr(server, "wal", None)
+
+    assert list(server.load_todos()) == [1, 3]
+    backups = [name for name in os.listdir(tmp_path) if name.startswith("todos.json.damaged-")]
+    assert len(backups) == 1 and (tmp_path / backups[0]).read_text() == path.read_text()
+    assert "Skipped 1 damaged part(s)" in capsys.readouterr().out
+
+
+@pytest.mark.skipif(not LARGE_FILE_GB, reason="set TODO_LARGE_FILE_GB to run (e.g. 2)")
+def test_multi_gigabyte_file_loads_in_bounded_memory(tmp_path):
+    # One block of todos written over and over, with one record damaged every 64 blocks
+    block = json.dumps(make_todos(5000), indent=2)[1:-1]
+    damaged_block = block.replace('"id": 2500,', '"id": 2500 ', 1)
+    blocks = int(LARGE_FILE_GB * 2 ** 30 // len(block))
+    path = tmp_path / "big.json"
+    with open(path, "w") as f:
+        f.write("[")
+        for number in range(blocks):
+            f.write("," if number else "")
+            f.write(damaged_block if number % 64 == 63 else block)
+        f.write("]")
+
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    errors = []
+    count = sum(1 for _ in read_todos(str(path), errors))
+    grown_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+
+    assert count == blocks * 5000 - blocks // 64
+    assert len(errors) == blocks // 64
+    # Reading keeps a chunk and a batch of todos, not the file
+    assert grown_kb < 256 * 1024
@@ -0,0 +1,37 @@
+from metrics import Registry
+
+
+def test_render_prometheus_text():
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests", ["method", "path"])
+    latency = registry.histogram("latency_seconds", "Latency", ["method"], buckets=(0.1, 1.0))
+    registry.gauge("size", "Size", lambda: 3)
+    registry.gauge("broken", "Fails", lambda: 1 / 0)
+
+    requests.inc("GET", 'a"b')
+    requests.inc("GET", 'a"b', amount=2)
+    latency.observe(0.05, "GET")
+    latency.observe(0.5, "GET")
+    latency.observe(5, "GET")
+
+    lines = registry.render().decode().splitlines()
+    assert "# TYPE requests_total counter" in lines
+    assert 'requests_total{method="GET",path="a\\"b"} 3' in lines
+    assert 'latency_seconds_bucket{method="GET",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{method="GET",le="1.0"} 2' in lines
+    assert 'latency_seconds_bucket{method="GET",le="+Inf"} 3' in lines
+    assert 'latency_seconds_sum{method="GET"} 5.55' in lines
+    assert 'latency_seconds_count{method="GET"} 3' in lines
+    assert "size 3" in lines
+    assert not any(line.startswith("broken ") for line in lines)
+    assert latency.count("GET") == 3 and requests.value("GET", 'a"b') == 3
+
+
+def test_names_are_registered_once():
+    registry = Registry()
+    registry.counter("a_total", "A")
+    try:
+        registry.counter("a_total", "A again")
+    except ValueError:
+        return
+    assert False, "Expected ValueError"
@@ -0,0 +1,83 @@
+import marshal
+import threading
+import time
+
+import pytest
+
+from profiling import RequestProfiler, format_breakdown, phase, start_timer, stop_timer
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_phases_count_only_their_own_time():
+    now = [100.0]
+    timer = start_timer(clock=lambda: now[0])
+    now[0] += 0.5
+    with phase("mutate"):
+        now[0] += 0.02
+        with phase("persist"):
+            now[0] += 0.03
+        now[0] += 0.01
+    with phase("write"):
+        pass
+    assert stop_timer() is timer
+
+    now[0] += 0.25
+    phases = dict(timer.breakdown())
+    assert list(phases) == ["mutate", "persist", "write", "other"]
+    assert phases == pytest.approx({"mutate": 0.03, "persist": 0.03, "write": 0, "other": 0.75})
+    assert format_breakdown([("read", 0.0012), ("other", 0)]) == "read 1.2 ms, other 0.0 ms"
+
+
+def test_phase_does_nothing_without_a_timer():
+    assert stop_timer() is None
+    with phase("read"):
+        pass
+
+    # A timer belongs to the thread that started it
+    timer = start_timer()
+    other = threading.Thread(target=lambda: phase("read").__enter__())
+    other.start()
+    other.join()
+    stop_timer()
+    assert timer.seconds == {}
+
+
+def test_profiler_samples_and_adds_up(tmp_path):
+    path = str(tmp_path / "todo.prof")
+    profiler = RequestProfiler(rate=0, allow_header=True, path=path, dump_interval=0)
+    assert profiler.start() is None
+
+    for _ in range(2):
+        profile = profiler.start(requested=True)
+        # Only one request is profiled at a time
+        assert profiler.start(requested=True) is None
+        busy(0.01)
+        profiler.finish(profile)
+
+    assert profiler.profiled == 2
+    report = profiler.report("tottime", limit=5)
+    assert report.startswith("2 request(s) profiled") and "busy" in report
+    with open(path, "rb") as f:
+        stats = marshal.load(f)
+    assert any(name == "busy" for (_, _, name) in stats)
+    with pytest.raises(ValueError):
+        profiler.report("name")
+
+    profiler.reset()
+    assert profiler.report() == "No requests profiled yet\n" and marshal.loads(profiler.dump_bytes()) == {}
+
+
+def test_profiler_rate():
+    always = RequestProfiler(rate=1)
+    profile = always.start()
+    assert profile is not None and always.enabled
+    always.finish(profile)
+    # The header only counts where it is allowed
+    assert RequestProfiler(rate=0).start(requested=True) is None and not RequestProfiler().enabled
+    with pytest.raises(ValueError):
+        RequestProfiler(rate=2)
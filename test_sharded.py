@@ -0,0 +1,148 @@
+import json
+import threading
+
+import pytest
+
+from compact import CompactTodoStore
+from sharded import ShardedTodoStore, existing_shard_paths, load_shards, remove_extra_shards, shard_path
+from store import TodoStore
+
+
+def make_store(count, todos=(), on_change=None):
+    parts = [{} for _ in range(count)]
+    for item in todos:
+        parts[item["id"] % count][item["id"]] = item
+    return ShardedTodoStore(CompactTodoStore(part, on_change=on_change) for part in parts)
+
+
+def sample_todos(count):
+    return [{"id": todo_id, "task": f"task {todo_id}", "completed": todo_id % 3 == 0}
+            for todo_id in range(1, count + 1) if todo_id % 7]
+
+
+def test_reads_match_an_unsharded_store():
+    todos = sample_todos(60)
+    sharded = make_store(4, todos)
+    single = TodoStore({item["id"]: item for item in todos})
+
+    assert sharded.all() == single.all() and len(sharded) == len(single)
+    assert sharded.get(8) == single.get(8) and sharded.get(7) is None
+    # Out of range positional routes look up None
+    assert sharded.get(None) is None and sharded.update(None, {"task": "x"}) is None and not sharded.delete(None)
+    indexes = (0, 10, 50, 51, 10 ** 20)
+    assert [sharded.id_at(index) for index in indexes] == [single.id_at(index) for index in indexes]
+
+    # Paging through the merged shards gives the same pages and cursors
+    for kwargs in ({}, {"completed": True}, {"completed": False}, {"query": "task 1"}):
+        after = None
+        while True:
+            page = sharded.page(5, after=after, **kwargs)
+            assert page == single.page(5, after=after, **kwargs)
+            after = page[1]
+            if after is None:
+                break
+        assert sharded.page(None, **kwargs) == single.page(None, **kwargs)
+
+
+def test_writes_go_to_the_shard_of_the_id():
+    changes = []
+    store = make_store(3, sample_todos(6), on_change=changes.append)
+    item = store.add({"task": "new"})
+    assert item["id"] == 7 and 7 in store.shards[1].todo
+    assert store.update(7, {"completed": True})["completed"] is True
+    assert store.delete(3) and store.get(3) is None and store.update(3, {"completed": True}) is None
+    assert [record["op"] for records in changes for record in records] == ["add", "update", "delete"]
+
+    created, missing = store.apply_batch(creates=[{"task": "a"}, {"task": "b"}], updates=[(1, {"task": "one"})],
+                                         deletes=[2])
+    assert [item["id"] for item in created] == [8, 9] and missing == []
+    # One on_change call per shard that changed
+    assert sorted(len(records) for records in changes[3:]) == [1, 1, 2]
+    assert [item["id"] for item in store.all()] == [1, 4, 5, 6, 7, 8, 9]
+
+
+def test_batch_with_a_missing_todo_changes_nothing():
+    store = make_store(3, sample_todos(6))
+    before = store.all()
+    created, missing = store.apply_batch(creates=[{"task": "a"}], updates=[(1, {"task": "x"}), (50, {})],
+                                         deletes=[4, 4])
+    assert created == [] and missing == [("update", 1), ("delete", 1)]
+    assert store.all() == before and store.next_id == 7
+
+
+def test_concurrent_adds_keep_every_shard_in_id_order():
+    store = make_store(4)
+
+    def worker(worker_id):
+        for i in range(200):
+            store.add({"task": f"w{worker_id}-{i}"})
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    ids = [item["id"] for item in store.all()]
+    assert len(ids) == len(set(ids)) == 1600
+    for index, shard in enumerate(store.shards):
+        assert list(shard.todo) == sorted(shard.todo)
+        assert all(todo_id % 4 == index for todo_id in shard.todo)
+    # Ids only skip where a shard was busy
+    assert store.next_id == ids[-1] + 1
+
+
+def test_single_file_is_split_then_loaded_from_the_shards(tmp_path):
+    path = str(tmp_path / "todos.json")
+    with open(path, "w") as f:
+        json.dump([{"task": "no id"}, {"id": 5, "task": "five"}, {"id": 5, "task": "dup"}], f)
+
+    parts, errors, rewrite = load_shards(path, 2)
+    assert rewrite and errors == {}
+    assert parts == [{6: {"id": 6, "task": "no id"}}, {5: {"id": 5, "task": "five"}, 7: {"id": 7, "task": "dup"}}]
+
+    for index, part in enumerate(parts):
+        with open(shard_path(path, index), "w") as f:
+            json.dump(list(part.values()), f)
+    # The shards are read in loader processes, and are already in place
+    assert load_shards(path, 2, workers=2) == (parts, {}, False)
+
+
+def test_shards_are_redistributed_when_the_count_changes(tmp_path):
+    path = str(tmp_path / "todos.json")
+    todos = sample_todos(20)
+    for index in range(4):
+        with open(shard_path(path, index), "w") as f:
+            json.dump([item for item in todos if item["id"] % 4 == index], f)
+
+    parts, _, rewrite = load_shards(path, 3, workers=2)
+    assert rewrite and parts == [{item["id"]: item for item in todos if item["id"] % 3 == index}
+                                 for index in range(3)]
+
+    remove_extra_shards(path, 3)
+    assert sorted(existing_shard_paths(path)) == [0, 1, 2]
+
+
+def test_damaged_shard_reports_its_file(tmp_path):
+    path = str(tmp_path / "todos.json")
+    with open(shard_path(path, 0), "w") as f:
+        f.write('[{"id": 2, "task": "two"}, {"id": 4, "task": ')
+    with open(shard_path(path, 1), "w") as f:
+        json.dump([{"id": 1, "task": "one"}], f)
+
+    parts, errors, rewrite = load_shards(path, 2)
+    assert parts == [{2: {"id": 2, "task": "two"}}, {1: {"id": 1, "task": "one"}}] and not rewrite
+    assert list(errors) == [shard_path(path, 0)]
+
+
+@pytest.mark.parametrize("count", [1, 2])
+def test_missing_files_load_empty(tmp_path, count):
+    assert load_shards(str(tmp_path / "todos.json"), count) == ([{}] * count, {}, False)
+
+
+def test_fragments_merge_like_the_list():
+    store = make_store(3, sample_todos(20))
+    encode = lambda item: json.dumps(item).encode()
+    assert store.fragments(encode) == [encode(item) for item in store.all()]
+    store.update(4, {"task": "changed"})
+    assert store.fragments(encode) == [encode(item) for item in store.all()]
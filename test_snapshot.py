@@ -0,0 +1,143 @@
+import json
+
+import pytest
+
+from persistence import WriteAheadLog
+from snapshot import HEADER_SIZE, LazyTodos, Snapshot, SnapshotError, load_snapshot, main, write_snapshot
+from store import TodoStore
+
+TODOS = [
+    {"id": 1, "task": "Buy milk", "completed": False},
+    {"id": 2, "task": "Walk dog", "completed": True, "tags": ["outside"]},
+    {"id": 5, "completed": False, "task": "Pay rent", "description": "Before the 1st"},
+]
+
+
+def test_snapshot_round_trips_todos(tmp_path):
+    path = str(tmp_path / "todos.snap")
+    write_snapshot(path, TODOS)
+    snapshot = Snapshot(path)
+    assert len(snapshot) == 3 and list(snapshot) == TODOS
+    assert list(snapshot.get(5)) == ["id", "completed", "task", "description"]
+    assert snapshot.get(3) is None and 2 in snapshot and 4 not in snapshot
+    snapshot.verify()
+    snapshot.close()
+
+
+def test_todos_are_decoded_on_first_access(tmp_path):
+    path = str(tmp_path / "todos.snap")
+    write_snapshot(path, TODOS)
+    todo = load_snapshot(path)
+    assert len(todo) == 3 and list(todo) == [1, 2, 5] and todo.loaded == {}
+
+    assert todo[2] is todo[2] and list(todo.loaded) == [2]
+    todo[6] = {"id": 6, "task": "New"}
+    del todo[1]
+    del todo[6]
+    todo[7] = {"id": 7, "task": "Newer"}
+    assert list(todo) == [2, 5, 7] and len(todo) == 3 and 1 not in todo
+    assert list(reversed(todo)) == [7, 5, 2]
+    assert todo.values() == [TODOS[1], TODOS[2], {"id": 7, "task": "Newer"}]
+    with pytest.raises(KeyError):
+        todo[1]
+    # Whatever can't be an id is missing, as it would be from a dict
+    assert None not in todo and "2" not in todo and -1 not in todo
+    with pytest.raises(KeyError):
+        todo[None]
+
+
+def test_store_runs_on_lazy_todos(tmp_path):
+    path = str(tmp_path / "todos.snap")
+    write_snapshot(path, TODOS)
+    store = TodoStore(load_snapshot(path))
+    assert store.next_id == 6 and store.todo.loaded == {}
+
+    assert store.get(5)["task"] == "Pay rent" and list(store.todo.loaded) == [5]
+    assert store.get(None) is None and store.update(None, {"task": "x"}) is None and not store.delete(None)
+    assert store.add({"task": "Call mom"})["id"] == 6
+    store.update(1, {"completed": True})
+    store.delete(2)
+    assert store.page(None, completed=True) == ([{"id": 1, "task": "Buy milk", "completed": True}], None)
+    assert [item["id"] for item in store.all()] == [1, 5, 6]
+
+
+def test_corruption_is_detected(tmp_path):
+    path = tmp_path / "todos.snap"
+    write_snapshot(str(path), TODOS)
+    data = path.read_bytes()
+
+    def corrupt(position, value=None):
+        damaged = bytearray(data)
+        damaged[position] = value if value is not None else damaged[position] ^ 0xFF
+        path.write_bytes(bytes(damaged))
+
+    # A damaged record is only found when it is decoded, or by verify()
+    corrupt(HEADER_SIZE + 3)
+    snapshot = Snapshot(str(path))
+    assert snapshot.get(2) == TODOS[1]
+    with pytest.raises(SnapshotError, match="todo 1"):
+        snapshot.get(1)
+    with pytest.raises(SnapshotError):
+        snapshot.verify()
+    snapshot.close()
+
+    for position, message in ((0, "not a todo snapshot"), (8, "version"), (12, "corrupt header"),
+                              (len(data) - 1, "corrupt index")):
+        corrupt(position, 2 if position == 8 else None)
+        with pytest.raises(SnapshotError, match=message):
+            Snapshot(str(path))
+
+    path.write_bytes(data[:-4])
+    with pytest.raises(SnapshotError, match="truncated"):
+        Snapshot(str(path))
+
+
+def test_converter_round_trips_the_json_file(tmp_path, capsys):
+    source = tmp_path / "todos.json"
+    # Old files without ids get them assigned, as on a normal load
+    source.write_text(json.dumps([{"task": "Buy milk"}, {"id": 1, "task": "Walk dog"}]))
+    assert main(["to-snapshot", str(source), str(tmp_path / "todos.snap")]) == 0
+    assert main(["verify", str(tmp_path / "todos.snap")]) == 0
+    assert main(["to-json", str(tmp_path / "todos.snap"), str(tmp_path / "out.json")]) == 0
+    assert json.loads((tmp_path / "out.json").read_text()) == [
+        {"id": 1, "task": "Walk dog"}, {"id": 2, "task": "Buy milk"}]
+    assert main(["verify", str(source)]) == 1
+    assert "not a todo snapshot" in capsys.readouterr().err
+
+
+def test_compaction_rewrites_the_snapshot(tmp_path):
+    path = str(tmp_path / "todos.snap")
+    todo = {}
+    log = WriteAheadLog(str(tmp_path / "todos.json.wal"), snapshot_provider=todo.values,
+                        snapshot_writer=lambda items: write_snapshot(path, items), compact_every=5,
+                        fsync_policy="never")
+    for todo_id in range(1, 13):
+        todo[todo_id] = {"id": todo_id, "task": f"Task {todo_id}"}
+        log.append([{"op": "add", "item": todo[todo_id]}])
+    log.close()
+
+    # The log only holds what came after the snapshot; together they give every todo
+    with open(tmp_path / "todos.json.wal", "rb") as f:
+        assert all(json.loads(line)["op"] == "add" for line in f)
+    recovered = WriteAheadLog(str(tmp_path / "todos.json.wal"), snapshot_provider=None).replay(
+        load_snapshot(path))
+    assert isinstance(recovered, LazyTodos) and dict(recovered) == todo
+
+
+def test_old_log_replays_over_a_newer_snapshot(tmp_path):
+    # A crash after compaction wrote the snapshot, before it replaced the log:
+    # the snapshot already lacks todo 1, which the old log updates and deletes
+    path = str(tmp_path / "todos.snap")
+    write_snapshot(path, [{"id": 2, "task": "Two"}])
+    log_path = tmp_path / "todos.json.wal"
+    with open(log_path, "wb") as f:
+        f.write(b'{"op":"update","id":1,"fields":{"completed":true}}\n')
+        f.write(b'{"op":"delete","id":1}\n')
+        f.write(b'{"op":"add","item":{"id":3,"task":"Three"}}\n')
+    size = log_path.stat().st_size
+
+    log = WriteAheadLog(str(log_path), snapshot_provider=None,
+                        snapshot_writer=lambda items: write_snapshot(path, items))
+    recovered = log.replay(load_snapshot(path))
+    assert dict(recovered) == {2: {"id": 2, "task": "Two"}, 3: {"id": 3, "task": "Three"}}
+    assert log_path.stat().st_size == size
@@ -0,0 +1,113 @@
+import json
+
+from sqlite_store import SqliteTodoStore, migrate_json
+
+
+def test_crud_and_reopen(tmp_path):
+    path = str(tmp_path / "todos.db")
+    store = SqliteTodoStore(path)
+    first = store.add({"task": "Buy milk", "completed": False, "tags": ["shop"]})
+    second = store.add({"task": "Study Python", "id": 42})
+    assert (first["id"], second["id"]) == (1, 2)
+
+    assert store.update(1, {"completed": True, "id": 9}) == {
+        "id": 1, "task": "Buy milk", "completed": True, "tags": ["shop"]}
+    assert store.update(99, {"completed": True}) is None
+    assert store.delete(2) and not store.delete(2)
+    version = store.version
+    store.close()
+
+    store = SqliteTodoStore(path)
+    assert store.all() == [{"id": 1, "task": "Buy milk", "completed": True, "tags": ["shop"]}]
+    # Deleted ids are never handed out again
+    assert store.add({"task": "Exercise"})["id"] == 3
+    assert version > 0
+    store.close()
+
+
+def test_page_and_filter(tmp_path):
+    store = SqliteTodoStore(str(tmp_path / "todos.db"))
+    for i in range(10):
+        store.add({"task": f"Task {i}", "completed": i % 3 == 0})
+
+    items, after = store.page(2, completed=True)
+    assert [item["id"] for item in items] == [1, 4]
+    items, after = store.page(2, after=after, completed=True)
+    assert [item["id"] for item in items] == [7, 10] and after is None
+    assert store.id_at(3) == 4 and store.id_at(10) is None
+    store.close()
+
+
+def test_text_search(tmp_path):
+    path = str(tmp_path / "todos.db")
+    store = SqliteTodoStore(path)
+    store.add({"task": "Buy milk", "description": "Semi-skimmed"})
+    store.add({"task": "Buy bread", "completed": True})
+    store.add({"task": "Walk the dog"})
+
+    assert [item["id"] for item in store.page(None, query="BUY")[0]] == [1, 2]
+    assert [item["id"] for item in store.page(None, query="buy skimmed")[0]] == [1]
+    assert [item["id"] for item in store.page(1, query="buy", completed=True)[0]] == [2]
+    assert store.page(None, query='"')[0] == []
+
+    store.update(1, {"task": "Sell milk"})
+    store.delete(2)
+    assert store.page(None, query="buy")[0] == []
+    store.close()
+
+    # A database created before the text index gets it filled in on open
+    store = SqliteTodoStore(path)
+    store._writer.execute("DROP TABLE todos_text")
+    for trigger in ("insert", "update", "delete"):
+        store._writer.execute(f"DROP TRIGGER todos_text_{trigger}")
+    store.close()
+    store = SqliteTodoStore(path)
+    assert [item["id"] for item in store.page(None, query="milk")[0]] == [1]
+    store.close()
+
+
+def test_batch_is_all_or_nothing(tmp_path):
+    store = SqliteTodoStore(str(tmp_path / "todos.db"))
+    store.add({"task": "a"})
+    store.add({"task": "b"})
+
+    created, missing = store.apply_batch([{"task": "c"}], [(1, {"completed": True})], [2, 5])
+    assert missing == [("delete", 1)] and len(store) == 2
+
+    created, missing = store.apply_batch([{"task": "c"}], [(1, {"completed": True})], [2])
+    assert missing == [] and created[0]["id"] == 3
+    assert [item["task"] for item in store.all()] == ["a", "c"]
+    store.close()
+
+
+def test_ids_beyond_sqlite_integers_are_not_found(tmp_path):
+    store = SqliteTodoStore(str(tmp_path / "todos.db"))
+    store.add({"task": "a"})
+    huge = 10 ** 20
+    assert store.get(huge) is None and store.update(huge, {"task": "b"}) is None and not store.delete(huge)
+    assert store.apply_batch(updates=[(huge, {"task": "b"})], deletes=[huge]) == ([], [("update", 0), ("delete", 0)])
+    assert store.id_at(huge) is None
+    store.close()
+
+
+def test_migrate_json_keeps_ids(tmp_path):
+    source = tmp_path / "todos.json"
+    source.write_text(json.dumps([{"id": 5, "task": "a"}, {"task": "b", "completed": True}]))
+    with open(str(source) + ".wal", "w") as f:
+        f.write('{"op":"add","item":{"id":7,"task":"c"}}\n')
+
+    target = str(tmp_path / "todos.db")
+    assert migrate_json(str(source), target) == 3
+
+    store = SqliteTodoStore(target)
+    assert store.all() == [{"id": 5, "task": "a"}, {"id": 6, "task": "b", "completed": True},
+                           {"id": 7, "task": "c"}]
+    assert store.add({"task": "d"})["id"] == 8
+    store.close()
+
+    # Refuses to merge into a database that already has todos
+    try:
+        migrate_json(str(source), target)
+    except ValueError:
+        return
+    assert False, "Expected ValueError"
@@ -0,0 +1,132 @@
+import json
+
+from compact import CompactTodoStore
+from store import TodoStore, index_todos
+
+
+def make_store(count):
+    store = TodoStore()
+    for i in range(count):
+        store.add({"task": f"Task {i}", "completed": i % 3 == 0})
+    return store
+
+
+def test_index_todos_assigns_ids_in_list_order():
+    todo = index_todos([{"task": "a"}, {"id": 7, "task": "b"}, {"task": "c"}, {"id": 7, "task": "d"}])
+    # Kept in id order, with the duplicate 7 moved to a fresh id
+    assert list(todo) == [7, 8, 9, 10]
+    assert [item["task"] for item in todo.values()] == ["b", "a", "c", "d"]
+    assert index_todos([{"task": "a"}, {"task": "b"}]) == {1: {"id": 1, "task": "a"}, 2: {"id": 2, "task": "b"}}
+
+
+def test_ids_stay_stable_after_delete():
+    store = make_store(3)
+    assert store.delete(1)
+    assert store.get(2)["task"] == "Task 1"
+    assert store.id_at(0) == 2 and store.id_at(10 ** 20) is None
+    assert store.add({"task": "new", "id": 99})["id"] == 4
+
+
+def test_page_walks_every_todo_once():
+    store = make_store(25)
+    for todo_id in (3, 4, 10):
+        store.delete(todo_id)
+
+    seen = []
+    after = None
+    while True:
+        items, after = store.page(7, after=after)
+        seen.extend(item["id"] for item in items)
+        if after is None:
+            break
+    assert seen == [item["id"] for item in store.all()]
+
+
+def test_page_after_a_cursor_far_back_starts_at_the_first_todo():
+    store = make_store(5)
+    store.delete(1)
+    # Walking every id from the cursor on would take hours with the read lock held
+    assert store.page(2, after=-10 ** 12) == store.page(2) == ([store.get(2), store.get(3)], 3)
+
+
+def test_page_filters_on_completed():
+    store = make_store(10)
+    items, after = store.page(2, completed=True)
+    assert [item["id"] for item in items] == [1, 4]
+    items, after = store.page(2, after=after, completed=True)
+    assert [item["id"] for item in items] == [7, 10]
+    assert after is None
+
+
+def test_batch_is_all_or_nothing():
+    changes = []
+    store = make_store(3)
+    store.on_change = changes.append
+
+    created, missing = store.apply_batch([{"task": "new"}], [(1, {"completed": True})], [2, 2])
+    assert created == [] and missing == [("delete", 1)]
+    assert len(store) == 3 and changes == []
+
+    created, missing = store.apply_batch([{"task": "new"}], [(1, {"completed": True})], [2])
+    assert missing == [] and created[0]["id"] == 4
+    assert [item["id"] for item in store.all()] == [1, 3, 4]
+    assert store.get(1)["completed"] is True
+
+    # The whole batch is handed to persistence in one call
+    assert len(changes) == 1 and len(changes[0]) == 3
+
+
+def test_indexes_follow_every_change():
+    store = TodoStore({1: {"id": 1, "task": "Buy milk", "description": "Semi-skimmed"}})
+    store.add({"task": "Buy bread", "completed": True})
+    store.add({"task": "Walk the dog"})
+
+    assert [item["id"] for item in store.page(None, query="buy")[0]] == [1, 2]
+    assert [item["id"] for item in store.page(None, query="BUY milk")[0]] == [1]
+    assert [item["id"] for item in store.page(None, query="skimmed")[0]] == [1]
+    assert [item["id"] for item in store.page(None, query="buy", completed=False)[0]] == [1]
+    assert store.page(None, query="!!")[0] == []
+
+    store.update(1, {"task": "Sell milk", "completed": True})
+    store.apply_batch([{"task": "Buy eggs"}], [], [2])
+    assert [item["id"] for item in store.page(None, query="buy")[0]] == [4]
+    assert store.indexes.by_completed == {True: {1}, False: {3, 4}}
+    assert "bread" not in store.indexes.postings
+
+    # Index and scan answer the same for every filter, a page at a time
+    store = make_store(40)
+    for todo_id in range(1, 41, 4):
+        store.update(todo_id, {"description": "urgent"})
+    for completed in (None, True, False):
+        for query in (None, "urgent", "task urgent"):
+            expected = [item for item in store.all()
+                        if (completed is None or item["completed"] == completed)
+                        and (query is None or "urgent" in item.get("description", ""))]
+            seen, after = [], None
+            while True:
+                items, after = store.page(3, after=after, completed=completed, query=query)
+                seen.extend(items)
+                if after is None:
+                    break
+            assert seen == expected
+
+
+def test_fragments_are_kept_until_their_todo_changes():
+    encoded = []
+
+    def encode(item):
+        encoded.append(item["id"])
+        return json.dumps(item).encode()
+
+    store = CompactTodoStore({1: {"id": 1, "task": "a"}, 2: {"id": 2, "task": "b"}, 3: {"id": 3, "task": "c"}})
+    assert store.fragments(encode) == [json.dumps(item).encode() for item in store.all()]
+    assert store.fragments(encode) == store.fragments(encode) and encoded == [1, 2, 3]
+
+    store.update(2, {"completed": True})
+    store.delete(3)
+    store.add({"task": "d"})
+    assert store.fragments(encode) == [json.dumps(item).encode() for item in store.all()]
+    assert encoded == [1, 2, 3, 2, 4]
+
+    # Another encoder doesn't get the first one's bytes
+    assert store.fragments(lambda item: b"x") == [b"x", b"x", b"x"]
@@ -0,0 +1,63 @@
+import pytest
+
+import server
+from benchmarks import handwritten_validate_todo, handwritten_validate_update
+from validation import TODO_FIELDS, Field, Validator, todo_validator, update_validator
+
+SAMPLES = [
+    None, [], "task", {}, {"id": 3},
+    {"task": "Buy milk"}, {"task": "Buy milk", "completed": True, "description": "2 litres", "tags": ["x"]},
+    {"task": 5}, {"task": ""}, {"task": " \t\n"}, {"task": " "},
+    {"task": "x" * 500}, {"task": "x" * 501}, {"task": "  " + "x" * 500 + "  "},
+    {"task": "ok", "completed": "yes"}, {"task": "ok", "completed": 1}, {"task": "ok", "completed": None},
+    {"task": "ok", "description": 7}, {"task": "ok", "description": "d" * 1000},
+    {"task": "ok", "description": "d" * 1001}, {"completed": False}, {"description": ""},
+    {"task": "", "completed": "no", "description": 1},
+]
+
+
+@pytest.mark.parametrize("data", SAMPLES)
+def test_compiled_validators_agree_with_the_handwritten_ones(data):
+    assert todo_validator.first_error(data) == handwritten_validate_todo(data)[1]
+    assert update_validator.first_error(data) == handwritten_validate_update(data)[1]
+    assert server.validate_todo_data(data) == handwritten_validate_todo(data)
+    assert server.validate_partial_todo_data(data) == handwritten_validate_update(data)
+
+
+def test_collecting_every_error():
+    data = {"task": "", "completed": "no", "description": 1}
+    assert todo_validator.errors(data) == ["Task cannot be empty or whitespace",
+                                           "Completed field must be a boolean (true/false)",
+                                           "Description must be a string"]
+    assert todo_validator.errors({"task": "ok"}) == [] and todo_validator.errors(5) == ["Todo must be a JSON object"]
+    assert update_validator.errors({}) == ["At least one field must be provided for update"]
+    assert update_validator.errors({"completed": 0}) == ["Completed field must be a boolean (true/false)"]
+
+
+def test_lists_are_validated_in_one_call():
+    assert todo_validator.first_error_each(SAMPLES) == [todo_validator.first_error(data) for data in SAMPLES]
+    assert update_validator.errors_each(SAMPLES) == [update_validator.errors(data) for data in SAMPLES]
+    assert todo_validator.first_error_each([]) == []
+
+
+def test_validators_follow_the_schema():
+    validator = Validator(TODO_FIELDS + (Field("note", str, required=True, not_blank=True, max_length=3,
+                                               label="Note"),))
+    assert validator.first_error({"task": "ok"}) == "Note field is required"
+    assert validator.errors({"task": "ok", "note": "long"}) == ["Note is too long (maximum 3 characters)"]
+    assert "def validate(items):" in validator.errors_each.source
+
+
+def test_batch_reports_every_problem_of_an_item():
+    error_message, _, item_errors = server.parse_batch({
+        "create": [{"task": "ok"}, {"task": " ", "completed": 1}],
+        "update": [{"id": 1}, {"completed": True}, {"id": 2, "task": "fine"}],
+        "delete": [3, "4"],
+    })
+    assert error_message is None
+    assert item_errors == {
+        "create": [[], ["Task cannot be empty or whitespace", "Completed field must be a boolean (true/false)"]],
+        "update": [["At least one field must be provided for update"],
+                   ["Update must be an object with a numeric id"], []],
+        "delete": [[], ["Delete must be a numeric id"]],
+    }
@@ -0,0 +1,151 @@
+import json
+import os
+
+from persistence import GroupCommitWriter, WriteAheadLog
+
+
+def make_log(tmp_path, todos, **options):
+    return WriteAheadLog(str(tmp_path / "todos.json.wal"),
+                         snapshot_provider=lambda: todos,
+                         export_path=str(tmp_path / "todos.json"),
+                         **options)
+
+
+def test_replay_applies_all_records(tmp_path):
+    log = make_log(tmp_path, {})
+    log.append([{"op": "add", "item": {"id": 1, "task": "Buy milk", "completed": False}}])
+    log.append([{"op": "add", "item": {"id": 2, "task": "Study Python", "completed": False}}])
+    log.append([{"op": "update", "id": 1, "fields": {"completed": True}}])
+    log.append([{"op": "delete", "id": 2}])
+    log.close()
+
+    recovered = make_log(tmp_path, {}).replay({})
+    assert recovered == {1: {"id": 1, "task": "Buy milk", "completed": True}}
+
+
+def test_replay_of_positional_records_assigns_ids(tmp_path):
+    # Logs written before todos had ids address them by list position
+    path = tmp_path / "todos.json.wal"
+    with open(path, "wb") as f:
+        f.write(b'{"op":"add","item":{"task":"Buy milk"}}\n')
+        f.write(b'{"op":"add","item":{"task":"Study Python"}}\n')
+        f.write(b'{"op":"add","item":{"task":"Exercise"}}\n')
+        f.write(b'{"op":"delete","index":0}\n')
+        f.write(b'{"op":"update","index":1,"fields":{"completed":true}}\n')
+
+    recovered = make_log(tmp_path, {}).replay({})
+    assert list(recovered.values()) == [
+        {"id": 2, "task": "Study Python"},
+        {"id": 3, "task": "Exercise", "completed": True},
+    ]
+
+
+def test_crash_mid_record_keeps_complete_records(tmp_path):
+    log = make_log(tmp_path, {})
+    for todo_id, name in enumerate(("Buy milk", "Study Python", "Exercise"), start=1):
+        log.append([{"op": "add", "item": {"id": todo_id, "task": name, "completed": False}}])
+    log.close()
+
+    # Simulate a crash that cut the last record in half
+    path = tmp_path / "todos.json.wal"
+    size = path.stat().st_size
+    with open(path, "r+b") as f:
+        f.truncate(size - 10)
+
+    log = make_log(tmp_path, {})
+    recovered = log.replay({})
+    assert [t["task"] for t in recovered.values()] == ["Buy milk", "Study Python"]
+
+    # The torn record is gone, so new appends produce a clean log
+    log.append([{"op": "add", "item": {"id": 4, "task": "Read a book", "completed": False}}])
+    log.close()
+    recovered = make_log(tmp_path, {}).replay({})
+    assert [t["task"] for t in recovered.values()] == ["Buy milk", "Study Python", "Read a book"]
+
+
+def test_corrupt_record_stops_replay(tmp_path):
+    path = tmp_path / "todos.json.wal"
+    with open(path, "wb") as f:
+        f.write(b'{"op":"add","item":{"id":1,"task":"Buy milk"}}\n')
+        f.write(b'{"op":"add","item":{"ta\n')
+        f.write(b'{"op":"add","item":{"id":3,"task":"Exercise"}}\n')
+
+    recovered = make_log(tmp_path, {}).replay({})
+    assert recovered == {1: {"id": 1, "task": "Buy milk"}}
+
+
+def test_compaction_writes_snapshot(tmp_path):
+    todo = {}
+    log = make_log(tmp_path, todo.values(), compact_every=5, fsync_policy="never")
+    for todo_id in range(1, 13):
+        todo[todo_id] = {"id": todo_id, "task": f"Task {todo_id}", "completed": False}
+        log.append([{"op": "add", "item": todo[todo_id]}])
+    log.close()
+
+    with open(tmp_path / "todos.json.wal", "rb") as f:
+        first = json.loads(f.readline())
+    assert first["op"] == "snapshot"
+
+    recovered = make_log(tmp_path, {}).replay({})
+    assert recovered == todo
+
+    # The exported file stays readable by the plain json mode
+    with open(tmp_path / "todos.json") as f:
+        exported = json.load(f)
+    assert exported == list(todo.values())[:len(exported)]
+
+
+def test_interval_fsync_policy(tmp_path):
+    log = make_log(tmp_path, {}, fsync_policy="interval", fsync_interval_ms=5)
+    log.append([{"op": "add", "item": {"id": 1, "task": "Buy milk"}}])
+    log.close()
+    assert os.path.getsize(tmp_path / "todos.json.wal") > 0
+
+
+def test_unknown_fsync_policy_is_rejected(tmp_path):
+    try:
+        make_log(tmp_path, {}, fsync_policy="sometimes")
+    except ValueError:
+        return
+    assert False, "Expected ValueError"
+
+
+def test_batch_is_one_record(tmp_path):
+    log = make_log(tmp_path, {})
+    log.append([{"op": "add", "item": {"id": 1, "task": "Buy milk"}},
+                {"op": "add", "item": {"id": 2, "task": "Study Python"}}])
+    log.close()
+
+    # A torn batch is dropped as a whole
+    path = tmp_path / "todos.json.wal"
+    assert len(path.read_bytes().splitlines()) == 1
+    with open(path, "r+b") as f:
+        f.truncate(path.stat().st_size - 5)
+    assert make_log(tmp_path, {}).replay({}) == {}
+
+
+def test_group_commit_coalesces_changes(tmp_path):
+    todo = []
+    writes = []
+    path = str(tmp_path / "todos.json")
+
+    def snapshot():
+        writes.append(len(todo))
+        return list(todo)
+
+    writer = GroupCommitWriter(path, snapshot, window_ms=50)
+    for i in range(20):
+        todo.append({"id": i + 1, "task": f"Task {i}"})
+        generation = writer.submit()
+    assert writer.flush(generation)
+    assert len(writes) < 20
+
+    with open(path) as f:
+        assert json.load(f) == todo
+
+    # Changes submitted right before close are drained, not dropped
+    todo.append({"id": 21, "task": "Last"})
+    writer.submit()
+    writer.close()
+    with open(path) as f:
+        assert json.load(f)[-1]["task"] == "Last"
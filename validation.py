@@ -0,0 +1,122 @@
+"""
+Validation of todos sent by clients, compiled from a declarative schema.
+
+TODO_FIELDS says what each field may hold. Validator turns it into plain
+Python functions once, at import: the checks for every field are written out
+as source and compiled, so validating a todo runs the same straight-line code
+a hand-written validator would, without looping over the schema or calling a
+function per check. Whitespace is never stripped just to be measured: a blank
+value is found with isspace(), and only a value over the length limit is
+stripped to see whether it really is.
+
+Every validator exists in four versions:
+  first_error(data)        the first problem found, or None (fail fast)
+  errors(data)             every problem found, [] if there is none
+  first_error_each(items)  first_error for every item of a list, in one pass
+  errors_each(items)       errors for every item of a list, in one pass
+"""
+from collections import namedtuple
+
+# name, Python type, required when creating a todo, whether a value of only
+# whitespace is refused, maximum length (None: any), whether whitespace around
+# the value doesn't count towards that length, and the name used in messages
+Field = namedtuple("Field", "name type required not_blank max_length strip label",
+                   defaults=(False, False, None, False, None))
+
+TODO_FIELDS = (
+    Field("task", str, required=True, not_blank=True, max_length=500, strip=True, label="Task"),
+    Field("completed", bool, label="Completed"),
+    Field("description", str, max_length=1000, label="Description"),
+)
+
+NOT_AN_OBJECT = "Todo must be a JSON object"
+NO_FIELDS = "At least one field must be provided for update"
+TYPE_MESSAGES = {
+    str: "{label} must be a string",
+    bool: "{label} field must be a boolean (true/false)",
+}
+
+
+def field_checks(field, required, fail):
+    """
+    Returns: source lines checking one field of the dict `data`, stopping at
+             its first problem; fail(message) gives the statement run for it
+    """
+    lines = [f"if {field.name!r} not in data:",
+             f"    {fail(f'{field.label} field is required')}" if required else "    pass",
+             f"elif not isinstance(value := data[{field.name!r}], {field.type.__name__}):",
+             f"    {fail(TYPE_MESSAGES[field.type].format(label=field.label))}"]
+    if field.not_blank:
+        lines += ["elif not value or value.isspace():",
+                  f"    {fail(f'{field.label} cannot be empty or whitespace')}"]
+    if field.max_length is not None:
+        too_long = f"len(value) > {field.max_length}"
+        if field.strip:
+            too_long += f" and len(value.strip()) > {field.max_length}"
+        lines += [f"elif {too_long}:",
+                  f"    {fail(f'{field.label} is too long (maximum {field.max_length} characters)')}"]
+    return lines
+
+
+def validator_source(fields, partial, collect, many):
+    """Returns: the source of one validator function (see the module docstring)"""
+    def fail(message):
+        if collect:
+            return f"errors.append({message!r})"
+        if many:
+            return f"append({message!r}); continue"
+        return f"return {message!r}"
+
+    body = []
+    if collect:
+        body.append("errors = []")
+    body += ["if not isinstance(data, dict):", f"    {fail(NOT_AN_OBJECT)}"]
+    if collect:
+        # Nothing else can be checked on something that isn't an object
+        body += ["else:"]
+        checks = []
+        if partial:
+            checks += ["if not data:", f"    {fail(NO_FIELDS)}"]
+        for field in fields:
+            checks += field_checks(field, field.required and not partial, fail)
+        body += ["    " + line for line in checks]
+        body.append("append(errors)" if many else "return errors")
+    else:
+        if partial:
+            body += ["if not data:", f"    {fail(NO_FIELDS)}"]
+        for field in fields:
+            body += field_checks(field, field.required and not partial, fail)
+        body.append("append(None)" if many else "return None")
+
+    if not many:
+        return "\n".join(["def validate(data):"] + ["    " + line for line in body])
+    return "\n".join(["def validate(items):", "    results = []", "    append = results.append",
+                      "    for data in items:"] + ["        " + line for line in body] + ["    return results"])
+
+
+class Validator:
+    """
+    The compiled validators for fields (see the module docstring).
+    partial is for updates: no field is required, but there must be at least one.
+    Fields not in the schema are allowed and not checked.
+    """
+
+    def __init__(self, fields, partial=False):
+        self.fields = tuple(fields)
+        self.partial = partial
+        self.first_error = self._compile(collect=False, many=False)
+        self.errors = self._compile(collect=True, many=False)
+        self.first_error_each = self._compile(collect=False, many=True)
+        self.errors_each = self._compile(collect=True, many=True)
+
+    def _compile(self, collect, many):
+        source = validator_source(self.fields, self.partial, collect, many)
+        namespace = {}
+        exec(compile(source, f"<validator {'/'.join(field.name for field in self.fields)}>", "exec"), namespace)
+        validate = namespace["validate"]
+        validate.source = source
+        return validate
+
+
+todo_validator = Validator(TODO_FIELDS)
+update_validator = Validator(TODO_FIELDS, partial=True)